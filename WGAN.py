@@ -4,6 +4,8 @@ from PIL import Image
 from config import cfg
 from utils import loadData
 from resnet50 import Resnet50
+from lightface import LightFace
+from telemetry import startup
 from ops import *
 
 epsilon = 1e-9
@@ -27,23 +29,38 @@ class WGAN(object):
     6. D的参数强制截断[-0.01,0.01], 注意是截断所有参数
     7. 两个网络的L2规则化
     """
-    def __init__(self):
+    def __init__(self, data_feed=None, face_model=None):
+        """
+        args:
+            data_feed: loadData object of the train set, a shuffled one by default.
+            face_model: face model object before 'build', by default the one
+                        of '--encoder' loaded from its npy file.
+        """
         self.graph = tf.Graph()
         with self.graph.as_default():
-            self.data_feed = loadData(batch_size=cfg.batch_size, train_shuffle=True) # False
+            self.data_feed = data_feed or loadData(batch_size=cfg.batch_size, train_shuffle=True) # False
             
             # Construct Template Model (G_enc) to encoder input face
             with tf.variable_scope('face_model'):
-                self.face_model = Resnet50() # Vgg16()
+                with startup.phase('weight_load'):
+                    if face_model is not None:
+                        self.face_model = face_model
+                    elif cfg.encoder == 'lightface':
+                        self.face_model = LightFace(cfg.student_model)
+                    else:
+                        self.face_model = Resnet50() # Vgg16()
                 self.face_model.build()
                 print('VGG model built successfully.')
             
             # Construct G_dec and D in 3 scale
             self.is_train = tf.placeholder(tf.bool, name='is_train')
             self.profile, self.front = self.data_feed.get_train()
+            self.queue_fill = self.data_feed.queue_fill
+            self.train_names = self.data_feed.train_names
             
             # Construct Model
-            self.build_arch()
+            with jit_scope():
+                self.build_arch()
             print('Model built successfully.')
             
             all_vars = tf.trainable_variables()
@@ -74,8 +91,9 @@ class WGAN(object):
         4. Feed generated image to Discriminator
         """
         # Use pretrained model(vgg-face) as encoder of Generator
-        self.feature_p = self.face_model.forward(self.profile,'profile_enc')
-        self.feature_f = self.face_model.forward(self.front, 'front_enc')
+        # Real images carry no gradient, they may run in reduced precision
+        self.feature_p = self.face_model.forward(self.profile,'profile_enc', cfg.enc_precision)
+        self.feature_f = self.face_model.forward(self.front, 'front_enc', cfg.enc_precision)
         print 'Face model output feature shape:', self.feature_p[-1].get_shape()
         
         # Decoder front face from vgg feature
@@ -184,18 +202,19 @@ class WGAN(object):
         return: 
             a set of and logits.
         """
+        if cfg.dis_type == 'shared':
+            return self.discriminator_shared(images, reuse)
         
         with tf.variable_scope("discriminator", reuse=reuse) as scope:
             norm = bn
             
             images = images / 127.5 - 1
-            bs = images.get_shape().as_list()[0]
             
             # Four Fixed Area. Modify them to fit your dataset
-            eyes = tf.slice(images, [0,64,50,0], [bs,36,124,cfg.channel]) #[64:100,50:174,:]
-            nose = tf.slice(images, [0,75,90,0], [bs,65,44,cfg.channel]) #[75:140,90:134,:]
-            mouth = tf.slice(images, [0,140,75,0], [bs,30,74,cfg.channel]) #[140:170,75:149,:]
-            face = tf.slice(images, [0,64,50,0], [bs,116,124,cfg.channel]) #[64:180,50:174,:]
+            eyes = tf.slice(images, [0,64,50,0], [-1,36,124,cfg.channel]) #[64:100,50:174,:]
+            nose = tf.slice(images, [0,75,90,0], [-1,65,44,cfg.channel]) #[75:140,90:134,:]
+            mouth = tf.slice(images, [0,140,75,0], [-1,30,74,cfg.channel]) #[140:170,75:149,:]
+            face = tf.slice(images, [0,64,50,0], [-1,116,124,cfg.channel]) #[64:180,50:174,:]
             with tf.variable_scope("images"):
                 with tf.variable_scope('d_conv0'):
                     h0_0 = lrelu(conv2d(images, 32, 'd_conv0', kernel_size=4, strides=2))
@@ -213,7 +232,7 @@ class WGAN(object):
                     h0_4 = lrelu(norm(conv2d(h0_3, 256, 'd_conv4', kernel_size=4, strides=2),self.is_train))
                 # h4 is (7 x 7 x 256)
                 with tf.variable_scope('d_fc'):
-                    h0_4 = tf.reshape(h0_4, [bs, -1])
+                    h0_4 = flatten(h0_4)
                     h0_5 = fullyConnect(h0_4, 1, 'd_fc')
                 # h5 is (1)
             with tf.variable_scope("eyes"):
@@ -230,7 +249,7 @@ class WGAN(object):
                     h1_3 = lrelu(norm(conv2d(h1_2, 256, 'd_conv3', kernel_size=4, strides=2),self.is_train))
                 # h3 is (3 x 8 x 256)
                 with tf.variable_scope('d_fc'):
-                    h1_3 = tf.reshape(h1_3, [bs, -1])
+                    h1_3 = flatten(h1_3)
                     h1_4 = fullyConnect(h1_3, 1, 'd_fc')
                 # h4 is (1)
             with tf.variable_scope("nose"):
@@ -247,7 +266,7 @@ class WGAN(object):
                     h2_3 = lrelu(norm(conv2d(h2_2, 256, 'd_conv3', kernel_size=4, strides=2),self.is_train))
                 # h3 is (5 x 3 x 256)
                 with tf.variable_scope('d_fc'):
-                    h2_3 = tf.reshape(h2_3, [bs, -1])
+                    h2_3 = flatten(h2_3)
                     h2_4 = fullyConnect(h2_3, 1, 'd_fc')
                 # h4 is (1)
             with tf.variable_scope("mouth"):
@@ -264,7 +283,7 @@ class WGAN(object):
                     h3_3 = lrelu(norm(conv2d(h3_2, 256, 'd_conv3', kernel_size=4, strides=2),self.is_train))
                 # h3 is (2 x 5 x 256)
                 with tf.variable_scope('d_fc'):
-                    h3_3 = tf.reshape(h3_3, [bs, -1])
+                    h3_3 = flatten(h3_3)
                     h3_4 = fullyConnect(h3_3, 1, 'd_fc')
                 # h4 is (1)
             with tf.variable_scope("face"):
@@ -281,12 +300,29 @@ class WGAN(object):
                     h4_3 = lrelu(norm(conv2d(h4_2, 256, 'd_conv3', kernel_size=4, strides=2),self.is_train))
                 # h3 is (8 x 8 x 256)
                 with tf.variable_scope('d_fc'):
-                    h4_3 = tf.reshape(h4_3, [bs, -1])
+                    h4_3 = flatten(h4_3)
                     h4_4 = fullyConnect(h4_3, 1, 'd_fc')
                 # h4 is (1)
             
             return h0_5, h1_4, h2_4, h3_4, h4_4
 
+    def discriminator_shared(self, images, reuse=False):
+        """Attention Discriminator Network with shared early layers
+        
+        Eyes and nose lie inside face, and face lies inside the whole image, 
+        so the early convolutions are computed once and the areas are 
+        cropped from the shared feature map (see 'shared_attention_dis').
+        Enabled by '--dis_type=shared'.
+        
+        args: 
+            image: front face in range [0,255].
+            reuse: Whether to reuse the model(Default False).
+        return: 
+            a set of and logits, in the same order as 'discriminator'.
+        """
+        with tf.variable_scope("discriminator", reuse=reuse) as scope:
+            return shared_attention_dis(images / 127.5 - 1, lambda x: bn(x, self.is_train))
+
     def loss(self):
         """Loss Functions
         
@@ -313,6 +349,8 @@ class WGAN(object):
                                cfg.w_f*(1 - tf.reduce_sum(tf.multiply(pool5_f_norm, pool5_gen_f_norm), [1]))
                 self.feature_loss = tf.reduce_mean(self.feature_distance) #/ 2 
                 tf.add_to_collection('losses', self.feature_loss)
+                # Identity similarity: pool5 cosine of the frontalized profile and the front
+                self.identity_sim = tf.reduce_mean(tf.reduce_sum(tf.multiply(pool5_f_norm, pool5_gen_p_norm), [1]))
             
             # 3. L2 Regulation Loss
             with tf.name_scope('Regularation_Loss'):
@@ -1,9 +1,13 @@
 #coding: utf-8
+import copy
 import tensorflow as tf
 from PIL import Image
 from config import cfg
 from utils import loadData
 from resnet50 import Resnet50
+from lightface import LightFace
+from telemetry import startup
+from schedule import progressive_resolutions
 from ops import *
 import tensorflow.contrib.slim as slim
 
@@ -29,50 +33,120 @@ class WGAN_GP(object):
     9. Ld:对抗损失 \ 梯度惩罚
     10. 损失比 L1:fea:gan:gp = 0.001:500:1:10, 其中P:F=0.5:0.5
     """
-    def __init__(self):
+    # Set on the copies built by 'build_stage'
+    is_stage = False
+    resolution = 224
+    
+    def __init__(self, data_feed=None, face_model=None):
+        """
+        args:
+            data_feed: loadData object of the train set, a shuffled one by default.
+            face_model: face model object before 'build', by default the one
+                        of '--encoder' loaded from its npy file.
+        """
         self.graph = tf.Graph()
         with self.graph.as_default():
             self.batch_size = cfg.batch_size
-            self.data_feed = loadData(batch_size=self.batch_size, train_shuffle=True) # False
+            self.data_feed = data_feed or loadData(batch_size=self.batch_size, train_shuffle=True) # False
             
             # Construct Template Model (G_enc) to encoder input face
             with tf.variable_scope('face_model'):
-                self.face_model = Resnet50() # Vgg16()
+                with startup.phase('weight_load'):
+                    if face_model is not None:
+                        self.face_model = face_model
+                    elif cfg.encoder == 'lightface':
+                        self.face_model = LightFace(cfg.student_model)
+                    else:
+                        self.face_model = Resnet50() # Vgg16()
                 self.face_model.build()
                 print('VGG model built successfully.')
             
             # Construct G_dec and D               
             self.is_train = tf.placeholder(tf.bool, name='is_train')
             self.profile, self.front = self.data_feed.get_train()
+            self.queue_fill = self.data_feed.queue_fill
+            self.train_names = self.data_feed.train_names
+            self.fade = tf.placeholder_with_default(1., [], 'fade')
+            # Importance weights of the profiles, see sampler.py
+            self.sample_weight = tf.placeholder_with_default(tf.ones(tf.shape(self.profile)[:1]), [None],
+                                                             'sample_weight')
             
             # Construct Model
-            self.build_arch()
+            with jit_scope():
+                self.build_arch()
             print('Model built successfully.')
             
-            all_vars = tf.trainable_variables()
-            self.vars_gen = [var for var in all_vars if var.name.startswith('decoder')]
-            self.vars_dis = [var for var in all_vars if var.name.startswith('discriminator')]
+            self._split_vars()
             self.loss()
-                           
-            #################DEBUG#######################
-            with tf.name_scope('Debug'):
-                grad1 = tf.gradients([self.feature_loss], [self.gen_p])[0]
-                self.grad1 = tf.reduce_mean(tf.sqrt(tf.reduce_sum(tf.square(grad1), [1,2,3])))
-                grad2 = tf.gradients([self.g_loss], [self.gen_p])[0]
-                self.grad2 = tf.reduce_mean(tf.sqrt(tf.reduce_sum(tf.square(grad2), [1,2,3])))
-                grad3 = tf.gradients([self.front_loss], [self.gen_f])[0]
-                self.grad3 = tf.reduce_mean(tf.sqrt(tf.reduce_sum(tf.square(grad3), [1,2,3])))
+            self._debug()
             # Summary
             self._summary()    
             
             # Trainer
             self.global_step = tf.Variable(0, name='global_step', trainable=False)
-            self.train_gen = tf.train.AdamOptimizer(cfg.lr, beta1=cfg.beta1, beta2=cfg.beta2).minimize(
-                             self.gen_loss,
-                             global_step=self.global_step, var_list=self.vars_gen)
-            self.train_dis = tf.train.AdamOptimizer(cfg.lr, beta1=cfg.beta1, beta2=cfg.beta2).minimize(
-                             self.dis_loss,
-                             global_step=self.global_step, var_list=self.vars_dis)
+            self._trainer()
+            
+            # Lower resolution stages of progressive training
+            self.stages = {}
+            for resolution in progressive_resolutions(cfg.progressive):
+                self.stages[resolution] = self.build_stage(resolution)
+    
+    def _split_vars(self):
+        all_vars = tf.trainable_variables()
+        self.vars_gen = [var for var in all_vars if var.name.startswith('decoder')]
+        self.vars_dis = [var for var in all_vars if var.name.startswith('discriminator')]
+    
+    def _debug(self):
+        #################DEBUG#######################
+        with tf.name_scope('Debug'):
+            grad1 = tf.gradients([self.feature_loss], [self.gen_p])[0]
+            self.grad1 = tf.reduce_mean(tf.sqrt(tf.reduce_sum(tf.square(grad1), [1,2,3])))
+            grad2 = tf.gradients([self.g_loss], [self.gen_p])[0]
+            self.grad2 = tf.reduce_mean(tf.sqrt(tf.reduce_sum(tf.square(grad2), [1,2,3])))
+            grad3 = tf.gradients([self.front_loss], [self.gen_f])[0]
+            self.grad3 = tf.reduce_mean(tf.sqrt(tf.reduce_sum(tf.square(grad3), [1,2,3])))
+    
+    def _trainer(self):
+        # Stages share the optimizers of the net, and so the Adam moments of shared variables
+        if not self.is_stage:
+            self.opt_gen = tf.train.AdamOptimizer(cfg.lr, beta1=cfg.beta1, beta2=cfg.beta2)
+            self.opt_dis = tf.train.AdamOptimizer(cfg.lr, beta1=cfg.beta1, beta2=cfg.beta2)
+        self.train_gen = self.opt_gen.minimize(self.gen_loss,
+                         global_step=self.global_step, var_list=self.vars_gen)
+        self.train_dis = self.opt_dis.minimize(self.dis_loss,
+                         global_step=self.global_step, var_list=self.vars_dis)
+    
+    def build_stage(self, resolution):
+        """Progressive training stage generating 'resolution' images
+        
+        The stage is a copy of the net with its own outputs, losses and
+        train ops. The decoder stops at the early exit of 'resolution' and
+        its output fades in from the upsampled exit below by 'self.fade'.
+        D sees the images and the face areas at 'resolution': the
+        convolutions are shared by all stages, the fully connected layers
+        depend on the resolution. Generated images are upsampled to 224 for
+        the face model.
+        
+        args:
+            resolution: 56, 112, or 224 for the fade-in of the full decoder.
+        return:
+            stage with the attributes used by the training loop.
+        """
+        stage = copy.copy(self)
+        stage.is_stage = True
+        stage.resolution = resolution
+        with tf.name_scope('stage%d' % resolution):
+            with jit_scope():
+                stage.build_arch()
+            # Only the variables of the stage are trained and regularized
+            stage._split_vars()
+            stage.vars_gen = used_vars([stage.gen_p, stage.gen_f], stage.vars_gen)
+            stage.vars_dis = used_vars(list(stage.dr + stage.df1 + stage.df2), stage.vars_dis)
+            stage.loss()
+            stage._debug()
+            stage._summary()
+            stage._trainer()
+        return stage
 
     def build_arch(self):
         """Build up architecture
@@ -83,46 +157,68 @@ class WGAN_GP(object):
         4. Feed generated image to Discriminator
         5. Construct 'Grade Penalty' for discriminator
         """
+        # Stages of progressive training share the variables of the net
+        reuse, reused = (tf.AUTO_REUSE, tf.AUTO_REUSE) if self.is_stage else (False, True)
+        size = [self.resolution, self.resolution]
+        upsample = lambda images: tf.image.resize_bilinear(images, [cfg.height, cfg.width])
+        
         # Use pretrained model(vgg-face) as encoder of Generator
-        self.feature_p = self.face_model.forward(self.profile,'profile_enc')
-        self.feature_f = self.face_model.forward(self.front, 'front_enc')
+        # Real images carry no gradient, they may run in reduced precision
+        self.feature_p = self.face_model.forward(self.profile,'profile_enc', cfg.enc_precision)
+        self.feature_f = self.face_model.forward(self.front, 'front_enc', cfg.enc_precision)
         print 'Face model output feature shape:', self.feature_p[-1].get_shape()
         
         # Decoder front face from vgg feature
-        self.gen_p = self.decoder(self.feature_p)
-        self.gen_f = self.decoder(self.feature_f, reuse=True)
+        self.exits_p, self.exits_f = ({}, {}) if cfg.exit_heads or self.is_stage else (None, None)
+        self.gen_p = self.decoder(self.feature_p, reuse=reuse, resolution=self.resolution, exits=self.exits_p)
+        self.gen_f = self.decoder(self.feature_f, reuse=reused, resolution=self.resolution, exits=self.exits_f)
+        if self.is_stage and self.resolution // 2 in self.exits_p:
+            fade_in = lambda gen, low: self.fade * gen + (1 - self.fade) * tf.image.resize_nearest_neighbor(low, size)
+            self.gen_p = fade_in(self.gen_p, self.exits_p[self.resolution // 2])
+            self.gen_f = fade_in(self.gen_f, self.exits_f[self.resolution // 2])
         print 'Generator output shape:', self.gen_p.get_shape()
         
         # Map texture into features again by VGG    
-        self.feature_gen_p = self.face_model.forward(self.gen_p,'profile_gen_enc')
-        self.feature_gen_f = self.face_model.forward(self.gen_f, 'front_gen_enc')
+        if self.resolution == 224:
+            self.front_r = self.front
+            self.feature_gen_p = self.face_model.forward(self.gen_p,'profile_gen_enc')
+            self.feature_gen_f = self.face_model.forward(self.gen_f, 'front_gen_enc')
+        else:
+            self.front_r = tf.image.resize_area(self.front, size)
+            self.feature_gen_p = self.face_model.forward(upsample(self.gen_p),'profile_gen_enc')
+            self.feature_gen_f = self.face_model.forward(upsample(self.gen_f), 'front_gen_enc')
         print 'Feature of Generated Image shape:', self.feature_gen_p[-1].get_shape()
         
         # Construct discriminator between generalized front face and ground truth
-        self.dr = self.discriminator(self.front)
-        self.df1 = self.discriminator(self.gen_p, reuse=True)
-        self.df2 = self.discriminator(self.gen_f, reuse=True)
+        self.dr = self.discriminator(self.front_r, reuse=reuse)
+        self.df1 = self.discriminator(self.gen_p, reuse=reused)
+        self.df2 = self.discriminator(self.gen_f, reuse=reused)
         
         # Gradient Penalty #
         with tf.name_scope('gp'):
-            alpha = tf.random_uniform((self.gen_p.get_shape().as_list()[0], 1, 1, 1),minval = 0., maxval = 1.,)
-            inter = self.front + alpha * (self.gen_p - self.front)
-            d = self.discriminator(inter, reuse=True)
+            alpha = tf.random_uniform([tf.shape(self.gen_p)[0], 1, 1, 1],minval = 0., maxval = 1.,)
+            inter = self.front_r + alpha * (self.gen_p - self.front_r)
+            d = self.discriminator(inter, reuse=reused)
             grad = tf.gradients([d], [inter])[0]
             slopes = tf.sqrt(tf.reduce_sum(tf.square(grad), [1,2,3]))
             self.gradient_penalty = tf.reduce_mean(tf.square(slopes - 1.))
             ######
             self.grad4 = tf.reduce_mean(slopes)
                 
-    def decoder(self, feature, reuse=False):
+    def decoder(self, feature, reuse=False, resolution=224, exits=None):
         """Decoder part of generator
         
         Embed pretrained face recognition model in Generator.
-        This part transforms feature to image. 
+        This part transforms feature to image. The 56 and 112 stages
+        have optional to-RGB heads (early exits), which are trained with
+        '--exit_heads'.
         
         args: 
             feature: face identity feature from pretrained face model.
             reuse: Whether to reuse the model(Default False).
+            resolution: 224, or 56/112 to stop at an early exit.
+            exits: dict filled with the early exit images by resolution,
+                   None to build no early exit.
         return: 
             generated front face, which value is in range [0, 255].
         """
@@ -171,10 +267,18 @@ class WGAN_GP(object):
                                         kernel_size=4, strides = 2),self.is_train,'norm4_2'))
             res4 = res_block(dconv4, 'res4',self.is_train, cfg.norm)
             #output shape: [56, 56, 64]
+            if resolution == 56:
+                return to_rgb(res4, 'exit56')
+            if exits is not None:
+                exits[56] = to_rgb(res4, 'exit56')
             with tf.variable_scope('dconv5'):
                 dconv5 = tf.nn.relu(norm(deconv2d(res4, 32, 'dconv5', kernel_size=4, strides = 2),self.is_train,'norm5'))
             res5 = res_block(dconv5, 'res5',self.is_train, cfg.norm)
             #input shape: [112, 112, 32]
+            if resolution == 112:
+                return to_rgb(res5, 'exit112')
+            if exits is not None:
+                exits[112] = to_rgb(res5, 'exit112')
             with tf.variable_scope('dconv6'):
                 dconv6 = tf.nn.relu(norm(deconv2d(res5, 32, 'dconv6', kernel_size=4, strides = 2),self.is_train,'norm6'))
             res6 = res_block(dconv6, 'res6',self.is_train, cfg.norm)
@@ -202,18 +306,19 @@ class WGAN_GP(object):
         return: 
             a set of and logits.
         """
+        if cfg.dis_type == 'shared':
+            return self.discriminator_shared(images, reuse)
         
         with tf.variable_scope("discriminator", reuse=reuse) as scope:
             norm = slim.layer_norm
             
             images = images / 127.5 - 1
-            bs = images.get_shape().as_list()[0]
+            resolution = images.get_shape().as_list()[1]
+            fc_scope = dis_fc_scope(resolution)
             
-            # Four Fixed Area. Modify them to fit your dataset
-            eyes = tf.slice(images, [0,64,50,0], [bs,36,124,cfg.channel]) #[64:100,50:174,:]
-            nose = tf.slice(images, [0,75,90,0], [bs,65,44,cfg.channel]) #[75:140,90:134,:]
-            mouth = tf.slice(images, [0,140,75,0], [bs,30,74,cfg.channel]) #[140:170,75:149,:]
-            face = tf.slice(images, [0,64,50,0], [bs,116,124,cfg.channel]) #[64:180,50:174,:]
+            # Four Fixed Area, scaled to the resolution. Modify FACE_REGIONS to fit your dataset
+            eyes, nose, mouth, face = [tf.slice(images, [0,top,left,0], [-1,height,width,cfg.channel])
+                                       for _, top, left, height, width in scaled_regions(resolution)]
             with tf.variable_scope("images"):
                 with tf.variable_scope('d_conv0'):
                     h0_0 = lrelu(conv2d(images, 32, 'd_conv0', kernel_size=4, strides=2))
@@ -230,8 +335,8 @@ class WGAN_GP(object):
                 with tf.variable_scope('d_conv4'):
                     h0_4 = lrelu(norm(conv2d(h0_3, 256, 'd_conv4', kernel_size=4, strides=2)))
                 # h4 is (7 x 7 x 256)
-                with tf.variable_scope('d_fc'):
-                    h0_4 = tf.reshape(h0_4, [bs, -1])
+                with tf.variable_scope(fc_scope):
+                    h0_4 = flatten(h0_4)
                     h0_5 = fullyConnect(h0_4, 1, 'd_fc')
                 # h5 is (1)
             with tf.variable_scope("eyes"):
@@ -247,8 +352,8 @@ class WGAN_GP(object):
                 with tf.variable_scope('d_conv3'):
                     h1_3 = lrelu(norm(conv2d(h1_2, 256, 'd_conv3', kernel_size=4, strides=2)))
                 # h3 is (3 x 8 x 256)
-                with tf.variable_scope('d_fc'):
-                    h1_3 = tf.reshape(h1_3, [bs, -1])
+                with tf.variable_scope(fc_scope):
+                    h1_3 = flatten(h1_3)
                     h1_4 = fullyConnect(h1_3, 1, 'd_fc')
                 # h4 is (1)
             with tf.variable_scope("nose"):
@@ -264,8 +369,8 @@ class WGAN_GP(object):
                 with tf.variable_scope('d_conv3'):
                     h2_3 = lrelu(norm(conv2d(h2_2, 256, 'd_conv3', kernel_size=4, strides=2)))
                 # h3 is (5 x 3 x 256)
-                with tf.variable_scope('d_fc'):
-                    h2_3 = tf.reshape(h2_3, [bs, -1])
+                with tf.variable_scope(fc_scope):
+                    h2_3 = flatten(h2_3)
                     h2_4 = fullyConnect(h2_3, 1, 'd_fc')
                 # h4 is (1)
             with tf.variable_scope("mouth"):
@@ -281,8 +386,8 @@ class WGAN_GP(object):
                 with tf.variable_scope('d_conv3'):
                     h3_3 = lrelu(norm(conv2d(h3_2, 256, 'd_conv3', kernel_size=4, strides=2)))
                 # h3 is (2 x 5 x 256)
-                with tf.variable_scope('d_fc'):
-                    h3_3 = tf.reshape(h3_3, [bs, -1])
+                with tf.variable_scope(fc_scope):
+                    h3_3 = flatten(h3_3)
                     h3_4 = fullyConnect(h3_3, 1, 'd_fc')
                 # h4 is (1)
             with tf.variable_scope("face"):
@@ -298,13 +403,30 @@ class WGAN_GP(object):
                 with tf.variable_scope('d_conv3'):
                     h4_3 = lrelu(norm(conv2d(h4_2, 256, 'd_conv3', kernel_size=4, strides=2)))
                 # h3 is (8 x 8 x 256)
-                with tf.variable_scope('d_fc'):
-                    h4_3 = tf.reshape(h4_3, [bs, -1])
+                with tf.variable_scope(fc_scope):
+                    h4_3 = flatten(h4_3)
                     h4_4 = fullyConnect(h4_3, 1, 'd_fc')
                 # h4 is (1)
             
             return h0_5, h1_4, h2_4, h3_4, h4_4
 
+    def discriminator_shared(self, images, reuse=False):
+        """Attention Discriminator Network with shared early layers
+        
+        Eyes and nose lie inside face, and face lies inside the whole image, 
+        so the early convolutions are computed once and the areas are 
+        cropped from the shared feature map (see 'shared_attention_dis').
+        Enabled by '--dis_type=shared'.
+        
+        args: 
+            image: front face in range [0,255].
+            reuse: Whether to reuse the model(Default False).
+        return: 
+            a set of and logits, in the same order as 'discriminator'.
+        """
+        with tf.variable_scope("discriminator", reuse=reuse) as scope:
+            return shared_attention_dis(images / 127.5 - 1, slim.layer_norm)
+
     def loss(self):
         """Loss Functions
         
@@ -315,6 +437,7 @@ class WGAN_GP(object):
         5. Symmetric Loss: NOT APPLY
         6. Drift Loss: NOT APPLY
         7. Grade Penalty Loss: Grade penalty for Discriminator
+        8. Early Exit Loss: L1 of the early exits, with '--exit_heads'
         """
         with tf.name_scope('loss') as scope:
             with tf.name_scope('FeatureNorm'):
@@ -324,14 +447,19 @@ class WGAN_GP(object):
                 pool5_gen_f_norm = self.feature_gen_f[-1] / (tf.norm(self.feature_gen_f[-1], axis=1,keep_dims=True) + epsilon)
                         
             # 1. Frontalization Loss: L1-Norm
-            self.front_loss = tf.reduce_mean(tf.reduce_sum(tf.abs(self.front/255. - self.gen_f/255.), [1,2,3]))
+            self.front_loss = tf.reduce_mean(tf.reduce_sum(tf.abs(self.front_r/255. - self.gen_f/255.), [1,2,3]))
           
             # 2. Feature Loss: Cosine-Norm / L2-Norm
             with tf.name_scope('Perceptual_Loss'):
-                self.feature_distance = (1-cfg.w_f)*(1 - tf.reduce_sum(tf.multiply(pool5_p_norm, pool5_gen_p_norm), [1])) + \
-                               cfg.w_f*(1 - tf.reduce_sum(tf.multiply(pool5_f_norm, pool5_gen_f_norm), [1]))
-                self.feature_loss = tf.reduce_mean(self.feature_distance) #/ 2 
+                # Per-example distance of the profile term, the one drawn by the sampler and weighted
+                self.profile_distance = 1 - tf.reduce_sum(tf.multiply(pool5_p_norm, pool5_gen_p_norm), [1])
+                front_distance = 1 - tf.reduce_sum(tf.multiply(pool5_f_norm, pool5_gen_f_norm), [1])
+                self.feature_distance = (1-cfg.w_f)*self.profile_distance + cfg.w_f*front_distance
+                self.feature_loss = tf.reduce_mean((1-cfg.w_f)*self.sample_weight*self.profile_distance + \
+                                                   cfg.w_f*front_distance) #/ 2 
                 tf.add_to_collection('losses', self.feature_loss)
+                # Identity similarity: pool5 cosine of the frontalized profile and the front
+                self.identity_sim = tf.reduce_mean(tf.reduce_sum(tf.multiply(pool5_f_norm, pool5_gen_p_norm), [1]))
             
             # 3. L2 Regulation Loss
             with tf.name_scope('Regularation_Loss'):
@@ -349,7 +477,8 @@ class WGAN_GP(object):
             # 4. Adversarial Loss
             with tf.name_scope('Adversarial_Loss'):
                 self.d_loss = tf.reduce_mean(tf.add_n(self.df1)*(1-cfg.w_f) + tf.add_n(self.df2)*cfg.w_f - tf.add_n(self.dr)) / 5
-                self.g_loss = - tf.reduce_mean(tf.add_n(self.df1)*(1-cfg.w_f) + tf.add_n(self.df2)*cfg.w_f) / 5
+                weight = tf.expand_dims(self.sample_weight, 1)
+                self.g_loss = - tf.reduce_mean(tf.add_n(self.df1)*weight*(1-cfg.w_f) + tf.add_n(self.df2)*cfg.w_f) / 5
                 tf.add_to_collection('losses', self.d_loss)
                 tf.add_to_collection('losses', self.g_loss)
             
@@ -363,10 +492,24 @@ class WGAN_GP(object):
                 self.drift_loss = 0
                 #tf.reduce_mean(tf.add_n(tf.square(self.df)) + tf.add_n(tf.square(self.dr))) / 10
             
-            # 7. Total Loss
+            # 7. Early Exit Loss: front-to-front against the downsampled front,
+            # profile-to-front against the downsampled 224 output
+            self.exit_loss = 0
+            if cfg.exit_heads:
+                with tf.name_scope('Exit_Loss'):
+                    exit_losses = []
+                    for size in sorted(self.exits_f):
+                        front = tf.image.resize_area(self.front, [size, size])
+                        gen_p = tf.stop_gradient(tf.image.resize_area(self.gen_p, [size, size]))
+                        loss_f = tf.reduce_mean(tf.reduce_sum(tf.abs(front/255. - self.exits_f[size]/255.), [1,2,3]))
+                        loss_p = tf.reduce_mean(tf.reduce_sum(tf.abs(gen_p/255. - self.exits_p[size]/255.), [1,2,3]))
+                        exit_losses.append(cfg.w_f*loss_f + (1-cfg.w_f)*loss_p)
+                    self.exit_loss = tf.add_n(exit_losses)
+            
+            # 8. Total Loss
             with tf.name_scope('Total_Loss'):  #
                 self.gen_loss = cfg.lambda_l1 * self.front_loss + cfg.lambda_fea * self.feature_loss + \
-                                cfg.lambda_gan * self.g_loss + self.reg_gen
+                                cfg.lambda_gan * self.g_loss + cfg.lambda_exit * self.exit_loss + self.reg_gen
                 self.dis_loss = cfg.lambda_gan * self.d_loss + cfg.lambda_gp * self.gradient_penalty + \
                                 self.reg_dis
                 
@@ -0,0 +1,120 @@
+#coding: utf-8
+import os
+import sys
+import json
+import subprocess
+import numpy as np
+import tensorflow as tf
+from config import cfg, session_config
+from checkpoint import initialize
+from benchmark import GAN, peak_memory_op, peak_memory
+from cost_model import build_shapes
+
+# Flags that change the memory of a training step
+PROBE_FLAGS = ['encoder', 'enc_precision', 'dis_type', 'norm', 'xla', 'grappler', 'height', 'width']
+
+# Errors of a probe process that ran out of memory outside the session run
+OOM_MARKERS = ['ResourceExhausted', 'OOM when allocating', 'out of memory', 'MemoryError', 'std::bad_alloc']
+
+def probe_key(gan):
+    """Setting a probed batch size is valid for"""
+    return ','.join(['gan=%s' % gan, 'budget=%d' % cfg.memory_budget] +
+                    ['%s=%s' % (flag, getattr(cfg, flag)) for flag in PROBE_FLAGS])
+
+def probe_path():
+    return os.path.join(cfg.results, 'batch_probe.json')
+
+def load_batch_size(gan):
+    """Probed batch size of the current setting, None if it was not probed"""
+    if not os.path.exists(probe_path()):
+        return None
+    with open(probe_path()) as f:
+        result = json.load(f).get(probe_key(gan))
+    return result['batch_size'] if result else None
+
+def try_batch():
+    """Run D and G steps at '--batch_size' and print the peak memory
+
+    Runs in a child process, so every batch size starts from a fresh
+    allocator and RSS.
+    """
+    net = build_shapes(GAN[cfg.bench_gan])
+    shape = [cfg.batch_size, cfg.height, cfg.width, cfg.channel]
+    feed = {net.profile: np.random.uniform(0, 255, shape).astype(np.float32),
+            net.front: np.random.uniform(0, 255, shape).astype(np.float32),
+            net.is_train: True}
+    with net.graph.as_default():
+        memory_op = peak_memory_op()
+    result = {'batch_size': cfg.batch_size, 'fits': True}
+    try:
+        with tf.Session(config=session_config(), graph=net.graph) as sess:
+            initialize(sess)
+            for i in range(2):
+                sess.run(net.train_dis, feed)
+                sess.run(net.train_gen, feed)
+            result['peak_mb'] = peak_memory(sess, memory_op)
+    except tf.errors.ResourceExhaustedError:
+        result['fits'] = False
+    print('PROBE %s' % json.dumps(result))
+
+def fits(batch_size, peaks):
+    """Whether a batch size runs within '--memory_budget' (MB)"""
+    command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + \
+              ['--batch_size=%d' % batch_size, '--probe_try=True']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = [out.decode('utf-8', 'replace') for out in process.communicate()]
+    result = None
+    for line in output.splitlines():
+        if line.startswith('PROBE '):
+            result = json.loads(line[len('PROBE '):])
+    if result is None:
+        # Killed by a signal (e.g. the OOM killer) or failed allocating: did not fit
+        if process.returncode < 0 or any(marker in errors for marker in OOM_MARKERS):
+            print('Batch %d: out of memory (exit code %d)' % (batch_size, process.returncode))
+            return False
+        # Any other failure would make the search converge on a wrong batch size
+        raise RuntimeError('Probe of batch %d failed with exit code %d:\n%s' %
+                           (batch_size, process.returncode, '\n'.join(errors.splitlines()[-20:])))
+    if not result['fits']:
+        print('Batch %d: out of memory' % batch_size)
+        return False
+    peaks[str(batch_size)] = result['peak_mb']
+    print('Batch %d: peak %.0f MB of %d MB' % (batch_size, result['peak_mb'], cfg.memory_budget))
+    return result['peak_mb'] <= cfg.memory_budget
+
+def search():
+    """Largest batch size within the budget: doubling, then binary search"""
+    peaks = {}
+    low, high = 0, 1
+    while high <= cfg.probe_max and fits(high, peaks):
+        low, high = high, high * 2
+    high = min(high, cfg.probe_max + 1)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(middle, peaks):
+            low = middle
+        else:
+            high = middle
+    return low, peaks
+
+def main(_):
+    if cfg.probe_try:
+        return try_batch()
+    if not os.path.exists(cfg.results):
+        os.mkdir(cfg.results)
+    batch_size, peaks = search()
+    if batch_size == 0:
+        print('Batch size 1 does not fit in %d MB' % cfg.memory_budget)
+        return
+    print('Largest batch size within %d MB: %d' % (cfg.memory_budget, batch_size))
+
+    results = {}
+    if os.path.exists(probe_path()):
+        with open(probe_path()) as f:
+            results = json.load(f)
+    results[probe_key(cfg.bench_gan)] = {'batch_size': batch_size, 'peak_mb': peaks}
+    with open(probe_path(), 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    tf.app.run()
@@ -0,0 +1,325 @@
+#coding: utf-8
+import os
+import json
+import time
+import resource
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from tensorflow.python.framework import ops as tf_ops
+from config import cfg, session_config
+from checkpoint import initialize
+from utils import loadData, decode_crop_jpeg
+from loader import decode_image
+from resnet50 import resnet50_layout
+from inference import build_frontalizer
+from WGAN_GP import WGAN_GP
+from WGAN import WGAN
+from LSGAN import LSGAN
+
+GAN = {'WGAN_GP': WGAN_GP, 'WGAN': WGAN, 'LSGAN': LSGAN}
+
+def graph_flops(graph, prefix=''):
+    """Count FLOPs of the ops whose name starts with 'prefix'
+
+    Statistics registered by TensorFlow are used (Conv2D, MatMul, ...), ops
+    without statistics or with unknown shapes count as zero.
+
+    return:
+        forward FLOPs, backward FLOPs (ops under 'gradients')
+    """
+    forward, backward = 0, 0
+    for op in graph.get_operations():
+        name = op.name.split('/', 1)[-1] if op.name.startswith('gradients') else op.name
+        if not name.startswith(prefix):
+            continue
+        try:
+            flops = tf_ops.get_stats_for_node_def(graph, op.node_def, 'flops').value or 0
+        except ValueError:
+            flops = 0
+        if op.name.startswith('gradients'):
+            backward += flops
+        else:
+            forward += flops
+    return forward, backward
+
+def time_run(sess, fetches, feed=None, iters=None):
+    """Time sess.run of fetches
+
+    return:
+        seconds of the first run (graph setup and autotuning included) and
+        mean seconds of the following 'iters' runs
+    """
+    iters = iters or cfg.bench_iters
+    start = time.time()
+    sess.run(fetches, feed)
+    first = time.time() - start
+    start = time.time()
+    for i in range(iters):
+        sess.run(fetches, feed)
+    return first, (time.time() - start) / iters
+
+def peak_memory_op():
+    """Peak bytes of the GPU allocator, None when running on CPU"""
+    if not tf.test.is_gpu_available():
+        return None
+    with tf.device('/gpu:0'):
+        return tf.contrib.memory_stats.MaxBytesInUse()
+
+def peak_memory(sess, op=None):
+    """Peak memory in MB: GPU allocator if 'op' is given, else process RSS"""
+    if op is not None:
+        return sess.run(op) / 2.**20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2.**10
+
+def bench_dis():
+    """Compare the attention discriminator with the shared-trunk one
+
+    Each variant is built alone on random images, with the gradient penalty
+    of WGAN_GP, and a D step (forward, penalty and Adam update) is timed.
+    """
+    results = {}
+    dis_type = cfg.dis_type
+    shape = [cfg.batch_size, cfg.height, cfg.width, cfg.channel]
+    images = np.random.uniform(0, 255, shape).astype(np.float32)
+    for name in ['attention', 'shared']:
+        cfg.dis_type = name
+        graph = tf.Graph()
+        with graph.as_default():
+            net = GAN[cfg.bench_gan].__new__(GAN[cfg.bench_gan])
+            net.is_train = tf.constant(True)
+            x = tf.placeholder(tf.float32, shape, 'images')
+            logits = net.discriminator(x)
+            with tf.name_scope('gp'):
+                grad = tf.gradients([logits], [x])[0]
+                slopes = tf.sqrt(tf.reduce_sum(tf.square(grad), [1,2,3]))
+                loss = tf.reduce_mean(tf.add_n(logits)) + tf.reduce_mean(tf.square(slopes - 1.))
+            train = tf.train.AdamOptimizer(cfg.lr).minimize(loss)
+            forward, _ = graph_flops(graph, 'discriminator')
+            params = sum(np.prod(var.get_shape().as_list()) for var in tf.trainable_variables())
+            with tf.Session(config=session_config(), graph=graph) as sess:
+                initialize(sess)
+                _, step = time_run(sess, train, {x: images})
+        results[name] = {'forward_gflops': forward / 1e9, 'params': int(params), 'd_step_ms': 1000 * step}
+        print('%s discriminator: %.2f GFLOPs forward, %d params, %.1f ms per D step' %
+              (name, forward / 1e9, params, 1000 * step))
+    cfg.dis_type = dis_type
+    return results
+
+def make_synthetic(root):
+    """Write a synthetic dataset and a random-weight face model to 'root'
+
+    '--synthetic_num' JPEG images of the original size (smooth random
+    colours) with profile, front and test lists in the format of loadData,
+    and 'resnet50.npy' with the key and shape layout Resnet50.build expects.
+    Existing files are kept.
+    """
+    images = os.path.join(root, 'images')
+    if not os.path.exists(images):
+        os.makedirs(images)
+    names = ['%05d.jpg' % i for i in range(max(cfg.synthetic_num, 2))]
+    rng = np.random.RandomState(0)
+    for name in names:
+        if not os.path.exists(os.path.join(images, name)):
+            low = rng.uniform(0, 255, [8, 8, 3]).astype(np.uint8)
+            image = Image.fromarray(low).resize((cfg.ori_width, cfg.ori_height), Image.BILINEAR)
+            image.save(os.path.join(images, name), quality=90)
+    for list_name in ['profile.txt', 'front.txt', 'test.txt']:
+        with open(os.path.join(root, list_name), 'w') as f:
+            f.write('\n'.join(names) + '\n')
+    npy = os.path.join(root, 'resnet50.npy')
+    if not os.path.exists(npy):
+        np.save(npy, resnet50_layout(lambda shape: rng.normal(0, 0.01, shape)))
+
+def use_synthetic():
+    """Point the data and face model flags to the synthetic files"""
+    root = cfg.synthetic_dir
+    make_synthetic(root)
+    cfg.profile_path = cfg.front_path = cfg.test_path = os.path.join(root, 'images')
+    cfg.profile_list = cfg.gt_list = os.path.join(root, 'profile.txt')
+    cfg.front_list = os.path.join(root, 'front.txt')
+    cfg.test_list = os.path.join(root, 'test.txt')
+    cfg.face_model = os.path.join(root, 'resnet50.npy')
+
+def bench_data():
+    """Images per second of the input paths of loadData"""
+    data_feed = loadData(batch_size=cfg.batch_size)
+    results = {}
+    graph = tf.Graph()
+    with graph.as_default():
+        profile, front = data_feed.get_train()
+        with tf.Session(config=session_config(), graph=graph) as sess:
+            initialize(sess)
+            coord = tf.train.Coordinator()
+            threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+            _, step = time_run(sess, [profile, front])
+            coord.request_stop()
+            coord.join(threads)
+    results['get_train'] = 2 * cfg.batch_size / step
+    for name, get_batch in [('get_train_batch', data_feed.get_train_batch),
+                            ('get_test_batch', lambda: data_feed.get_test_batch(cfg.batch_size))]:
+        start = time.time()
+        for i in range(cfg.bench_iters):
+            get_batch()
+        results[name] = 2 * cfg.batch_size * cfg.bench_iters / (time.time() - start)
+    for name, speed in results.items():
+        print('%s: %.1f images/s' % (name, speed))
+    results = dict(('%s_images_per_s' % name, speed) for name, speed in results.items())
+    results['cache'] = data_feed.cache_stats()
+    print('Decoded image cache: %s' % json.dumps(results['cache'], sort_keys=True))
+    return results
+
+def bench_decode():
+    """Decode throughput of full decoding then cropping against crop-aware decoding
+
+    In-graph: decode_jpeg + crop_to_bounding_box against decode_crop_jpeg.
+    PIL: full decode + crop against loader.decode_image (draft decoding
+    of larger sources). Images are the first ones of the profile list.
+    """
+    names = np.loadtxt(cfg.profile_list, dtype='string', delimiter=',')[:cfg.bench_iters]
+    paths = [cfg.profile_path + '/' + name for name in names]
+    contents = [open(path, 'rb').read() for path in paths]
+    box = [(cfg.ori_width - cfg.width) // 2, (cfg.ori_height - cfg.height) // 2,
+           (cfg.ori_width + cfg.width) // 2, (cfg.ori_height + cfg.height) // 2]
+
+    graph = tf.Graph()
+    with graph.as_default():
+        jpeg = tf.placeholder(tf.string, [])
+        full = tf.image.decode_jpeg(jpeg, channels=cfg.channel)
+        full = tf.image.crop_to_bounding_box(full, box[1], box[0], cfg.height, cfg.width)
+        crop = decode_crop_jpeg(jpeg, False)
+    results = {}
+    with tf.Session(config=session_config(), graph=graph) as sess:
+        for name, image in [('tf_full', full), ('tf_crop', crop)]:
+            sess.run(image, {jpeg: contents[0]})
+            start = time.time()
+            for content in contents:
+                sess.run(image, {jpeg: content})
+            results[name] = len(contents) / (time.time() - start)
+    for name, decode in [('pil_full', lambda path: np.asarray(Image.open(path).crop(box), np.uint8)),
+                         ('pil_draft', lambda path: decode_image(path, False, box))]:
+        start = time.time()
+        for path in paths:
+            decode(path)
+        results[name] = len(paths) / (time.time() - start)
+    for name, speed in sorted(results.items()):
+        print('%s: %.1f images/s' % (name, speed))
+    return dict(('%s_images_per_s' % name, speed) for name, speed in results.items())
+
+def bench_model():
+    """Latency of the face model forward, the decoder and the discriminator
+
+    Each part is timed alone at '--batch_size': the decoder is fed with
+    features and the discriminator with images.
+    """
+    net = build_frontalizer(GAN[cfg.bench_gan], cfg.batch_size)
+    shape = [cfg.batch_size, cfg.height, cfg.width, cfg.channel]
+    images = np.random.uniform(0, 255, shape).astype(np.float32)
+    with net.graph.as_default():
+        logits = net.discriminator(net.profile)
+        with tf.Session(config=session_config(), graph=net.graph) as sess:
+            initialize(sess)
+            features = sess.run(net.feature_p, {net.profile: images})
+            parts = {'forward': (net.feature_p, {net.profile: images}),
+                     'decoder': (net.gen_p, dict(zip(net.feature_p, features))),
+                     'discriminator': (logits, {net.profile: images})}
+            results = {}
+            for name, (fetches, feed) in parts.items():
+                _, step = time_run(sess, fetches, feed)
+                results['%s_ms' % name] = 1000 * step
+                print('%s: %.1f ms' % (name, 1000 * step))
+    return results
+
+def bench_exits():
+    """Latency of the frontalizer stopped at each exit of the WGAN_GP decoder
+
+    The decoder is timed alone on face model features and with the face
+    model, at '--batch_size' and with random weights.
+    """
+    shape = [cfg.batch_size, cfg.height, cfg.width, cfg.channel]
+    images = np.random.uniform(0, 255, shape).astype(np.float32)
+    results = {}
+    for resolution in [56, 112, 224]:
+        net = build_frontalizer(batch_size=cfg.batch_size, resolution=resolution)
+        with tf.Session(config=session_config(), graph=net.graph) as sess:
+            with net.graph.as_default():
+                initialize(sess)
+            features = sess.run(net.feature_p, {net.profile: images})
+            _, decoder = time_run(sess, net.gen_p, dict(zip(net.feature_p, features)))
+            _, total = time_run(sess, net.gen_p, {net.profile: images})
+        results['exit%d_decoder_ms' % resolution] = 1000 * decoder
+        results['exit%d_total_ms' % resolution] = 1000 * total
+        print('exit %d: decoder %.1f ms, with the face model %.1f ms' % (resolution, 1000 * decoder, 1000 * total))
+    return results
+
+def time_steps(net_cls):
+    """Build a GAN and time its D step and G step"""
+    start = time.time()
+    net = net_cls()
+    build = time.time() - start
+    with net.graph.as_default():
+        memory_op = peak_memory_op()
+    with tf.Session(config=session_config(), graph=net.graph) as sess:
+        initialize(sess)
+        coord = tf.train.Coordinator()
+        threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+        d_first, d_step = time_run(sess, net.train_dis, {net.is_train: True})
+        g_first, g_step = time_run(sess, net.train_gen, {net.is_train: True})
+        memory = peak_memory(sess, memory_op)
+        coord.request_stop()
+        coord.join(threads)
+    return {'build_s': build, 'd_compile_s': d_first - d_step, 'g_compile_s': g_first - g_step,
+            'd_step_ms': 1000 * d_step, 'g_step_ms': 1000 * g_step, 'peak_memory_mb': memory,
+            'images_per_s': cfg.batch_size / (cfg.critic * d_step + g_step)}
+
+def bench_step():
+    """Time the D step and the G step of a GAN under the current session setting
+
+    The first run of each step includes graph optimization and XLA
+    compilation, so 'compile_s' is the first run minus a steady-state step.
+    Results are keyed by the XLA / Grappler setting; run once per setting
+    (e.g. --xla=scoped --grappler=layout,remapper) to fill the comparison.
+    """
+    key = 'xla=%s,grappler=%s,bs=%d' % (cfg.xla, cfg.grappler, cfg.batch_size)
+    result = time_steps(GAN[cfg.bench_gan])
+    print('%s: %s' % (key, json.dumps(result, sort_keys=True)))
+    return {key: result}
+
+def bench_suite():
+    """Input, model and step benchmarks, keyed by the session setting
+
+    Steps are timed for every GAN class at each of '--bench_batches'.
+    Use '--synthetic' to run without the datasets and the face model.
+    """
+    batch_size = cfg.batch_size
+    result = {'data': bench_data(), 'decode': bench_decode(), 'model': bench_model(), 'steps': {}}
+    for name in sorted(GAN):
+        for size in [int(size) for size in cfg.bench_batches.split(',')]:
+            cfg.batch_size = size
+            result['steps']['%s,bs=%d' % (name, size)] = time_steps(GAN[name])
+            print('%s, batch %d: %s' % (name, size, json.dumps(result['steps']['%s,bs=%d' % (name, size)],
+                                                               sort_keys=True)))
+    cfg.batch_size = batch_size
+    key = 'xla=%s,grappler=%s,synthetic=%s' % (cfg.xla, cfg.grappler, cfg.synthetic)
+    return {key: result}
+
+BENCHES = {'dis': bench_dis, 'step': bench_step, 'suite': bench_suite, 'decode': bench_decode,
+           'exits': bench_exits}
+
+def main(_):
+    if not os.path.exists(cfg.results):
+        os.mkdir(cfg.results)
+    if cfg.synthetic:
+        use_synthetic()
+    # Results of earlier runs are kept, so settings can be compared
+    path = os.path.join(cfg.results, 'bench_%s_%s.json' % (cfg.bench, cfg.bench_gan))
+    results = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            results = json.load(f)
+    results.update(BENCHES[cfg.bench]())
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    tf.app.run()
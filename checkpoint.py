@@ -0,0 +1,338 @@
+#coding: utf-8
+import os
+import glob
+import json
+import time
+import weakref
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.training import saver as saver_lib
+from config import cfg
+
+# Initial values of the variables of 'fed_variable', per graph
+_init_values = weakref.WeakKeyDictionary()
+
+def fed_variable(value, name, source, dtype=None, shape=None, **kwargs):
+    """Variable whose initial value is fed to its initializer
+
+    The value stays out of the graph, so the frozen face model and the data
+    lists are not copied into the GraphDef or an exported MetaGraph. The
+    placeholder of the value is listed in the 'init_values' collection and
+    its 'source' in 'init_sources', so an imported graph can get the values
+    again with 'load_init_values'.
+
+    args:
+        value: initial value (array or list).
+        source: '<npy path>:<layer>/<key>' of a model file, or a name given
+                to 'load_init_values' (e.g. 'profile_list').
+        dtype, shape: of the placeholder, those of 'value' if None. None
+                      dimensions give a variable of unknown shape.
+        kwargs: passed to tf.Variable.
+    """
+    if dtype is None:
+        value = np.asarray(value)
+        dtype, shape = tf.as_dtype(value.dtype), value.shape
+    init = tf.placeholder(dtype, shape, name + '_init')
+    tf.add_to_collection('init_values', init)
+    tf.add_to_collection('init_sources', source)
+    _init_values.setdefault(init.graph, {})[init.name] = value
+    return tf.Variable(init, name=name, validate_shape=tf.TensorShape(shape).is_fully_defined(), **kwargs)
+
+def init_feed(graph):
+    """Feed of the initial values of 'fed_variable' for the initializers"""
+    values = _init_values.get(graph, {})
+    return dict((graph.get_tensor_by_name(name), value) for name, value in values.items())
+
+def load_init_values(graph, named):
+    """Get the initial values of an imported graph from their sources
+
+    args:
+        named: dict of the values of named sources (e.g. the data lists).
+    """
+    models, values = {}, {}
+    for init, source in zip(graph.get_collection('init_values'), graph.get_collection('init_sources')):
+        if not isinstance(source, str):
+            source = source.decode('utf-8')
+        if source in named:
+            values[init.name] = named[source]
+            continue
+        path, key = source.rsplit(':', 1)
+        if path not in models:
+            models[path] = np.load(path, encoding='latin1').item()
+        layer, param = key.split('/')
+        values[init.name] = models[path][layer][param]
+    _init_values[graph] = values
+
+def initialize(sess):
+    """Initialize the global and local variables of the session graph"""
+    with sess.graph.as_default():
+        sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()],
+                 init_feed(sess.graph))
+
+class HalfSaveable(saver_lib.BaseSaverBuilder.SaveableObject):
+    """Store a float32 variable as float16 and restore it back to float32"""
+    def __init__(self, var, name):
+        tensor = tf.cast(var, tf.float16)
+        spec = saver_lib.BaseSaverBuilder.SaveSpec(tensor, '', name)
+        super(HalfSaveable, self).__init__(var, [spec], name)
+
+    def restore(self, restored_tensors, restored_shapes):
+        return tf.assign(self.op, tf.cast(restored_tensors[0], self.op.dtype.base_dtype))
+
+def is_optimizer_var(name):
+    """Adam slots ('<var>/Adam', '<var>/Adam_1') and beta powers"""
+    return name.split('/')[-1].startswith('Adam') or name.startswith('beta1_power') or \
+           name.startswith('beta2_power')
+
+def checkpoint_vars(graph, scope='all', optimizer=True):
+    """Variables stored in a checkpoint
+
+    The frozen face model is never stored, it is restored from its npy file.
+
+    args:
+        scope: 'all' for decoder, discriminator and global step, or the
+               name of one scope (e.g. 'decoder').
+        optimizer: whether to include the optimizer slots.
+    """
+    prefixes = ('decoder/', 'discriminator/') if scope == 'all' else (scope + '/',)
+    var_list = []
+    for var in graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES):
+        name = var.op.name
+        if is_optimizer_var(name):
+            if not optimizer:
+                continue
+            # Beta powers are shared by all variables of an optimizer
+            if name.startswith('beta') and scope == 'all':
+                var_list.append(var)
+            elif name.startswith(prefixes):
+                var_list.append(var)
+        elif name.startswith(prefixes) or (scope == 'all' and name == 'global_step'):
+            var_list.append(var)
+    return var_list
+
+def restore(sess, graph, model_path, scope='all'):
+    """Restore a checkpoint, or part of it, whatever format it was saved in
+
+    Only variables present in the checkpoint are restored (a checkpoint
+    saved without optimizer slots leaves them initialized), and float16
+    entries are cast back. Old checkpoints of the whole graph work too.
+
+    args:
+        model_path: checkpoint prefix, or a directory holding checkpoints.
+        scope: 'all', or 'decoder' for finetuning and inference.
+    """
+    if os.path.isdir(model_path):
+        model_path = tf.train.latest_checkpoint(model_path)
+    dtypes = tf.train.NewCheckpointReader(model_path).get_variable_to_dtype_map()
+    with graph.as_default():
+        var_list = []
+        for var in checkpoint_vars(graph, scope, optimizer=True):
+            name = var.op.name
+            if name not in dtypes:
+                continue
+            if dtypes[name] == tf.float16 and var.dtype.base_dtype == tf.float32:
+                var_list.append(HalfSaveable(var, name))
+            else:
+                var_list.append(var)
+        tf.train.Saver(var_list=var_list).restore(sess, model_path)
+    print('Restored %d variables of %s from %s' % (len(var_list), scope, model_path))
+    return model_path
+
+def load_state(model_path):
+    """Training state saved with a checkpoint, None if there is none
+
+    args:
+        model_path: checkpoint prefix, or a directory holding checkpoints.
+    return:
+        dict of 'epoch' and 'step' to continue from, 'iteration' (global
+        step count of the loop), 'seed' of the train shuffle and 'cursor'
+        (train images consumed).
+    """
+    if os.path.isdir(model_path):
+        model_path = tf.train.latest_checkpoint(model_path)
+    if model_path is None or not os.path.exists(model_path + '.state.json'):
+        return None
+    with open(model_path + '.state.json') as f:
+        return json.load(f)
+
+def sidecar_path(model_path, name):
+    """Arrays '<checkpoint>.<name>.npz' saved with a checkpoint, None if there are none
+
+    args:
+        model_path: checkpoint prefix, or a directory holding checkpoints.
+    """
+    if os.path.isdir(model_path):
+        model_path = tf.train.latest_checkpoint(model_path)
+    if model_path is None or not os.path.exists('%s.%s.npz' % (model_path, name)):
+        return None
+    return '%s.%s.npz' % (model_path, name)
+
+class AsyncCheckpointer(object):
+    """Checkpoint writer off the critical path of training
+
+    'save' copies the variables of 'checkpoint_vars' to host memory, which
+    is the only part blocking the training loop, and a background thread
+    writes them through a separate CPU graph as a normal TF checkpoint
+    (readable by 'restore'). At most one snapshot waits for the writer.
+
+    Every save goes to new files ('<prefix>-<step>', with the training
+    state in '<prefix>-<step>.state.json' and arrays of the training loop in
+    '<prefix>-<step>.<name>.npz'), and the 'checkpoint' state file
+    is replaced atomically after the files are complete, so an interrupted
+    save never corrupts the latest checkpoint. Old checkpoints are deleted
+    after the state file stops referring to them. A failed background write
+    is raised by the next 'save' or by 'close'.
+
+    Retention keeps the union of:
+    1. the last '--keep_checkpoints' checkpoints
+    2. every '--keep_every'-th checkpoint (counted in saves)
+    3. the '--keep_best' checkpoints with the lowest metric (test feature loss)
+
+    args:
+        graph: graph of the GAN.
+        prefix: checkpoint prefix, e.g. 'logdir/raf/raf1'.
+        resumed: whether the run continues the one of the retention records
+                 in the save directory. A new run starts without records,
+                 so checkpoints of an old run are neither kept nor counted.
+    """
+    def __init__(self, graph, prefix, resumed=False):
+        self.prefix = prefix
+        self.save_dir = os.path.dirname(os.path.abspath(prefix))
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+        self.var_list = checkpoint_vars(graph, 'all', cfg.ckpt_optimizer)
+
+        # Writer graph: one variable per saved variable, loaded from a placeholder
+        self.writer_graph = tf.Graph()
+        with self.writer_graph.as_default(), tf.device('/cpu:0'):
+            self.placeholders, self.initializers, saved = [], [], {}
+            for i, var in enumerate(self.var_list):
+                dtype = var.dtype.base_dtype
+                if cfg.ckpt_half and dtype == tf.float32:
+                    dtype = tf.float16
+                placeholder = tf.placeholder(dtype, var.get_shape())
+                copy = tf.Variable(placeholder, trainable=False, collections=[], name='var%d' % i)
+                self.placeholders.append(placeholder)
+                self.initializers.append(copy.initializer)
+                saved[var.op.name] = copy
+            self.saver = tf.train.Saver(var_list=saved, max_to_keep=None)
+        self.writer_sess = tf.Session(graph=self.writer_graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+
+        self.records = self._load_records() if resumed else []
+        self.error = None
+        self.stats = {'snapshot_s': 0., 'write_s': 0., 'wait_s': 0.}
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, sess, step, metric=None, state=None, arrays=None):
+        """Snapshot variables and queue them for writing
+
+        args:
+            metric: value ranked by '--keep_best', lower is better.
+            state: dict of the training state, read back by 'load_state'.
+            arrays: dict of name to a dict of numpy arrays (not modified
+                    afterwards), found again by 'sidecar_path'.
+        """
+        self._check()
+        start = time.time()
+        values = sess.run(self.var_list)
+        self.stats['snapshot_s'] = time.time() - start
+        item = (step, values, metric, state, arrays)
+        if cfg.async_ckpt:
+            start = time.time()
+            self.queue.put(item)
+            self.stats['wait_s'] = time.time() - start
+        else:
+            self._write(item)
+
+    def close(self):
+        """Wait for pending writes and stop the writer"""
+        self.queue.put(None)
+        self.thread.join()
+        self.writer_sess.close()
+        self._check()
+
+    def _check(self):
+        """Raise the failure of a background write"""
+        if self.error is not None:
+            step, error = self.error
+            self.error = None
+            raise RuntimeError('Saving checkpoint of step %d failed: %s' % (step, error))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._write(item)
+            except Exception as e:
+                print('Saving checkpoint of step %d failed: %s' % (item[0], e))
+                self.error = (item[0], e)
+
+    def _write(self, item):
+        step, values, metric, state, arrays = item
+        start = time.time()
+        feed = dict((placeholder, value.astype(placeholder.dtype.as_numpy_dtype))
+                    for placeholder, value in zip(self.placeholders, values))
+        self.writer_sess.run(self.initializers, feed)
+        path = '%s-%d' % (self.prefix, step)
+        self.saver.save(self.writer_sess, path, write_meta_graph=False, write_state=False)
+        if state is not None:
+            with open(path + '.state.json', 'w') as f:
+                json.dump(state, f, indent=2)
+        for name, named_arrays in (arrays or {}).items():
+            np.savez('%s.%s.npz' % (path, name), **named_arrays)
+        # Saves are numbered from 1, '--keep_every' keeps every n-th of them
+        index = max([record.get('index', 0) for record in self.records] + [0]) + 1
+        self.records.append({'path': path, 'step': step, 'metric': metric, 'index': index})
+        self._retain()
+        self.stats['write_s'] = time.time() - start
+        print('Model saved to %s (snapshot %.2fs, write %.2fs)' %
+              (path, self.stats['snapshot_s'], self.stats['write_s']))
+
+    def _retain(self):
+        """Apply the retention policy, then delete what is no longer kept"""
+        if cfg.keep_checkpoints <= 0:
+            keep = set(record['path'] for record in self.records)
+        else:
+            keep = set(record['path'] for record in self.records[-cfg.keep_checkpoints:])
+        if cfg.keep_every > 0:
+            keep.update(record['path'] for record in self.records
+                        if record.get('index', record['step'] // cfg.save_freq) % cfg.keep_every == 0)
+        scored = [record for record in self.records if record['metric'] is not None]
+        if cfg.keep_best > 0:
+            scored.sort(key=lambda record: record['metric'])
+            keep.update(record['path'] for record in scored[:cfg.keep_best])
+        removed = [record for record in self.records if record['path'] not in keep]
+        self.records = [record for record in self.records if record['path'] in keep]
+
+        # State files first, the removed checkpoints are unreferenced before deletion
+        tf.train.update_checkpoint_state(self.save_dir, self.records[-1]['path'],
+                                         [record['path'] for record in self.records])
+        self._save_records()
+        for record in removed:
+            for path in glob.glob(record['path'] + '.*'):
+                os.remove(path)
+
+    def _records_path(self):
+        return os.path.join(self.save_dir, 'retention.json')
+
+    def _load_records(self):
+        if os.path.exists(self._records_path()):
+            with open(self._records_path()) as f:
+                return json.load(f)
+        return []
+
+    def _save_records(self):
+        tmp = self._records_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.records, f, indent=2)
+        os.rename(tmp, self._records_path())
@@ -1,4 +1,5 @@
 import tensorflow as tf
+from tensorflow.core.protobuf import rewriter_config_pb2
 
 flags = tf.app.flags
 
@@ -13,10 +14,12 @@ flags.DEFINE_float('lambda_reg', 1e-6, 'weight of the loss for L2 regularitaion
 flags.DEFINE_float('lambda_gan', 1, 'weight of the loss for gan loss') # 1
 flags.DEFINE_float('lambda_sym', 0., 'weight of the loss for gan loss') #
 flags.DEFINE_float('lambda_gp', 10, 'weight of the loss for gradient penalty on parameter of D') # 10
+flags.DEFINE_float('lambda_exit', 0.001, 'weight of the L1 loss of the early exits of the decoder')
 flags.DEFINE_float('lambda_dr', 0., 'weight of the L2 loss for the output of D according to paper') #
 
 # For training
-flags.DEFINE_integer('dataset_size', 150000, 'number of images in the dataset') # 297369
+flags.DEFINE_integer('dataset_size', 0, 'number of train images per epoch, 0 for the size of the profile list') # 297369
+flags.DEFINE_string('manifest', '', 'manifest of the data lists (npz), built when missing or stale; empty to read the lists directly')
 flags.DEFINE_string('profile_path', '/home/ycqian/casia_aligned_250_250_jpg', 'dataset path')
 flags.DEFINE_string('profile_list', 'mpie/casia_profile.txt', 'train profile list')
 flags.DEFINE_string('gt_list', 'mpie/casia_profile.txt', 'train ground truth list')
@@ -27,6 +30,9 @@ flags.DEFINE_string('test_list', 'mpie/session01_test.txt', 'test set path') # l
 flags.DEFINE_boolean('is_train', True, 'train or frontalize test')
 flags.DEFINE_boolean('is_finetune', False, 'finetune') # False, True
 flags.DEFINE_string('face_model', 'resnet50.npy', 'face model path') #
+flags.DEFINE_string('encoder', 'resnet50', 'face model used as encoder and perceptual network: resnet50 or lightface')
+flags.DEFINE_string('student_model', 'lightface.npy', 'distilled lightface model path')
+flags.DEFINE_string('enc_precision', 'fp32', 'precision of the face model passes on real images: fp32, fp16 or int8 (fake-quantized weights, accuracy only)')
 flags.DEFINE_string('logdir', 'logdir/raf/raf1', 'model directory') #
 flags.DEFINE_string('summary_dir', 'log/raf1', 'logs directory') #
 flags.DEFINE_string('model_path', 'logdir/raf/raf1', 'finetune model path') #
@@ -34,18 +40,89 @@ flags.DEFINE_integer('batch_size', 6, 'batch size')
 flags.DEFINE_integer('decay_steps', 100, 'learning rate decay steps')
 flags.DEFINE_integer('epoch', 20, 'epoch') #
 flags.DEFINE_integer('critic', 1, 'number of D training times')
+flags.DEFINE_boolean('critic_adaptive', False, 'whether to choose the number of D steps per G step from d_loss, the GP norm and the D/G loss ratio')
+flags.DEFINE_integer('critic_min', 0, 'fewest D steps per G step of the adaptive critic schedule, 0 for max(critic / 2, 1)')
+flags.DEFINE_integer('critic_max', 0, 'most D steps per G step of the adaptive critic schedule, 0 for 2 * critic')
+flags.DEFINE_float('critic_tol', 0.05, 'relative gain of the Wasserstein estimate below which D is ahead')
+flags.DEFINE_float('critic_gp_tol', 0.2, 'distance of the GP gradient norm to 1 within which D is trusted')
+flags.DEFINE_float('critic_ratio', 2., 'Wasserstein estimate over |g_loss| above which D is ahead')
 flags.DEFINE_integer('train_sum_freq', 400, 'the frequency of saving train summary(step)')
 flags.DEFINE_integer('test_sum_freq', 500, 'the frequency of saving test summary(step)')
+flags.DEFINE_integer('test_images', 800, 'number of test images of each test')
 flags.DEFINE_integer('save_freq', 1000, 'the frequency of saving model')
+flags.DEFINE_float('log_every', 30., 'seconds between two prints of the training metrics')
+flags.DEFINE_integer('metrics_port', 0, 'local port serving the training metrics for Prometheus, 0 for none')
+flags.DEFINE_integer('metrics_rows', 100000, 'rows of a metrics file before it is rolled over')
+flags.DEFINE_string('trace_steps', '', 'comma-separated steps to trace op by op, SIGUSR1 traces the next step')
+flags.DEFINE_integer('keep_checkpoints', 5, 'number of last checkpoints to keep, 0 keeps all')
+flags.DEFINE_integer('keep_every', 0, 'also keep every n-th checkpoint, 0 for none')
+flags.DEFINE_integer('keep_best', 0, 'also keep the n checkpoints with the lowest test feature loss')
+flags.DEFINE_boolean('async_ckpt', True, 'whether to write checkpoints on a background thread')
+flags.DEFINE_boolean('ckpt_optimizer', True, 'whether to save optimizer slots in checkpoints')
+flags.DEFINE_boolean('ckpt_half', False, 'whether to save checkpoints in float16')
+flags.DEFINE_string('restore_scope', 'all', 'part of the model restored for finetuning: all or decoder')
+flags.DEFINE_boolean('resume', True, 'whether finetuning continues the training state (epoch, step, data order) of the checkpoint')
+flags.DEFINE_integer('seed', -1, 'seed of the train shuffle, -1 for a random one')
+flags.DEFINE_boolean('exact_order', False, 'dequeue train pairs in list order from one reader thread, so a resumed run consumes exactly the images an uninterrupted one would; otherwise the batch queue shuffles and resume is approximate')
+flags.DEFINE_string('order_log', '', 'file receiving the path of every consumed train profile, empty for none')
 flags.DEFINE_boolean('crop', True, 'Crop image to target size') # 
+flags.DEFINE_integer('loader_workers', 0, 'processes decoding feed-mode batches into shared memory, 0 decodes in the main thread')
+flags.DEFINE_integer('loader_ring', 4, 'number of shared memory batches of the loader, ring - 1 are prefetched')
+flags.DEFINE_integer('cache_mb', 0, 'budget (MB) of the LRU caches of decoded images, shared by the train queue and test readers and split with the loader workers, 0 for none')
 flags.DEFINE_float('lr', 1e-4, 'base learning rate') # 1e-4
 flags.DEFINE_float('beta1', 0., 'beta1 momentum term of adam')
 flags.DEFINE_float('beta2', 0.9, 'beta2 momentum term of adam')
 flags.DEFINE_float('stddev', 0.02, 'stddev for W initializer')
 flags.DEFINE_boolean('use_bias', False, 'whether to use bias')
 flags.DEFINE_string('norm', 'bn', 'normalize function for G') #
+flags.DEFINE_string('dis_type', 'attention', 'discriminator: attention (independent areas) or shared (shared trunk)')
+flags.DEFINE_string('progressive', '', "progressive training stages below 224 as '<resolution>:<epochs>', e.g. '56:1,112:2'; empty for none")
+flags.DEFINE_float('fade_epochs', 0.5, 'epochs over which a progressive stage fades in from the one below')
+flags.DEFINE_boolean('sampler', False, 'whether to draw generator batches by their recent feature loss (sampler.py)')
+flags.DEFINE_float('sampler_decay', 0.999, 'decay per iteration of a recorded loss towards the mean loss')
+flags.DEFINE_float('sampler_mix', 0.2, 'fraction of uniform draws of the sampler, bounds the importance weights')
+flags.DEFINE_float('target_fea', 0., 'test feature loss whose wall-clock time to reach is recorded, 0 for none')
+flags.DEFINE_boolean('exit_heads', False, 'whether to train the to-RGB early exits of the decoder at 56 and 112 (WGAN_GP)')
 flags.DEFINE_float('w_f', 0.5, 'weight of front2front loss for VGG-FACE') #
 
+# For distillation of the face model
+flags.DEFINE_integer('distill_steps', 20000, 'number of distillation steps')
+flags.DEFINE_float('distill_lr', 1e-3, 'learning rate of distillation')
+flags.DEFINE_float('distill_w_mid', 0.1, 'weight of the 28/14 feature losses in distillation')
+
+# For int8 quantization of the generator
+flags.DEFINE_integer('quant_calib_num', 200, 'number of test images to calibrate activation ranges')
+flags.DEFINE_integer('quant_eval_num', 100, 'number of test images to compare int8 and float models, at least 2')
+flags.DEFINE_string('quant_model', 'frontalizer_int8.tflite', 'path of quantized inference model')
+
+# For feature extraction
+flags.DEFINE_string('extract_list', '', 'list of images to extract features of, empty for the test list')
+flags.DEFINE_string('extract_path', '', 'image directory of the extraction list, empty for the test path')
+flags.DEFINE_string('extract_out', 'results/features', 'output prefix of the feature matrix (.npy) and ids (.ids)')
+flags.DEFINE_string('extract_layer', 'pool5', 'face model output: conv3_4, conv4_6, conv5_3 or pool5')
+flags.DEFINE_string('extract_source', 'input', 'features of the input images (input) or of their generated fronts (generated)')
+flags.DEFINE_integer('extract_batch', 64, 'batch size of feature extraction')
+flags.DEFINE_string('extract_dtype', 'float32', 'dtype of the feature matrix: float32 or float16')
+
+# For evaluation
+flags.DEFINE_string('eval_probe', 'results/features', 'feature prefix (.npy, .ids) of the probes')
+flags.DEFINE_string('eval_gallery', '', 'feature prefix of the gallery for rank-1 identification, empty for none')
+flags.DEFINE_string('eval_pairs', '', "verification pairs of probe ids ('id1,id2,same' lines or LFW pairs.txt), empty for none")
+flags.DEFINE_integer('eval_memory_mb', 1024, 'memory budget (MB) of the similarity blocks and their histogram binning')
+
+# For benchmark
+flags.DEFINE_string('bench', 'dis', 'benchmark to run, see BENCHES in benchmark.py')
+flags.DEFINE_string('bench_gan', 'WGAN_GP', 'GAN class to benchmark: WGAN_GP, WGAN or LSGAN')
+flags.DEFINE_integer('bench_iters', 20, 'number of timed iterations of every benchmark')
+flags.DEFINE_string('bench_batches', '2,6,12', 'comma-separated batch sizes of the step benchmark of the suite')
+flags.DEFINE_boolean('synthetic', False, 'benchmark on a synthetic dataset and a random-weight face model')
+flags.DEFINE_string('synthetic_dir', 'synthetic', 'directory of the synthetic dataset and face model')
+flags.DEFINE_integer('synthetic_num', 64, 'number of synthetic images')
+flags.DEFINE_integer('memory_budget', 11000, 'memory budget (MB) of batch size probing: GPU allocator, or process RSS on CPU')
+flags.DEFINE_integer('probe_max', 256, 'largest batch size probed')
+flags.DEFINE_boolean('probe_try', False, 'internal: run one batch size of the probe')
+flags.DEFINE_boolean('auto_batch', False, 'train with the batch size probed by batch_probe.py for the current setting')
+
 ############################
 #   environment setting    #
 ############################
@@ -56,6 +133,10 @@ flags.DEFINE_integer('width', 224, 'width of images')
 flags.DEFINE_integer('channel', 3, 'channel of images')
 flags.DEFINE_integer('num_threads', 8, 'number of threads of enqueueing examples')
 flags.DEFINE_string('results', 'results', 'path for saving results')
+flags.DEFINE_string('xla', 'off', 'XLA JIT: off, auto (auto-clustering of the whole graph) or scoped (encoder, decoder and D only)')
+flags.DEFINE_string('grappler', 'default', 'Grappler rewriters: default, none or a list from layout,arithmetic,remapper,memory')
+flags.DEFINE_string('ptx_cache', '', 'directory of the persistent CUDA PTX JIT cache, empty for the driver default; XLA clusters are recompiled on every start')
+flags.DEFINE_string('graph_cache', '', 'directory of cached MetaGraphs keyed by the config hash, empty to disable')
 
 ############################
 #   distributed setting    #
@@ -66,3 +147,35 @@ flags.DEFINE_integer('thread_per_gpu', 8, 'Number of preprocessing threads per t
 
 cfg = tf.app.flags.FLAGS
 # tf.logging.set_verbosity(tf.logging.INFO)
+
+# Grappler rewriters selectable by '--grappler'
+GRAPPLER = {'layout': 'layout_optimizer',
+            'arithmetic': 'arithmetic_optimization',
+            'remapper': 'remapping',
+            'memory': 'memory_optimization'}
+
+def session_config():
+    """Build tf.ConfigProto from the environment setting
+    
+    1. XLA JIT auto-clustering on the whole graph if '--xla=auto', the 
+       'scoped' mode is applied when the GAN graph is built (see 'jit_scope')
+    2. Grappler rewriters: 'default' keeps TensorFlow defaults, 'none' turns 
+       the four rewriters off, otherwise only the listed ones are on
+    """
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True
+    if cfg.xla == 'auto':
+        config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+    if cfg.grappler != 'default':
+        enabled = [] if cfg.grappler == 'none' else cfg.grappler.split(',')
+        assert set(enabled) <= set(GRAPPLER), 'unknown grappler rewriter in %s' % cfg.grappler
+        rewrite = config.graph_options.rewrite_options
+        for name, field in GRAPPLER.items():
+            if name == 'memory':
+                value = rewriter_config_pb2.RewriterConfig.HEURISTICS if name in enabled \
+                        else rewriter_config_pb2.RewriterConfig.NO_MEM_OPT
+            else:
+                value = rewriter_config_pb2.RewriterConfig.ON if name in enabled \
+                        else rewriter_config_pb2.RewriterConfig.OFF
+            setattr(rewrite, field, value)
+    return config
@@ -0,0 +1,160 @@
+#coding: utf-8
+import os
+import json
+import time
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import ops as tf_ops
+from config import cfg
+from resnet50 import Resnet50, resnet50_layout
+from lightface import LightFace
+from benchmark import GAN
+from tracing import component_of
+
+# Ops whose outputs are views, parameters or bookkeeping, not activations
+NO_ACTIVATION = set(['Const', 'VariableV2', 'Variable', 'VarHandleOp', 'Identity', 'Placeholder',
+                     'Reshape', 'Shape', 'Assign', 'NoOp', 'ReadVariableOp'])
+
+class ShapeFeed(object):
+    """Stand-in for loadData: placeholders instead of file lists and queues"""
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def get_train(self):
+        shape = [self.batch_size, cfg.height, cfg.width, cfg.channel]
+        self.queue_fill = tf.constant(1., name='queue_fill')
+        self.train_names = tf.placeholder(tf.string, [self.batch_size], 'train_names')
+        return tf.placeholder(tf.float32, shape, 'profile'), tf.placeholder(tf.float32, shape, 'front')
+
+def build_shapes(net_cls):
+    """Build the training graph of a GAN class without data or weights
+
+    The face model has the layout of its npy file with zero weights, so only
+    the configuration ('--batch_size', '--norm', '--encoder', ...) decides
+    the graph. Images are 224x224: the face model input, the decoder output
+    and the discriminator regions are fixed to that size.
+    """
+    if (cfg.height, cfg.width) != (224, 224):
+        raise ValueError('--height/--width %dx%d: the GANs only take 224x224 images (face model input, '
+                         'decoder output and discriminator regions). Source images of other sizes are '
+                         'resized on decoding, set --ori_height/--ori_width for them.' % (cfg.height, cfg.width))
+    if cfg.encoder == 'lightface':
+        face_model = LightFace()
+    else:
+        face_model = Resnet50.__new__(Resnet50)
+        face_model.data_dict = resnet50_layout()
+    return net_cls(ShapeFeed(cfg.batch_size), face_model)
+
+def op_flops(graph, op):
+    try:
+        return tf_ops.get_stats_for_node_def(graph, op.node_def, 'flops').value or 0
+    except ValueError:
+        return 0
+
+def activation_bytes(op):
+    """Bytes of the outputs of an op, zero if they are not activations"""
+    if op.type in NO_ACTIVATION:
+        return 0
+    total = 0
+    for output in op.outputs:
+        shape = output.get_shape()
+        if shape.is_fully_defined() and output.dtype.is_floating:
+            total += int(np.prod(shape.as_list())) * output.dtype.size
+    return total
+
+def closure_flops(graph, fetch):
+    """FLOPs of the ops a sess.run of 'fetch' executes"""
+    seen, stack, flops = set(), [fetch.op if hasattr(fetch, 'op') else fetch], 0
+    while stack:
+        op = stack.pop()
+        if op.name in seen:
+            continue
+        seen.add(op.name)
+        flops += op_flops(graph, op)
+        stack.extend(tensor.op for tensor in op.inputs)
+        stack.extend(op.control_inputs)
+    return flops
+
+def component_costs(net):
+    """Parameters, forward/backward FLOPs and activation memory per component
+
+    Activation memory adds up the forward outputs, which backpropagation
+    keeps alive, so it estimates the peak from above.
+    """
+    costs = {}
+    def cost(name):
+        return costs.setdefault(name, {'params': 0, 'forward_gflops': 0., 'backward_gflops': 0.,
+                                       'activation_mb': 0.})
+    # Frozen face model and trainable variables, optimizer slots are not parameters
+    trainable = set(var.op.name for var in net.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES))
+    for var in net.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES):
+        if var.op.name.startswith('face_model') or var.op.name in trainable:
+            cost(component_of(var.op.name))['params'] += int(np.prod(var.get_shape().as_list()))
+    for op in net.graph.get_operations():
+        name = component_of(op.name)
+        if name.endswith(' (backward)'):
+            cost(name[:-len(' (backward)')])['backward_gflops'] += op_flops(net.graph, op) / 1e9
+        else:
+            cost(name)['forward_gflops'] += op_flops(net.graph, op) / 1e9
+            cost(name)['activation_mb'] += activation_bytes(op) / 2.**20
+    return costs
+
+def calibrate(iters=None):
+    """FLOP rate of one CPU core on a Resnet-like 3x3 convolution
+
+    return:
+        GFLOP/s of a single thread
+    """
+    graph = tf.Graph()
+    with graph.as_default(), tf.device('/cpu:0'):
+        x = tf.constant(np.random.uniform(size=[8, 56, 56, 64]).astype(np.float32))
+        w = tf.constant(np.random.uniform(size=[3, 3, 64, 64]).astype(np.float32))
+        y = tf.reduce_sum(tf.nn.conv2d(x, w, [1, 1, 1, 1], 'SAME'))
+        flops = closure_flops(graph, y)
+    config = tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1,
+                            device_count={'GPU': 0})
+    iters = iters or cfg.bench_iters
+    with tf.Session(graph=graph, config=config) as sess:
+        sess.run(y)
+        start = time.time()
+        for i in range(iters):
+            sess.run(y)
+        seconds = (time.time() - start) / iters
+    return flops / seconds / 1e9
+
+def main(_):
+    if not os.path.exists(cfg.results):
+        os.mkdir(cfg.results)
+    net = build_shapes(GAN[cfg.bench_gan])
+    costs = component_costs(net)
+    d_gflops = closure_flops(net.graph, net.train_dis) / 1e9
+    g_gflops = closure_flops(net.graph, net.train_gen) / 1e9
+    step_gflops = cfg.critic * d_gflops + g_gflops
+
+    print('%s, batch %d, %dx%d, norm %s, encoder %s' %
+          (cfg.bench_gan, cfg.batch_size, cfg.height, cfg.width, cfg.norm, cfg.encoder))
+    print('    %-36s %12s %10s %10s %10s' % ('component', 'params', 'fwd GFLOP', 'bwd GFLOP', 'act MB'))
+    for name in sorted(costs):
+        c = costs[name]
+        print('    %-36s %12d %10.2f %10.2f %10.1f' %
+              (name, c['params'], c['forward_gflops'], c['backward_gflops'], c['activation_mb']))
+    activation = sum(c['activation_mb'] for c in costs.values())
+    print('D step %.1f GFLOP, G step %.1f GFLOP, activations <= %.0f MB' % (d_gflops, g_gflops, activation))
+
+    core_gflops = calibrate()
+    cores = multiprocessing.cpu_count()
+    per_core = cfg.batch_size / (step_gflops / core_gflops)
+    print('Calibrated %.1f GFLOP/s per core: %.3f images/s per core, %.2f images/s on %d cores' %
+          (core_gflops, per_core, per_core * cores, cores))
+
+    result = {'components': costs, 'd_step_gflops': d_gflops, 'g_step_gflops': g_gflops,
+              'activation_mb': activation, 'core_gflops_per_s': core_gflops,
+              'images_per_s_per_core': per_core, 'cores': cores}
+    path = os.path.join(cfg.results, 'cost_%s_bs%d_%dx%d_%s.json' %
+                        (cfg.bench_gan, cfg.batch_size, cfg.height, cfg.width, cfg.norm))
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    tf.app.run()
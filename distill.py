@@ -0,0 +1,118 @@
+#coding: utf-8
+import os
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from config import cfg, session_config
+from checkpoint import initialize
+from utils import loadData
+from resnet50 import Resnet50
+from lightface import LightFace
+
+epsilon = 1e-9
+
+def cosine(a, b):
+    """Row-wise cosine similarity of two [batch, dim] tensors"""
+    a = a / (tf.norm(a, axis=1, keep_dims=True) + epsilon)
+    b = b / (tf.norm(b, axis=1, keep_dims=True) + epsilon)
+    return tf.reduce_sum(tf.multiply(a, b), [1])
+
+def relative_error(student, teacher):
+    """Per-example relative L2 error of a feature map"""
+    axis = [1, 2, 3]
+    return tf.sqrt(tf.reduce_sum(tf.square(student - teacher), axis)) / \
+           (tf.sqrt(tf.reduce_sum(tf.square(teacher), axis)) + epsilon)
+
+def throughput(sess, fetch, feed, iters=20):
+    """Images per second of a forward pass"""
+    sess.run(fetch, feed)
+    start = time.time()
+    for i in range(iters):
+        sess.run(fetch, feed)
+    return iters * cfg.batch_size / (time.time() - start)
+
+def main(_):
+    """Distill Resnet50 into LightFace
+
+    The student is trained to reproduce conv5_3 (relative L2) and pool5
+    (cosine) of the frozen Resnet50 on the training images, the 28/14
+    outputs are matched with a smaller weight. Feature agreement on the
+    test list and forward throughput of both models are reported in
+    'results/distill_report.json'.
+    """
+    if not os.path.exists(cfg.results):
+        os.mkdir(cfg.results)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        data_feed = loadData(batch_size=cfg.batch_size, train_shuffle=True)
+        with tf.variable_scope('face_model'):
+            teacher = Resnet50()
+            teacher.build()
+        with tf.variable_scope('student'):
+            student = LightFace(cfg.student_model if cfg.is_finetune else None)
+            student.build(trainable=True)
+
+        # Both profiles and fronts are fed to the encoder in training
+        profile, front = data_feed.get_train()
+        images = tf.concat([profile, front], 0)
+        t_feat = teacher.forward(images, 'teacher_enc')
+        s_feat = student.forward(images, 'student_enc')
+        with tf.name_scope('distill_loss'):
+            loss_mid = tf.reduce_mean(relative_error(s_feat[0], t_feat[0])) + \
+                       tf.reduce_mean(relative_error(s_feat[1], t_feat[1]))
+            loss_conv5 = tf.reduce_mean(relative_error(s_feat[2], t_feat[2]))
+            loss_pool5 = tf.reduce_mean(1 - cosine(s_feat[3], t_feat[3]))
+            loss = loss_conv5 + loss_pool5 + cfg.distill_w_mid * loss_mid
+        student_vars = [var for var in tf.trainable_variables() if var.name.startswith('student')]
+        train_op = tf.train.AdamOptimizer(cfg.distill_lr).minimize(loss, var_list=student_vars)
+
+        # Evaluation and throughput on fed test images
+        x = tf.placeholder(tf.float32, [cfg.batch_size, cfg.height, cfg.width, cfg.channel], 'test_images')
+        t_eval = teacher.forward(x, 'teacher_eval')
+        s_eval = student.forward(x, 'student_eval')
+        eval_cos = tf.reduce_mean(cosine(s_eval[3], t_eval[3]))
+        eval_err = tf.reduce_mean(relative_error(s_eval[2], t_eval[2]))
+
+    def evaluate(sess):
+        cos, err = 0., 0.
+        test_num = max(1, 800 // cfg.batch_size)
+        for i in range(test_num):
+            te_profile, _ = data_feed.get_test_batch(cfg.batch_size)
+            cos_, err_ = sess.run([eval_cos, eval_err], {x: te_profile})
+            cos += cos_; err += err_
+        return cos / test_num, err / test_num
+
+    with tf.Session(config=session_config(), graph=graph) as sess:
+        initialize(sess)
+        coord = tf.train.Coordinator()
+        threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+
+        for step in range(cfg.distill_steps):
+            _, l, l5, lp = sess.run([train_op, loss, loss_conv5, loss_pool5])
+            if step % 100 == 0:
+                print('%d, Loss:%.4f, conv5_3:%.4f, pool5:%.4f' % (step, l, l5, lp))
+            if step % cfg.test_sum_freq == 0:
+                print('Testing: pool5 cosine:%.4f, conv5_3 rel. error:%.4f' % evaluate(sess))
+            if step != 0 and step % cfg.save_freq == 0:
+                student.save_npy(sess, cfg.student_model)
+        student.save_npy(sess, cfg.student_model)
+
+        # Report
+        cos, err = evaluate(sess)
+        te_profile, _ = data_feed.get_test_batch(cfg.batch_size)
+        t_ips = throughput(sess, t_eval[-1], {x: te_profile})
+        s_ips = throughput(sess, s_eval[-1], {x: te_profile})
+        report = {'pool5_cosine': float(cos), 'conv5_3_relative_error': float(err),
+                  'resnet50_images_per_sec': t_ips, 'lightface_images_per_sec': s_ips,
+                  'speedup': s_ips / t_ips, 'batch_size': cfg.batch_size}
+        print('Distillation report: %s' % json.dumps(report, sort_keys=True))
+        with open(os.path.join(cfg.results, 'distill_report.json'), 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+        coord.request_stop()
+        coord.join(threads)
+
+if __name__ == "__main__":
+    tf.app.run()
@@ -0,0 +1,200 @@
+#coding: utf-8
+import os
+import json
+import numpy as np
+import tensorflow as tf
+from config import cfg
+
+# Score histograms of the verification curves: cosine in [-1, 1]
+BINS = 4000
+# Scores binned at a time by ScoreHistogram.add, and the bytes of its temporaries per score
+CHUNK = 2**18
+CHUNK_BYTES = 18
+FARS = [1e-1, 1e-2, 1e-3, 1e-4, 1e-5, 1e-6]
+epsilon = 1e-9
+
+def load_features(prefix):
+    """Feature memmap and ids written by extract.py"""
+    features = np.load(prefix + '.npy', mmap_mode='r')
+    with open(prefix + '.ids') as f:
+        ids = [line.rstrip('\n') for line in f]
+    return features, ids
+
+def mpie_fields(ids):
+    """Identity and pose of MPIE file names (e.g. '001_01_01_051_07.png')
+
+    Same fields as 'f1' in utils.py: label name[:3], session name[4:6],
+    expression name[7:9], pose name[10:13], illumination name[14:16].
+    """
+    names = [os.path.basename(name) for name in ids]
+    return np.array([name[:3] for name in names]), np.array([name[10:13] for name in names])
+
+def normalize(block):
+    block = np.asarray(block, np.float32)
+    return block / (np.linalg.norm(block, axis=1, keepdims=True) + epsilon)
+
+def blocks(n, size):
+    for start in range(0, n, size):
+        yield start, min(start + size, n)
+
+def block_sizes(dim, n_gallery):
+    """Probe and gallery block sizes that fit '--eval_memory_mb'
+
+    A block holds the normalized float32 features of its probes and gallery
+    and, per pair, a float32 score and a bool of 'same'. The temporaries of
+    the histogram are bounded by CHUNK scores.
+    """
+    budget = cfg.eval_memory_mb * 2**20 - CHUNK * CHUNK_BYTES
+    probe = min(1024, max(budget // (8 * dim), 1))
+    gallery = max(min(n_gallery, (budget - 4 * probe * dim) // (5 * probe + 4 * dim)), 1)
+    return probe, gallery
+
+class ScoreHistogram(object):
+    """Genuine and impostor score histograms, the ROC without keeping scores"""
+    def __init__(self):
+        self.genuine = np.zeros(BINS, np.int64)
+        self.impostor = np.zeros(BINS, np.int64)
+
+    def add(self, scores, same):
+        """Count float32 scores, which are overwritten by their bins
+
+        Scores are binned in place, then counted CHUNK at a time, so the
+        temporaries do not grow with the block.
+        """
+        scores += 1.
+        scores *= BINS / 2.
+        np.clip(scores, 0, BINS - 1, out=scores)
+        for start, end in blocks(len(scores), CHUNK):
+            bins = scores[start:end].astype(np.int64)
+            genuine = same[start:end]
+            self.genuine += np.bincount(bins[genuine], minlength=BINS)
+            self.impostor += np.bincount(bins[~genuine], minlength=BINS)
+
+    def roc(self):
+        """TAR at the FARs of FARS, with the thresholds, and the ROC AUC"""
+        # Rates of accepting scores >= bin, from the highest bin down
+        tar = np.cumsum(self.genuine[::-1])[::-1] / max(self.genuine.sum(), 1.)
+        far = np.cumsum(self.impostor[::-1])[::-1] / max(self.impostor.sum(), 1.)
+        result = {'genuine': int(self.genuine.sum()), 'impostor': int(self.impostor.sum()),
+                  'auc': float(-np.trapz(np.append(tar, 0.), np.append(far, 0.)))}
+        for target in FARS:
+            # Lowest threshold whose FAR is at most the target
+            index = np.searchsorted(-far, -target)
+            if index < BINS:
+                result['tar@far=%g' % target] = float(tar[index])
+                result['threshold@far=%g' % target] = 2. * index / BINS - 1.
+        return result
+
+def identification(probe, probe_ids, gallery, gallery_ids):
+    """Rank-1 identification and all-pairs verification of probes against a gallery
+
+    Cosine similarities are computed block by block, so no probe x gallery
+    matrix larger than the memory budget is kept. Identity and pose come
+    from MPIE file names.
+    """
+    probe_labels, probe_poses = mpie_fields(probe_ids)
+    gallery_labels, _ = mpie_fields(gallery_ids)
+    probe_size, gallery_size = block_sizes(probe.shape[1], len(gallery_ids))
+    histogram = ScoreHistogram()
+    correct = np.zeros(len(probe_ids), bool)
+    for p_start, p_end in blocks(len(probe_ids), probe_size):
+        queries = normalize(probe[p_start:p_end])
+        best = np.full(p_end - p_start, -np.inf, np.float32)
+        best_index = np.zeros(p_end - p_start, np.int64)
+        for g_start, g_end in blocks(len(gallery_ids), gallery_size):
+            scores = np.dot(queries, normalize(gallery[g_start:g_end]).T)
+            index = np.argmax(scores, axis=1)
+            score = scores[np.arange(len(index)), index]
+            better = score > best
+            best[better] = score[better]
+            best_index[better] = g_start + index[better]
+            same = probe_labels[p_start:p_end, None] == gallery_labels[None, g_start:g_end]
+            histogram.add(scores.ravel(), same.ravel())
+        correct[p_start:p_end] = gallery_labels[best_index] == probe_labels[p_start:p_end]
+
+    result = {'rank1': float(correct.mean()), 'probes': len(probe_ids), 'gallery': len(gallery_ids),
+              'verification': histogram.roc(), 'rank1_per_pose': {}}
+    for pose in sorted(set(probe_poses)):
+        mask = probe_poses == pose
+        result['rank1_per_pose'][pose] = {'rank1': float(correct[mask].mean()), 'probes': int(mask.sum())}
+    return result
+
+def read_pairs(pairs_file, ids):
+    """Positions in 'ids' of the pairs of a pairs file, and whether they are genuine
+
+    Two formats are read:
+    1. 'id1,id2,same' lines, same is 1 or 0
+    2. LFW pairs.txt: 'name n1 n2' lines for genuine pairs and
+       'name1 n1 name2 n2' for impostors, with the image of 'name n' at
+       '<name>/<name>_<n:04d>.<any extension>' in the ids. Other lines
+       (the '<folds> <pairs>' header) are skipped.
+    """
+    position = dict((name, i) for i, name in enumerate(ids))
+    lfw = dict(('/'.join(os.path.splitext(name)[0].split('/')[-2:]), i) for i, name in enumerate(ids))
+    def lfw_position(name, number):
+        return lfw['%s/%s_%04d' % (name, name, int(number))]
+    first, second, same = [], [], []
+    with open(pairs_file) as f:
+        for line in f:
+            if ',' in line:
+                pair = line.strip().split(',')
+                first.append(position[pair[0]])
+                second.append(position[pair[1]])
+                same.append(int(pair[2]) == 1)
+                continue
+            fields = line.split()
+            if len(fields) == 3:
+                first.append(lfw_position(fields[0], fields[1]))
+                second.append(lfw_position(fields[0], fields[2]))
+                same.append(True)
+            elif len(fields) == 4:
+                first.append(lfw_position(fields[0], fields[1]))
+                second.append(lfw_position(fields[2], fields[3]))
+                same.append(False)
+    return np.array(first, np.int64), np.array(second, np.int64), np.array(same, bool)
+
+def verification(features, ids, pairs_file):
+    """Verification on the pairs of a pairs file (see 'read_pairs')
+
+    Pairs are scored in blocks read from the feature memmap.
+    """
+    first, second, same = read_pairs(pairs_file, ids)
+    histogram = ScoreHistogram()
+    size, _ = block_sizes(features.shape[1], 1)
+    for start, end in blocks(len(same), size):
+        scores = np.sum(normalize(features[first[start:end]]) * normalize(features[second[start:end]]), axis=1)
+        histogram.add(scores, same[start:end])
+    result = histogram.roc()
+    # Best accuracy over the bin thresholds: genuine pairs at or above, impostors below
+    accepted = np.cumsum(histogram.genuine[::-1])[::-1]
+    rejected = np.cumsum(histogram.impostor) - histogram.impostor
+    result['best_accuracy'] = float((accepted + rejected).max()) / max(len(same), 1)
+    return result
+
+def main(_):
+    """Evaluate feature matrices of extract.py
+
+    1. '--eval_probe' against '--eval_gallery': rank-1 identification
+       (overall and per pose) and verification over all probe-gallery pairs
+    2. '--eval_pairs' on '--eval_probe': verification of listed pairs
+    Results are written to 'results/eval_<probe name>.json'.
+    """
+    if not os.path.exists(cfg.results):
+        os.mkdir(cfg.results)
+    probe, probe_ids = load_features(cfg.eval_probe)
+    result = {}
+    if cfg.eval_gallery:
+        gallery, gallery_ids = load_features(cfg.eval_gallery)
+        result['identification'] = identification(probe, probe_ids, gallery, gallery_ids)
+        print('Rank-1: %.4f on %d probes' % (result['identification']['rank1'], len(probe_ids)))
+        for pose, pose_result in sorted(result['identification']['rank1_per_pose'].items()):
+            print('    pose %s: %.4f (%d)' % (pose, pose_result['rank1'], pose_result['probes']))
+    if cfg.eval_pairs:
+        result['pairs'] = verification(probe, probe_ids, cfg.eval_pairs)
+        print('Pairs: %s' % json.dumps(result['pairs'], sort_keys=True))
+    path = os.path.join(cfg.results, 'eval_%s.json' % os.path.basename(cfg.eval_probe))
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    tf.app.run()
@@ -0,0 +1,127 @@
+#coding: utf-8
+import os
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from config import cfg, session_config
+from checkpoint import initialize
+from loader import SharedLoader
+from manifest import read_list
+from ops import flatten
+from inference import build_frontalizer, restore
+
+# Outputs of Resnet50.forward / LightFace.forward
+LAYERS = ['conv3_4', 'conv4_6', 'conv5_3', 'pool5']
+
+def feature_graph(batch_size=None):
+    """Frontalizer graph with the features of '--extract_layer'
+
+    Features are taken from the input images, or from the generated fronts
+    re-encoded by the face model ('--extract_source=generated').
+    """
+    net = build_frontalizer(batch_size=batch_size)
+    with net.graph.as_default():
+        if cfg.extract_source == 'generated':
+            features = net.face_model.forward(net.gen_p, 'gen_enc')
+        else:
+            features = net.feature_p
+        layer = features[LAYERS.index(cfg.extract_layer)]
+        net.features = flatten(layer)
+    return net
+
+class FeatureWriter(object):
+    """Rows of features in a preallocated npy memmap, with an id file
+
+    '<out>.npy' can be opened with np.load(path, mmap_mode='r'), row i
+    belongs to line i of '<out>.ids'. '<out>.progress.json' holds the number
+    of rows written and flushed; a writer opened on the same ids and shape
+    continues from there.
+    """
+    def __init__(self, out, ids, dim, dtype):
+        self.out = out
+        self.progress_path = out + '.progress.json'
+        shape = (len(ids), dim)
+        self.done = 0
+        if os.path.exists(out + '.npy') and os.path.exists(out + '.ids') and \
+           os.path.exists(self.progress_path):
+            matrix = np.load(out + '.npy', mmap_mode='r+')
+            with open(out + '.ids') as f:
+                same_ids = [line.rstrip('\n') for line in f] == list(ids)
+            if matrix.shape == shape and matrix.dtype == dtype and same_ids:
+                self.matrix = matrix
+                with open(self.progress_path) as f:
+                    self.done = json.load(f)['done']
+        if self.done == 0:
+            with open(out + '.ids', 'w') as f:
+                f.write(''.join('%s\n' % name for name in ids))
+            self.matrix = np.lib.format.open_memmap(out + '.npy', 'w+', dtype, shape)
+            self._save_progress()
+
+    def write(self, rows):
+        """Write rows after the ones written, rows past the end are dropped"""
+        rows = rows[:len(self.matrix) - self.done]
+        self.matrix[self.done:self.done + len(rows)] = rows
+        self.done += len(rows)
+
+    def flush(self):
+        self.matrix.flush()
+        self._save_progress()
+
+    def _save_progress(self):
+        tmp = self.progress_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'done': self.done, 'rows': len(self.matrix)}, f)
+        os.rename(tmp, self.progress_path)
+
+def main(_):
+    """Extract face features of a image list into a memmap
+
+    Images of '--extract_list' (default: the test list) are decoded by a
+    prefetching process pool, encoded in batches of '--extract_batch' and
+    written as '--extract_dtype' rows of '--extract_out'.npy. The graph has
+    no static batch size, so the last partial batch is encoded as it is.
+    An interrupted extraction resumes at the last flushed row.
+    """
+    list_file = cfg.extract_list or cfg.test_list
+    root = cfg.extract_path or cfg.test_path
+    ids = read_list(list_file)
+    batch_size = cfg.extract_batch
+    out_dir = os.path.dirname(os.path.abspath(cfg.extract_out))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    net = feature_graph()
+    dim = int(np.prod(net.features.get_shape().as_list()[1:]))
+    writer = FeatureWriter(cfg.extract_out, ids, dim, np.dtype(cfg.extract_dtype))
+    if writer.done == len(ids):
+        print('All %d features already extracted to %s.npy' % (len(ids), cfg.extract_out))
+        return
+    if writer.done:
+        print('Resuming at image %d of %d' % (writer.done, len(ids)))
+
+    crop_box = [(cfg.ori_width - cfg.width) // 2, (cfg.ori_height - cfg.height) // 2,
+                (cfg.ori_width + cfg.width) // 2, (cfg.ori_height + cfg.height) // 2]
+    paths = [root + '/' + name for name in ids[writer.done:]]
+    loader = SharedLoader([(paths, False)], batch_size, crop_box if cfg.crop else None,
+                          cfg.loader_ring, cfg.loader_workers or 4, cfg.cache_mb * 2**20)
+    with tf.Session(config=session_config(), graph=net.graph) as sess:
+        if cfg.extract_source == 'generated':
+            restore(sess, net)
+        else:
+            initialize(sess)
+        start, first = time.time(), writer.done
+        for batch in range((len(paths) + batch_size - 1) // batch_size):
+            images, = loader.get()
+            features = sess.run(net.features, {net.profile: images[:len(ids) - writer.done]})
+            writer.write(features.astype(writer.matrix.dtype))
+            if batch % 100 == 99:
+                writer.flush()
+                print('%d / %d images, %.1f images/s' %
+                      (writer.done, len(ids), (writer.done - first) / (time.time() - start)))
+        writer.flush()
+    loader.close()
+    print('Features of %d images written to %s.npy' % (len(ids), cfg.extract_out))
+
+if __name__ == "__main__":
+    tf.app.run()
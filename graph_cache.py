@@ -0,0 +1,90 @@
+#coding: utf-8
+import os
+import hashlib
+import tensorflow as tf
+from config import cfg
+from utils import loadData
+from checkpoint import load_init_values
+
+# Attributes of the GAN classes used by the training loop. They are stored
+# in collections of the MetaGraph and restored by name.
+HANDLES = ['profile', 'front', 'is_train', 'train_dis', 'train_gen', 'global_step',
+           'feature_loss', 'g_loss', 'd_loss', 'gen_p', 'train_summary', 'queue_fill',
+           'profile_distance', 'sample_weight', 'grad4', 'train_names', 'identity_sim']
+
+# Flags that do not change the graph
+RUN_FLAGS = ['is_train', 'is_finetune', 'logdir', 'summary_dir', 'model_path', 'epoch',
+             'train_sum_freq', 'test_sum_freq', 'save_freq', 'results', 'graph_cache',
+             'ptx_cache', 'dataset_size', 'manifest', 'profile_path', 'profile_list', 'front_path',
+             'front_list', 'test_path', 'test_list', 'keep_checkpoints', 'ckpt_optimizer', 'ckpt_half',
+             'restore_scope', 'keep_every', 'keep_best', 'async_ckpt', 'resume', 'seed',
+             'metrics_port', 'log_every', 'metrics_rows', 'trace_steps', 'order_log', 'test_images',
+             'memory_budget', 'probe_max', 'probe_try', 'auto_batch',
+             'loader_workers', 'loader_ring', 'fade_epochs', 'target_fea',
+             'sampler', 'sampler_decay', 'sampler_mix', 'critic_adaptive', 'critic_min',
+             'critic_max', 'critic_tol', 'critic_gp_tol', 'critic_ratio']
+
+# Files the graph is built from
+SOURCES = ['config.py', 'ops.py', 'checkpoint.py', 'utils.py', 'loader.py', 'manifest.py', 'resnet50.py',
+           'lightface.py', 'schedule.py', 'WGAN_GP.py', 'WGAN.py', 'LSGAN.py']
+
+def cache_key(name):
+    """Hash of the flags, the model sources and the model files
+
+    The data lists and the face model weights are fed when the variables
+    are initialized (checkpoint.fed_variable), so they are not part of the
+    graph and one cached graph serves every seed and data cursor.
+    """
+    md5 = hashlib.md5(name.encode('utf-8'))
+    flags = cfg.flag_values_dict()
+    for flag in sorted(flags):
+        if flag not in RUN_FLAGS:
+            md5.update(('%s=%r;' % (flag, flags[flag])).encode('utf-8'))
+    here = os.path.dirname(os.path.abspath(__file__))
+    for source in SOURCES:
+        with open(os.path.join(here, source), 'rb') as f:
+            md5.update(f.read())
+    for path in [cfg.face_model, cfg.student_model]:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            md5.update(('%s:%d:%d;' % (path, stat.st_size, int(stat.st_mtime))).encode('utf-8'))
+    return md5.hexdigest()
+
+def cache_path(name):
+    """MetaGraph file of a GAN class for the current setting"""
+    return os.path.join(cfg.graph_cache, '%s-%s.meta' % (name, cache_key(name)))
+
+def save(net, path):
+    """Export the graph of a built GAN with its handles"""
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with net.graph.as_default():
+        for name in HANDLES:
+            if hasattr(net, name):
+                tf.add_to_collection('handles/' + name, getattr(net, name))
+        # Write to a temporary file first, an interrupted export is never loaded
+        tf.train.export_meta_graph(filename=path + '.tmp', clear_devices=True)
+    os.rename(path + '.tmp', path)
+    print('Graph cached to %s' % path)
+
+class CachedNet(object):
+    """GAN imported from a cached MetaGraph
+
+    It has the graph, the handles of HANDLES and a data feed, which is all
+    the training loop uses. The train lists of the data feed (shuffled with
+    'seed' from 'cursor') and the face model weights are fed to the
+    initializers, as in a built graph.
+    """
+    def __init__(self, path, seed=None, cursor=0):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.train.import_meta_graph(path)
+            for name in HANDLES:
+                handle = self.graph.get_collection('handles/' + name)
+                if handle:
+                    setattr(self, name, handle[0])
+        self.batch_size = cfg.batch_size
+        self.data_feed = loadData(batch_size=self.batch_size, seed=seed, cursor=cursor)
+        profile_list, front_list = self.data_feed.train_lists()
+        load_init_values(self.graph, {'profile_list': profile_list, 'front_list': front_list})
+        print('Graph imported from %s' % path)
@@ -0,0 +1,58 @@
+#coding: utf-8
+import tensorflow as tf
+from config import cfg
+import checkpoint
+from resnet50 import Resnet50
+from lightface import LightFace
+from WGAN_GP import WGAN_GP
+
+def build_frontalizer(net_cls=WGAN_GP, batch_size=None, resolution=224):
+    """Build the inference graph of the generator
+
+    Only the encoder and the decoder of a GAN class are constructed, on a
+    placeholder input and with BatchNorm fixed to inference mode. No data
+    list, discriminator or optimizer is created. Variables keep the names
+    used in training, so the decoder can be restored from a training
+    checkpoint by 'restore'.
+
+    args:
+        net_cls: GAN class whose decoder is used (WGAN_GP, WGAN or LSGAN).
+        batch_size: static batch size of the input placeholder, None for
+                    batches of any size.
+        resolution: output resolution; 56 or 112 stop the decoder at an
+                    early exit (WGAN_GP trained with '--exit_heads').
+    return:
+        net object with 'graph', 'profile' (input), 'feature_p' and 'gen_p'.
+    """
+    net = net_cls.__new__(net_cls)
+    net.graph = tf.Graph()
+    with net.graph.as_default():
+        net.batch_size = batch_size
+        with tf.variable_scope('face_model'):
+            if cfg.encoder == 'lightface':
+                net.face_model = LightFace(cfg.student_model)
+            else:
+                net.face_model = Resnet50()
+            net.face_model.build()
+
+        net.is_train = tf.constant(False, name='is_train')
+        net.profile = tf.placeholder(tf.float32, [batch_size, cfg.height, cfg.width, cfg.channel], 'profile')
+        net.feature_p = net.face_model.forward(net.profile, 'profile_enc')
+        if resolution == 224:
+            net.gen_p = net.decoder(net.feature_p)
+        else:
+            net.gen_p = net.decoder(net.feature_p, resolution=resolution)
+    return net
+
+def restore(sess, net, model_path=None):
+    """Initialize the face model from its npy file and restore the decoder
+
+    args:
+        model_path: checkpoint prefix, or a directory holding checkpoints;
+                    '--model_path' when None.
+    """
+    if model_path is None:
+        model_path = cfg.model_path
+    with net.graph.as_default():
+        checkpoint.initialize(sess)
+    checkpoint.restore(sess, net.graph, model_path, 'decoder')
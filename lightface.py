@@ -0,0 +1,144 @@
+#coding: utf-8
+import numpy as np
+import tensorflow as tf
+from config import cfg
+from ops import PRECISION, frozen_param
+from checkpoint import fed_variable
+from resnet50 import VGG_MEAN
+
+# Layer table: name, type, kernel size, input channels, output channels, stride
+# 'conv' is a full convolution, 'dw' a depthwise convolution and 'pw' a 1x1
+# convolution. 'proj*' layers lift the student features to the channel
+# numbers of Resnet50 (conv3_4 / conv4_6 / conv5_3), so the decoder and the
+# perceptual loss see the same tensor shapes.
+LAYERS = [
+    ('conv1', 'conv', 3, 3, 32, 2),        # 112 x 112 x 32
+    ('conv2_dw', 'dw', 3, 32, 32, 2),
+    ('conv2_pw', 'pw', 1, 32, 64, 1),      # 56 x 56 x 64
+    ('conv3_dw', 'dw', 3, 64, 64, 1),
+    ('conv3_pw', 'pw', 1, 64, 64, 1),      # 56 x 56 x 64
+    ('conv4_dw', 'dw', 3, 64, 64, 2),
+    ('conv4_pw', 'pw', 1, 64, 128, 1),     # 28 x 28 x 128
+    ('conv5_dw', 'dw', 3, 128, 128, 1),
+    ('conv5_pw', 'pw', 1, 128, 128, 1),    # 28 x 28 x 128
+    ('proj28', 'pw', 1, 128, 512, 1),      # 28 x 28 x 512
+    ('conv6_dw', 'dw', 3, 128, 128, 2),
+    ('conv6_pw', 'pw', 1, 128, 256, 1),    # 14 x 14 x 256
+    ('conv7_dw', 'dw', 3, 256, 256, 1),
+    ('conv7_pw', 'pw', 1, 256, 256, 1),    # 14 x 14 x 256
+    ('proj14', 'pw', 1, 256, 1024, 1),     # 14 x 14 x 1024
+    ('conv8_dw', 'dw', 3, 256, 256, 2),
+    ('conv8_pw', 'pw', 1, 256, 512, 1),    # 7 x 7 x 512
+    ('conv9_dw', 'dw', 3, 512, 512, 1),
+    ('conv9_pw', 'pw', 1, 512, 512, 1),    # 7 x 7 x 512
+    ('proj7', 'pw', 1, 512, 2048, 1),      # 7 x 7 x 2048
+]
+
+class LightFace(object):
+    """Class for the lightweight face model distilled from Resnet50
+
+    A depthwise separable network trained by 'distill.py' to reproduce the
+    outputs of the frozen Resnet50. Function "forward" returns the same tuple
+    as Resnet50.forward, so it can replace Resnet50 both as encoder of G and
+    as perceptual loss network (set '--encoder=lightface').
+
+    args:
+        npy_path: binary file of distilled parameters. Parameters are
+                  initialized randomly if it is None.
+    """
+    def __init__(self, npy_path=None):
+        self.data_dict = None
+        self.npy_path = npy_path
+        if npy_path is not None:
+            self.data_dict = np.load(npy_path, encoding='latin1').item()
+            print("npy file loaded")
+
+    def build(self, trainable=False):
+        """Load parameters from dict (or initialize them) and build up the model
+
+        args:
+            trainable: whether parameters are trainable, only for distillation.
+        """
+        self.weights = {}
+        self.biases = {}
+        with tf.variable_scope('lightface_parameters'):
+            for name, kind, k, c_in, c_out, _ in LAYERS:
+                shape = [k, k, c_in, 1] if kind == 'dw' else [k, k, c_in, c_out]
+                with tf.variable_scope(name):
+                    self.weights[name] = self.get_filter(name, shape, trainable)
+                    self.biases[name] = self.get_bias(name, c_out, trainable)
+
+        # Clear the model dict
+        self.data_dict = None
+        # Reduced precision copies of the parameters, shared by all passes
+        self.cast_cache = {}
+
+    def forward(self, rgb, scope = 'lightface', precision = 'fp32'):
+        """Forward process of the distilled face model
+
+        args:
+            rgb: rgb image tensors with shape(batch, height, width, 3), values range in [0,255]
+            precision: compute precision, 'fp32', 'fp16' or 'int8' (fake-quantized
+                       weights). Outputs are always float32.
+        return:
+            a set of tensors of layers
+        """
+        dtype = PRECISION[precision]
+        w = lambda var: frozen_param(var, precision, self.cast_cache)
+        with tf.name_scope(scope):
+            # Same input convention as Resnet50
+            assert rgb.get_shape().as_list()[1:] == [224, 224, 3]
+            rgb = tf.cast(rgb, dtype)
+            red, green, blue = tf.split(axis=3, num_or_size_splits=3, value=rgb)
+            x = tf.concat(axis=3, values=[
+                blue - VGG_MEAN[0],
+                green - VGG_MEAN[1],
+                red - VGG_MEAN[2],
+            ])
+
+            outputs = {}
+            for name, kind, _, _, _, stride in LAYERS:
+                with tf.name_scope(name):
+                    strides = [1, stride, stride, 1]
+                    if kind == 'dw':
+                        y = tf.nn.depthwise_conv2d(x, w(self.weights[name]), strides, padding='SAME')
+                    else:
+                        y = tf.nn.conv2d(x, w(self.weights[name]), strides, padding='SAME')
+                    y = tf.nn.relu(tf.nn.bias_add(y, w(self.biases[name])))
+                outputs[name] = y
+                # Projections branch off the backbone, they do not feed the next layer
+                if not name.startswith('proj'):
+                    x = y
+
+            feat28, feat14, feat7 = outputs['proj28'], outputs['proj14'], outputs['proj7']
+            # output shape: [28, 28, 512], [14, 14, 1024], [7, 7, 2048]
+            pool5 = tf.reduce_mean(feat7, [1, 2])
+            # output shape: [2048]
+            assert pool5.get_shape().as_list()[1:] == [2048]
+            if dtype != tf.float32:
+                feat28, feat14, feat7, pool5 = [tf.cast(t, tf.float32) for t in [feat28, feat14, feat7, pool5]]
+
+        return feat28, feat14, feat7, pool5 # shape of 28,14,7,1
+
+    def get_filter(self, name, shape, trainable):
+        if self.data_dict is not None:
+            return fed_variable(self.data_dict[name]['weights'], "filter", '%s:%s/weights' % (self.npy_path, name),
+                                trainable=trainable)
+        fan_in = shape[0] * shape[1] * (1 if shape[3] == 1 else shape[2])
+        return tf.Variable(tf.truncated_normal(shape, stddev=np.sqrt(2. / fan_in)),
+                           name="filter", trainable=trainable)
+
+    def get_bias(self, name, units, trainable):
+        if self.data_dict is not None:
+            return fed_variable(self.data_dict[name]['biases'], "biases", '%s:%s/biases' % (self.npy_path, name),
+                                trainable=trainable)
+        return tf.Variable(tf.zeros([units]), name="biases", trainable=trainable)
+
+    def save_npy(self, sess, npy_path):
+        """Save parameters in the same dict layout as the Resnet50 model file"""
+        weights, biases = sess.run([self.weights, self.biases])
+        data_dict = {}
+        for name in weights:
+            data_dict[name] = {'weights': weights[name], 'biases': biases[name]}
+        np.save(npy_path, data_dict)
+        print('Student model saved to %s' % npy_path)
@@ -0,0 +1,245 @@
+#coding: utf-8
+import os
+import zlib
+import threading
+import collections
+import multiprocessing
+import numpy as np
+from PIL import Image
+from config import cfg
+
+def decode_image(path, flip, crop_box):
+    """Decode a image to uint8, flip it horizontally and crop it
+
+    Images of another size than the original one are resized to it, larger
+    JPEGs are decoded at a reduced DCT scale first (PIL 'draft').
+
+    args:
+        crop_box: left, upper, right, lower; None for no crop.
+    return:
+        uint8 array of shape (height, width, channel)
+    """
+    img = Image.open(path)
+    size = (cfg.ori_width, cfg.ori_height)
+    if img.size != size:
+        if img.format == 'JPEG':
+            img.draft(img.mode, size)
+        img = img.resize(size, Image.BILINEAR)
+    if(img.mode=='L' and cfg.channel == 3):
+        img = img.convert('RGB')
+    if flip:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    if crop_box is not None:
+        img = img.crop(crop_box)
+    img = np.asarray(img, dtype=np.uint8)
+    if(cfg.channel == 1):
+        img = np.expand_dims(img, axis=2)
+    return img
+
+class LRUCache(object):
+    """Least recently used cache of decoded images within a byte budget
+
+    args:
+        budget: bytes of images kept at most.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.bytes = 0
+        self.items = collections.OrderedDict()
+        self.hits, self.misses = 0, 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if value.nbytes > self.budget:
+            return
+        with self.lock:
+            if key in self.items:
+                self.bytes -= self.items.pop(key).nbytes
+            self.items[key] = value
+            self.bytes += value.nbytes
+            while self.bytes > self.budget:
+                _, old = self.items.popitem(last=False)
+                self.bytes -= old.nbytes
+
+    def stats(self):
+        stats = cache_stats(self.hits, self.misses)
+        stats.update({'mb': self.bytes / 2.**20, 'items': len(self.items)})
+        return stats
+
+def cache_stats(hits, misses, failures=0):
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / max(hits + misses, 1.),
+            'decode_failures': failures}
+
+def cached_decode(cache, path, flip, crop_box):
+    """decode_image through a cache, images are cached before cropping and flipping
+
+    Paths are normalized, so the profile, front and test readers share the
+    images of a directory they have in common, whatever crop they use. The
+    crop and the flip of a cached image are views of it.
+    """
+    if cache is None:
+        return decode_image(path, flip, crop_box), False
+    key = os.path.normpath(path)
+    img = cache.get(key)
+    hit = img is not None
+    if not hit:
+        img = decode_image(key, False, None)
+        cache.put(key, img)
+    if crop_box is not None:
+        left, upper, right, lower = [int(side) for side in crop_box]
+        img = img[upper:lower, left:right]
+    return (img[:, ::-1] if flip else img), hit
+
+def random_crop_box():
+    """Crop box of a training size crop at a random offset of the original size"""
+    left = np.random.randint(cfg.ori_width - cfg.width + 1)
+    upper = np.random.randint(cfg.ori_height - cfg.height + 1)
+    return (left, upper, left + cfg.width, upper + cfg.height)
+
+def _worker(buffer, shape, cache_bytes, tasks, done):
+    ring = np.frombuffer(buffer, np.uint8).reshape(shape)
+    cache = LRUCache(cache_bytes) if cache_bytes > 0 else None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        slot, stream, item, path, flip, crop_box = task
+        hit, failed = False, False
+        try:
+            ring[slot, stream, item], hit = cached_decode(cache, path, flip, crop_box)
+        except Exception as e:
+            # The batch keeps a black image, the failure is counted by the loader
+            print('Loader failed to decode %s: %s' % (path, e))
+            ring[slot, stream, item] = 0
+            failed = True
+        done.put((slot, hit, failed))
+
+class SharedLoader(object):
+    """Process pool decoding batches into a ring of shared memory buffers
+
+    Every stream (e.g. profile and front) is a list of image paths read in
+    order, batch k holding images k*batch_size ... (k+1)*batch_size-1 modulo
+    the list length. Workers decode single images straight into a ring of
+    'ring' preallocated uint8 batches, so 'ring - 1' batches are prefetched
+    while the last one is used.
+
+    'get' returns views of the shared buffer, no copy is made. They are
+    valid until the next call to 'get', which gives their slot back to the
+    workers. Images that fail to decode are black and counted in 'failures'.
+
+    Workers are forked by the constructor. Create loaders before the TF
+    session, queue runners or any other thread: a forked child only has
+    the forking thread, and locks held by the others stay locked in it.
+
+    With a cache, every worker keeps an LRU cache of 'cache_bytes / workers'
+    and images are sent to workers by a hash of their path, so all streams
+    share the caches and no cache is shared between processes.
+
+    Without 'prefetch', nothing is decoded ahead and 'get_items' decodes
+    chosen images of the streams (e.g. the draws of a sampler) in parallel.
+
+    args:
+        streams: list of (paths, flip), flip tells whether to flip images
+                 horizontally at random.
+        crop_box: crop applied to every image, None for no crop.
+        workers: number of decoding processes.
+        cache_bytes: total budget of the decoded image caches, 0 for none.
+        prefetch: whether to decode the streams in order for 'get'.
+    """
+    def __init__(self, streams, batch_size, crop_box, ring=4, workers=4, cache_bytes=0, prefetch=True):
+        self.streams = streams
+        self.batch_size = batch_size
+        self.crop_box = crop_box
+        self.ring = ring
+        self.shape = (ring, len(streams), batch_size, cfg.height, cfg.width, cfg.channel)
+        self.buffer = multiprocessing.RawArray('B', int(np.prod(self.shape)))
+        self.batches = np.frombuffer(self.buffer, np.uint8).reshape(self.shape)
+
+        if threading.active_count() > 1:
+            print('Warning: loader workers forked with %d threads running' % threading.active_count())
+        self.tasks = [multiprocessing.Queue() for i in range(workers)]
+        self.done = multiprocessing.Queue()
+        self.workers = [multiprocessing.Process(target=_worker,
+                                                args=(self.buffer, self.shape, cache_bytes // workers,
+                                                      tasks, self.done))
+                        for tasks in self.tasks]
+        self.hits, self.misses, self.failures = 0, 0, 0
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+        self.decoded = [0] * ring
+        self.next_batch = 0
+        self.in_use = None
+        if prefetch:
+            for batch in range(ring):
+                self._schedule(batch)
+
+    def _put(self, slot, stream, item, path, flip, crop_box):
+        tasks = self.tasks[zlib.crc32(os.path.normpath(path).encode('utf-8')) % len(self.tasks)]
+        tasks.put((slot, stream, item, path, flip and np.random.random() > 0.5, crop_box))
+
+    def _schedule(self, batch):
+        slot = batch % self.ring
+        self.decoded[slot] = 0
+        for stream, (paths, flip) in enumerate(self.streams):
+            for item in range(self.batch_size):
+                self._put(slot, stream, item, paths[(batch * self.batch_size + item) % len(paths)], flip,
+                          self.crop_box)
+
+    def _wait(self, slot):
+        while self.decoded[slot] < len(self.streams) * self.batch_size:
+            done, hit, failed = self.done.get()
+            self.decoded[done] += 1
+            self.hits += hit
+            self.misses += not hit
+            self.failures += failed
+
+    def get_items(self, items, crop_boxes):
+        """Chosen images of every stream, for a loader without prefetch
+
+        The views returned are valid until the next call.
+
+        args:
+            items: per stream, 'batch_size' positions in its paths.
+            crop_boxes: per stream, a crop box per item.
+        return:
+            one uint8 array (batch, height, width, channel) per stream
+        """
+        self.decoded[0] = 0
+        for stream, ((paths, flip), positions, boxes) in enumerate(zip(self.streams, items, crop_boxes)):
+            for item, (position, crop_box) in enumerate(zip(positions, boxes)):
+                self._put(0, stream, item, paths[position], flip, crop_box)
+        self._wait(0)
+        return [self.batches[0, stream] for stream in range(len(self.streams))]
+
+    def get(self):
+        """Next batch, one uint8 array (batch, height, width, channel) per stream"""
+        # The batch handed out last time is done with, its slot prefetches again
+        if self.in_use is not None:
+            self._schedule(self.in_use + self.ring)
+        slot = self.next_batch % self.ring
+        self._wait(slot)
+        self.in_use = self.next_batch
+        self.next_batch += 1
+        return [self.batches[slot, stream] for stream in range(len(self.streams))]
+
+    def stats(self):
+        """Hit statistics of the worker caches and decode failures"""
+        return cache_stats(self.hits, self.misses, self.failures)
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join()
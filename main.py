@@ -1,80 +1,246 @@
 #coding: utf-8
+import time
+start_time = time.time()
 import os
+import json
+import random
 import tensorflow as tf
-from config import cfg
-from WGAN_GP import WGAN_GP
+from config import cfg, session_config
+from telemetry import startup, StepMetrics, TimeToTarget
+from schedule import ProgressiveSchedule, CriticScheduler
+from sampler import LossSampler
+import graph_cache
+import checkpoint
+from tracing import Tracer
+startup.add('imports', time.time() - start_time)
 
 # Training Setting
-test_num = 800 / cfg.batch_size
+PHASES = ['critic', 'generator', 'summary', 'test', 'checkpoint']
+GAUGES = ['queue_fill', 'fea_loss', 'd_loss', 'g_loss', 'critic', 'decode_failures']
+
+def critic_range():
+    """Fewest and most D steps per G step of the adaptive critic schedule
+
+    The defaults are on both sides of '--critic', for comparison with it.
+    """
+    low = cfg.critic_min if cfg.critic_min > 0 else max(cfg.critic // 2, 1)
+    high = cfg.critic_max if cfg.critic_max > 0 else 2 * cfg.critic
+    if low > high:
+        raise ValueError('--critic_min %d is above --critic_max %d' % (low, high))
+    return low, high
+
+def run_key():
+    """Setting of a run in the time-to-target results"""
+    critic = 'adaptive:%d-%d' % critic_range() if cfg.critic_adaptive else cfg.critic
+    return 'progressive=%s,sampler=%s,critic=%s,bs=%d' % (cfg.progressive or 'off', cfg.sampler, critic,
+                                                          cfg.batch_size)
+
+def log_order(order_log, names):
+    """Append the paths of a dequeued batch to the '--order_log' file"""
+    if order_log is not None:
+        order_log.write(''.join(name.decode('utf-8') + '\n' for name in names))
+        order_log.flush()
+
+def build_net(seed, cursor):
+    """Construct the network, or import it from the graph cache
+    
+    Model modules are only imported when the graph has to be built.
+    
+    args:
+        seed: seed of the train shuffle.
+        cursor: number of train images already consumed.
+    """
+    # Change these lines if 'LSGAN' or 'WGAN'
+    # Progressive stages are not part of the cached handles, and the cached
+    # readers of '--cache_mb' are Python functions, which a MetaGraph cannot hold
+    cacheable = cfg.graph_cache and not cfg.progressive and not cfg.cache_mb
+    path = graph_cache.cache_path('WGAN_GP') if cacheable else None
+    if path and os.path.exists(path):
+        with startup.phase('graph_import'):
+            return graph_cache.CachedNet(path, seed, cursor)
+    with startup.phase('model_imports'):
+        from WGAN_GP import WGAN_GP
+        from utils import loadData
+    with startup.phase('graph_build'):
+        net = WGAN_GP(loadData(batch_size=cfg.batch_size, seed=seed, cursor=cursor))
+    if path:
+        with startup.phase('graph_export'):
+            graph_cache.save(net, path)
+    return net
     
 def main(_):
     # Environment Setting
     os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
     os.environ["CUDA_VISIBLE_DEVICES"] = "3"
+    if cfg.ptx_cache:
+        # Keep the driver's PTX-to-SASS compilations across restarts. TF 1.x has
+        # no persistent XLA cache, so XLA cluster compilation is paid every start.
+        os.environ["CUDA_CACHE_PATH"] = cfg.ptx_cache
+        os.environ["CUDA_CACHE_MAXSIZE"] = "4294967296"
     if not os.path.exists(cfg.results):
         os.mkdir(cfg.results)
+    if cfg.auto_batch:
+        from batch_probe import load_batch_size
+        batch_size = load_batch_size('WGAN_GP')
+        if batch_size is None:
+            print('No probed batch size for this setting, run batch_probe.py first')
+        else:
+            cfg.batch_size = batch_size
+            print('Probed batch size: %d' % batch_size)
+    test_num = max(cfg.test_images // cfg.batch_size, 1)
+    
+    # Training state, continued from the finetuned checkpoint if it has one
+    state = checkpoint.load_state(cfg.model_path) if cfg.is_finetune and cfg.resume else None
+    resumed = state is not None
+    if resumed:
+        print('Resume from epoch %d, step %d' % (state['epoch'], state['step']))
+    else:
+        seed = cfg.seed if cfg.seed >= 0 else random.randint(0, 2**31 - 1)
+        state = {'epoch': 0, 'step': 0, 'iteration': 0, 'seed': seed, 'cursor': 0}
     
     # Construct Networks
-    # Change this line if 'LSGAN' or 'WGAN'
-    net = WGAN_GP()
+    net = build_net(state['seed'], state['cursor'])
+    if cfg.sampler and not hasattr(net, 'sample_weight'):
+        raise ValueError('--sampler needs the sample weights and profile distances of WGAN_GP')
     
     # Train and Test
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True
-    with tf.Session(config=config, graph=net.graph) as sess:
-        sess.run(tf.global_variables_initializer())
-        
-        # Start Thread
-        coord = tf.train.Coordinator()
-        threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+    with tf.Session(config=session_config(), graph=net.graph) as sess:
+        with startup.phase('session_init'):
+            checkpoint.initialize(sess)
+            
+            # Start Thread
+            coord = tf.train.Coordinator()
+            threads = tf.train.start_queue_runners(sess=sess, coord=coord)
         
-        saver = tf.train.Saver(max_to_keep=0) #
+        # Face model is restored from its npy file, not from checkpoints
+        ckpt = checkpoint.AsyncCheckpointer(net.graph, cfg.logdir, resumed)
         if cfg.is_finetune:
-            saver.restore(sess, cfg.model_path)
+            with startup.phase('weight_load'):
+                checkpoint.restore(sess, net.graph, cfg.model_path, cfg.restore_scope)
             print('Load Finetuned Model Successfully!')
+        with open(os.path.join(cfg.results, 'startup.json'), 'w') as f:
+            json.dump(startup.report('Startup'), f, indent=2)
             
-        num_batch = int(cfg.dataset_size / cfg.batch_size)
+        num_batch = int(net.data_feed.dataset_size / cfg.batch_size)
         writer = tf.summary.FileWriter(cfg.summary_dir, sess.graph)
+        metrics = StepMetrics(cfg.results, PHASES, GAUGES, cfg.metrics_port, cfg.log_every, cfg.metrics_rows)
+        tracer = Tracer(cfg.results, cfg.trace_steps)
+        schedule = ProgressiveSchedule(cfg.progressive, cfg.fade_epochs, num_batch) if cfg.progressive else None
+        target = TimeToTarget(cfg.results, run_key(), cfg.target_fea)
+        critic_scheduler = None
+        if cfg.critic_adaptive:
+            low, high = critic_range()
+            critic_scheduler = CriticScheduler(low, high, cfg.critic_tol, cfg.critic_gp_tol, cfg.critic_ratio)
+        # Generator batches drawn by their feature loss, D batches come from the queue
+        sampler = None
+        if cfg.sampler:
+            sampler = LossSampler(len(net.data_feed.sample_list), cfg.sampler_decay, cfg.sampler_mix)
+            if resumed and sampler.load(checkpoint.sidecar_path(cfg.model_path, 'sampler')):
+                print('Sampler state restored')
+        test_fl = None
+        # Consumed train profiles, fetched with every run that dequeues a batch
+        order_log = open(cfg.order_log, 'a') if cfg.order_log else None
+        names = net.train_names if order_log else []
                     
         # Train by minibatch and critic
-        for epoch in range(cfg.epoch):
-            for step in range(num_batch):                
-                # Discriminator Part
-                if(step < 25 and epoch == 0 and not cfg.is_finetune):
-                    critic = 25
-                else:
-                    critic = cfg.critic
-                for i in range(critic):
-                    # add 'net.clip_D' into ops if 'LSGAN' or 'WGAN'
-                    _ = sess.run(net.train_dis, {net.is_train:True}) # net.clip_D
+        cursor = state['cursor']
+        for epoch in range(state['epoch'], cfg.epoch):
+            for step in range(state['step'] if epoch == state['epoch'] else 0, num_batch):
+                iteration = epoch*num_batch + step
+                # Progressive stage, the full net once 224 is faded in
+                model, stage_feed = net, {}
+                if schedule:
+                    resolution, fade = schedule(iteration)
+                    if resolution != 224 or fade < 1:
+                        model = net.stages[resolution]
+                    stage_feed = {net.fade: fade}
+                train_feed = {net.is_train: True}
+                train_feed.update(stage_feed)
+                # Discriminator Part: 25 steps of warm-up, then fixed or adaptive
+                warmup = iteration < 25 and (resumed or not cfg.is_finetune)
+                tracer.begin(iteration)
+                with metrics.phase('critic'):
+                    if critic_scheduler and not warmup:
+                        critic_scheduler.start()
+                        while critic_scheduler.more():
+                            _, dl_, gp_, names_ = sess.run([model.train_dis, model.d_loss, model.grad4, names],
+                                                           train_feed, **tracer.run_args())
+                            log_order(order_log, names_)
+                            critic_scheduler.observe(dl_, gp_)
+                        critic = critic_scheduler.steps
+                    else:
+                        critic = 25 if warmup else cfg.critic
+                        for i in range(critic):
+                            # add 'net.clip_D' into ops if 'LSGAN' or 'WGAN'
+                            _, names_ = sess.run([model.train_dis, names], train_feed, **tracer.run_args()) # net.clip_D
+                            log_order(order_log, names_)
                 
                 # Generative Part
-                _,fl,gl,dl,gen,summary = sess.run([net.train_gen,net.feature_loss,net.g_loss,
-                                                  net.d_loss,net.gen_p,net.train_summary],
-                                                 {net.is_train:True})
-                writer.add_summary(summary, epoch*num_batch + step)
-                print('%d-%d, Fea Loss:%.2f, D Loss:%4.1f, G Loss:%4.1f' %  #g1/2/3:%.5f/%.5f/%.5f 
-                     (epoch, step, fl, dl, gl)) #g1*cfg.lambda_fea,g2,g4
+                with metrics.phase('generator'):
+                    gen_feed = dict(train_feed)
+                    if sampler:
+                        indices, weights = sampler.sample(cfg.batch_size)
+                        gen_feed[net.profile], gen_feed[net.front] = net.data_feed.get_train_pairs(indices)
+                        gen_feed[net.sample_weight] = weights
+                    _,fl,gl,dl,gen,summary,fill,distance,names_ = sess.run([model.train_gen,model.feature_loss,model.g_loss,
+                                                           model.d_loss,model.gen_p,model.train_summary,
+                                                           net.queue_fill,
+                                                           [model.profile_distance] if sampler else [],
+                                                           [] if sampler else names],
+                                                          gen_feed, **tracer.run_args())
+                    log_order(order_log, names_)
+                tracer.end()
+                # Every train run dequeues one batch, but a sampled G batch is fed
+                cursor += (critic + (0 if sampler else 1)) * cfg.batch_size
+                if sampler:
+                    sampler.update(indices, distance[0], iteration)
+                if critic_scheduler:
+                    critic_scheduler.generator(gl)
+                with metrics.phase('summary'):
+                    writer.add_summary(summary, iteration)
+                gauges = {'queue_fill': fill, 'fea_loss': fl, 'd_loss': dl, 'g_loss': gl, 'critic': critic,
+                          'decode_failures': net.data_feed.cache_stats()['decode_failures']}
                 
                 # Test Part
                 if step % cfg.test_sum_freq == 0:
-                    net.data_feed.save_train(gen)
-                    fl, dl, gl = 0., 0., 0.
-                    for i in range(test_num):
-                        te_profile, te_front = net.data_feed.get_test_batch(cfg.batch_size)
-                        dl_, gl_, fl_, images = sess.run([net.d_loss,net.g_loss,\
-                                                          net.feature_loss, net.gen_p],
-                                                          {net.profile:te_profile, net.front:te_front, net.is_train:False}) #
-                        net.data_feed.save_images(images, epoch)
-                        dl += dl_; gl += gl_; fl += fl_
-                    print('Testing: Fea Loss:%.1f, D Loss:%.1f, G Loss:%.1f' % (fl/test_num, dl/test_num, gl/test_num))
-                    
+                    with metrics.phase('test'):
+                        net.data_feed.save_train(gen)
+                        fl, dl, gl, sim = 0., 0., 0., 0.
+                        for i in range(test_num):
+                            te_profile, te_front = net.data_feed.get_test_batch(cfg.batch_size)
+                            test_feed = {net.profile:te_profile, net.front:te_front, net.is_train:False}
+                            test_feed.update(stage_feed)
+                            dl_, gl_, fl_, sim_, images = sess.run([model.d_loss,model.g_loss,\
+                                                                    model.feature_loss, model.identity_sim, model.gen_p],
+                                                                    test_feed) #
+                            net.data_feed.save_images(images, epoch)
+                            dl += dl_; gl += gl_; fl += fl_; sim += sim_
+                        print('Testing: Fea Loss:%.1f, D Loss:%.1f, G Loss:%.1f, Identity:%.3f' %
+                              (fl/test_num, dl/test_num, gl/test_num, sim/test_num))
+                        test_fl = float(fl/test_num)
+                        # Only the full net at 224 counts, lower stages have other losses
+                        if model is net:
+                            target.update(iteration, test_fl, float(sim/test_num))
+
                 # Save Model
                 if(step != 0 and step % cfg.save_freq == 0):
-                    print("Saving Model....")
-                    saver.save(sess, cfg.logdir + '-%02d' % (epoch)) #
+                    with metrics.phase('checkpoint'):
+                        print("Saving Model....")
+                        ckpt.save(sess, iteration, metric=test_fl,
+                                  state={'epoch': (iteration + 1) // num_batch, 'step': (iteration + 1) % num_batch,
+                                         'iteration': iteration + 1, 'seed': state['seed'], 'cursor': cursor},
+                                  arrays={'sampler': sampler.state()} if sampler else None)
+                        # Durations of the previous write, the current one is still running
+                        writer.add_summary(tf.Summary(value=[tf.Summary.Value(tag='ckpt/' + name, simple_value=value)
+                                                             for name, value in ckpt.stats.items()]),
+                                           iteration)
+                metrics.end_step(iteration, gauges)
         
         # Close Threads
+        if order_log is not None:
+            order_log.close()
+        ckpt.close()
+        metrics.close()
         coord.request_stop()
         coord.join(threads)
         
@@ -0,0 +1,201 @@
+#coding: utf-8
+import os
+import time
+import multiprocessing
+import numpy as np
+from PIL import Image
+from config import cfg
+
+# Every BLOCK-th path is stored in full, the others as the length of the
+# prefix shared with the previous path plus the rest (front coding)
+BLOCK = 16
+
+def data_lists():
+    """Name, list file and image directory of the lists read by loadData"""
+    return [('profile', cfg.profile_list, cfg.profile_path),
+            ('front', cfg.front_list, cfg.front_path),
+            ('test', cfg.test_list, cfg.test_path)]
+
+def read_list(list_file):
+    """Image names of a list file (first column)"""
+    with open(list_file) as f:
+        return [line.split(',')[0].strip() for line in f if line.strip()]
+
+def root_prefix(root):
+    """Prefix of the normalized paths of the images in 'root'"""
+    root = os.path.normpath(root)
+    return '' if root == '.' else root.rstrip('/') + '/'
+
+def check_image(path):
+    """Size of a image, None if it is missing or does not decode
+
+    JPEGs are decoded at 1/8 scale, which checks the whole stream quickly.
+    """
+    try:
+        img = Image.open(path)
+        size = img.size
+        if img.format == 'JPEG':
+            img.draft(img.mode, (max(size[0] // 8, 1), max(size[1] // 8, 1)))
+        img.load()
+        return size
+    except Exception:
+        return None
+
+def front_code(paths):
+    """Front coding of sorted paths
+
+    return:
+        prefix lengths (uint16), offsets of the rests (int64, one more than
+        the paths) and the rests concatenated (uint8)
+    """
+    prefix = np.zeros(len(paths), np.uint16)
+    rests, previous = [], b''
+    for i, path in enumerate(paths):
+        path = path.encode('utf-8')
+        if i % BLOCK:
+            shared = os.path.commonprefix([previous, path])
+            prefix[i] = min(len(shared), 65535)
+        rests.append(path[prefix[i]:])
+        previous = path
+    offsets = np.zeros(len(paths) + 1, np.int64)
+    offsets[1:] = np.cumsum([len(rest) for rest in rests])
+    data = np.frombuffer(b''.join(rests), np.uint8) if rests else np.zeros(0, np.uint8)
+    return prefix, offsets, data
+
+def sources_key():
+    """List files and their size and mtime, the manifest is rebuilt when they change"""
+    key = []
+    for name, list_file, root in data_lists():
+        stat = os.stat(list_file)
+        key.append('%s:%s:%s:%d:%d' % (name, list_file, root, stat.st_size, int(stat.st_mtime)))
+    return np.array(key)
+
+def build(path, workers=None):
+    """Scan the data lists, check their images and write the manifest
+
+    Paths of all lists are deduplicated (profile and front lists often name
+    the same files), checked in parallel, then stored front-coded in sorted
+    order with the image sizes. Every list is an index array into the
+    paths, images that are missing or do not decode are left out. Names are
+    stored under their image directory, entries outside it (absolute or
+    with '..') are an error.
+    """
+    start = time.time()
+    lists = [(name, root, [os.path.normpath(os.path.join(root, image)) for image in read_list(list_file)])
+             for name, list_file, root in data_lists()]
+    for name, root, images in lists:
+        outside = [image for image in images if not image.startswith(root_prefix(root))]
+        if outside:
+            raise ValueError('Manifest: %d images of the %s list are outside %s, e.g. %s' %
+                             (len(outside), name, root, outside[0]))
+    paths = sorted(set(image for _, _, images in lists for image in images))
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count())
+    sizes = pool.map(check_image, paths, chunksize=256)
+    pool.close()
+    pool.join()
+
+    valid = np.array([size is not None for size in sizes], bool)
+    arrays = {'sizes': np.array([size or (0, 0) for size in sizes], np.int32).reshape(-1, 2),
+              'valid': valid, 'sources': sources_key()}
+    arrays['prefix'], arrays['offsets'], arrays['data'] = front_code(paths)
+    position = dict((image, i) for i, image in enumerate(paths))
+    for name, root, images in lists:
+        index = np.array([position[image] for image in images], np.int64)
+        dropped = len(index) - valid[index].sum()
+        if dropped:
+            print('Manifest: %d images of the %s list are missing or broken' % (dropped, name))
+        arrays['list_' + name] = index[valid[index]]
+        arrays['root_' + name] = np.array(os.path.normpath(root))
+
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.rename(tmp, path)
+    print('Manifest of %d images written to %s in %.1fs' % (len(paths), path, time.time() - start))
+
+class Manifest(object):
+    """Image paths and sizes of the data lists, loaded from a manifest file
+
+    The file is built by 'build' when it is missing or its lists changed.
+
+    usage:
+        manifest = Manifest(cfg.manifest)
+        names = manifest.names('profile')
+    """
+    def __init__(self, path):
+        self.arrays = self._load(path)
+        if self.arrays is None:
+            build(path, cfg.loader_workers or None)
+            self.arrays = self._load(path)
+        self.prefix, self.offsets, self.data = self.arrays['prefix'], self.arrays['offsets'], self.arrays['data']
+        self.sizes = self.arrays['sizes']
+        self._matrix = None
+
+    def _load(self, path):
+        """Arrays of the manifest file, None if it is missing or stale"""
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        if list(data['sources']) != list(sources_key()):
+            return None
+        return dict((key, data[key]) for key in data.files)
+
+    def __len__(self):
+        return len(self.prefix)
+
+    def _rest(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def path(self, i):
+        """Path of entry i, rebuilt from the start of its block"""
+        path = b''
+        for j in range(i - i % BLOCK, i + 1):
+            path = path[:self.prefix[j]] + self._rest(j)
+        return path if isinstance(path, str) else path.decode('utf-8')
+
+    def matrix(self):
+        """All paths as rows of a zero-padded uint8 matrix
+
+        Entries are decoded by their position in the block, each position
+        in one vectorized step over all blocks: BLOCK numpy steps instead
+        of a Python step per entry.
+        """
+        if self._matrix is None:
+            prefix, rest = self.prefix.astype(np.int64), np.diff(self.offsets)
+            width = int((prefix + rest).max()) if len(self) else 0
+            self._matrix = np.zeros((len(self), width), np.uint8)
+            columns = np.arange(width)[None, :]
+            for position in range(min(BLOCK, len(self))):
+                rows = np.arange(position, len(self), BLOCK)
+                # Column c of a row is byte c - prefix of its rest, or the previous path below prefix
+                shift = columns - prefix[rows, None]
+                inside = (shift >= 0) & (shift < rest[rows, None])
+                source = np.minimum(self.offsets[rows, None] + np.maximum(shift, 0), max(len(self.data) - 1, 0))
+                values = np.where(inside, self.data[source] if len(self.data) else 0, 0).astype(np.uint8)
+                if position:
+                    values = np.where(shift < 0, self._matrix[rows - 1], values)
+                self._matrix[rows] = values
+        return self._matrix
+
+    def paths(self):
+        """All paths, decoded in one pass"""
+        return strings(self.matrix())
+
+    def names(self, list_name):
+        """Image names of a list relative to its image directory, in list order"""
+        prefix = np.frombuffer(root_prefix(str(self.arrays['root_' + list_name])).encode('utf-8'), np.uint8)
+        rows = self.matrix()[self.arrays['list_' + list_name]]
+        if len(rows) and (rows.shape[1] < len(prefix) or (rows[:, :len(prefix)] != prefix).any()):
+            raise ValueError('Manifest: paths of the %s list are not all under %s, rebuild it' %
+                             (list_name, self.arrays['root_' + list_name]))
+        return strings(rows[:, len(prefix):])
+
+    def count(self, list_name):
+        return len(self.arrays['list_' + list_name])
+
+def strings(matrix):
+    """Rows of a zero-padded uint8 matrix as an array of str"""
+    matrix = np.ascontiguousarray(matrix)
+    if matrix.shape[1] == 0:
+        return np.array([''] * len(matrix))
+    strings = matrix.view('S%d' % matrix.shape[1])[:, 0]
+    return strings if str is bytes else np.char.decode(strings, 'utf-8')
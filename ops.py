@@ -1,10 +1,98 @@
 #coding:utf-8
 import math
+import contextlib
 import numpy as np 
 import tensorflow as tf
 from config import cfg
 import tensorflow.contrib.slim as slim
 
+# Compute precisions of the frozen face model; int8 fake-quantizes the
+# weights and computes in float32
+PRECISION = {'fp32': tf.float32, 'fp16': tf.float16, 'int8': tf.float32}
+
+def cast_frozen(var, dtype, cache):
+    """Cast a frozen parameter to 'dtype'
+    
+    The cast is created once per parameter and dtype and shared by every 
+    forward pass through 'cache', as the frozen weights never change.
+    """
+    if dtype == var.dtype.base_dtype:
+        return var
+    key = (var.name, dtype)
+    if key not in cache:
+        with tf.name_scope(None):
+            cache[key] = tf.cast(var, dtype, name=var.op.name + '_' + dtype.name)
+    return cache[key]
+
+def quantize_frozen(var, cache):
+    """Symmetric int8 fake-quantization of a frozen weight, per output channel
+
+    Weights are rounded to 255 levels in [-max|w|, max|w|] of their channel
+    (the last axis, the third one of depthwise filters) and dequantized, so
+    the pass shows the accuracy of int8 weights but not their speed.
+    Biases keep full precision.
+    """
+    shape = var.get_shape().as_list()
+    if len(shape) < 2:
+        return var
+    key = (var.name, 'int8')
+    if key not in cache:
+        channel = 2 if len(shape) == 4 and shape[-1] == 1 else len(shape) - 1
+        axes = [i for i in range(len(shape)) if i != channel]
+        with tf.name_scope(None):
+            with tf.name_scope(var.op.name + '_int8'):
+                scale = tf.maximum(tf.reduce_max(tf.abs(var), axes, keep_dims=True) / 127., 1e-12)
+                cache[key] = tf.round(var / scale) * scale
+    return cache[key]
+
+def frozen_param(var, precision, cache):
+    """A frozen parameter as used by a pass in 'precision' (a PRECISION key)"""
+    if precision == 'int8':
+        return quantize_frozen(var, cache)
+    return cast_frozen(var, PRECISION[precision], cache)
+
+# Attention areas of aligned 224x224 faces: name, top, left, height, width
+FACE_REGIONS = [('eyes', 64, 50, 36, 124),
+                ('nose', 75, 90, 65, 44),
+                ('mouth', 140, 75, 30, 74),
+                ('face', 64, 50, 116, 124)]
+
+def scaled_regions(resolution):
+    """FACE_REGIONS of images of size 'resolution' (they are given at 224)"""
+    scale = resolution / 224.
+    return [(name, int(round(top * scale)), int(round(left * scale)),
+             max(int(round(height * scale)), 1), max(int(round(width * scale)), 1))
+            for name, top, left, height, width in FACE_REGIONS]
+
+def dis_fc_scope(resolution):
+    """Scope of the fully connected layers of D, one per input resolution"""
+    return 'd_fc' if resolution == 224 else 'd_fc_%d' % resolution
+
+def used_vars(tensors, var_list):
+    """Variables of 'var_list' that 'tensors' are computed from"""
+    ops, stack = set(), [tensor.op for tensor in tensors]
+    while stack:
+        op = stack.pop()
+        if op not in ops:
+            ops.add(op)
+            stack.extend(tensor.op for tensor in op.inputs)
+            stack.extend(op.control_inputs)
+    return [var for var in var_list if var.op in ops]
+
+@contextlib.contextmanager
+def no_scope():
+    yield
+
+def jit_scope():
+    """XLA JIT scope for the encoder, decoder and discriminator if '--xla=scoped'
+    
+    Gradients of ops in the scope are compiled too, so both the D step and 
+    the G step run the model in XLA clusters.
+    """
+    if cfg.xla == 'scoped':
+        return tf.contrib.compiler.jit.experimental_jit_scope(compile_ops=True)
+    return no_scope()
+
 def instance_norm(input, train=True, name="instance_norm"):
     with tf.variable_scope(name):
         depth = input.get_shape()[3]
@@ -64,11 +152,13 @@ class batch_norm_mosv(object):
             self.variance = mosv_dict['variance']
             self.epsilon = 1e-5
     def __call__(self, x):
+        # Parameters follow the precision of the input
+        dtype = x.dtype.base_dtype.as_numpy_dtype
         return tf.nn.batch_normalization(x, 
-                                         mean=self.mean, 
-                                         variance=self.variance, 
-                                         offset=self.offset, 
-                                         scale=self.scale, 
+                                         mean=self.mean.astype(dtype), 
+                                         variance=self.variance.astype(dtype), 
+                                         offset=self.offset.astype(dtype), 
+                                         scale=self.scale.astype(dtype), 
                                          variance_epsilon=self.epsilon, 
                                          name=self.name)
                           
@@ -130,7 +220,7 @@ def deconv2d_w(input_, output_shape,
                                 strides=[1, d_h, d_w, 1])
 
         biases = tf.get_variable('biases', [output_shape[-1]], initializer=tf.constant_initializer(0.0))
-        deconv = tf.reshape(tf.nn.bias_add(deconv, biases), deconv.get_shape())
+        deconv = tf.nn.bias_add(deconv, biases)
 
         if with_w:
             return deconv, w, biases
@@ -150,6 +240,15 @@ def fullyConnect(inputs, units, name, bias=cfg.use_bias, trainable = True, activ
 def lrelu(x, leak=0.2, name="lrelu"):
     return tf.maximum(x, leak*x)
 
+def to_rgb(x, name):
+    """1x1 convolution to an image in range [0, 255]"""
+    with tf.variable_scope(name):
+        return (tf.nn.tanh(conv2d(x, 3, 'pw_conv', kernel_size=1, strides=1)) + 1) * 127.5
+
+def flatten(x):
+    """Reshape to (batch, features), the batch dimension may be unknown"""
+    return tf.reshape(x, [-1, int(np.prod(x.get_shape().as_list()[1:]))])
+
 def res_block(inputs, name, is_train, normal='bn',kernel_size = 3,
               strides = 1, padding='same', bias=cfg.use_bias):
     """Residual block with batch normalization or instance norm"""
@@ -171,3 +270,43 @@ def res_block_ln(inputs, name, kernel_size = 3, strides = 1, padding='same', bia
         conv2 = slim.layer_norm(conv2d(conv1, filters, 'conv2', 
                                 kernel_size=kernel_size, strides = strides))     
         return tf.nn.relu(tf.add(inputs, conv2))
+
+def shared_attention_dis(images, norm):
+    """Attention discriminator with a trunk shared by the five areas
+    
+    The first two convolutions (stride 4 in total) are computed once on the 
+    whole image and the areas of FACE_REGIONS are cropped from that feature 
+    map. Crop windows are snapped to the stride-4 grid, so the crop is a 
+    plain slice and stays twice differentiable for the gradient penalty. 
+    Every area keeps its own head (the layers after 'd_conv1').
+    
+    args:
+        images: normalized images in range [-1, 1], shape (batch, 224, 224, c),
+                or a lower resolution for progressive training.
+        norm: normalize function, called as norm(x).
+    return:
+        logits of images, eyes, nose, mouth and face.
+    """
+    resolution = images.get_shape().as_list()[1]
+    with tf.variable_scope("trunk"):
+        with tf.variable_scope('d_conv0'):
+            t0 = lrelu(conv2d(images, 32, 'd_conv0', kernel_size=4, strides=2))
+        # t0 is (112 x 112 x 32)
+        with tf.variable_scope('d_conv1'):
+            t1 = lrelu(norm(conv2d(t0, 64, 'd_conv1', kernel_size=4, strides=2)))
+        # t1 is (56 x 56 x 64)
+    
+    def head(h, name, filters):
+        with tf.variable_scope(name):
+            for i, f in enumerate(filters):
+                with tf.variable_scope('d_conv%d' % (i + 2)):
+                    h = lrelu(norm(conv2d(h, f, 'd_conv%d' % (i + 2), kernel_size=4, strides=2)))
+            with tf.variable_scope(dis_fc_scope(resolution)):
+                h = flatten(h)
+                return fullyConnect(h, 1, 'd_fc')
+    
+    logits = [head(t1, 'images', [128, 256, 256])]
+    for name, top, left, height, width in scaled_regions(resolution):
+        area = tf.slice(t1, [0, top // 4, left // 4, 0], [-1, (height + 3) // 4, (width + 3) // 4, 64])
+        logits.append(head(area, name, [128, 256]))
+    return tuple(logits)
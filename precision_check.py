@@ -0,0 +1,102 @@
+#coding: utf-8
+import os
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from config import cfg, session_config
+from checkpoint import initialize
+from utils import loadData
+from resnet50 import Resnet50
+from lightface import LightFace
+from ops import PRECISION
+
+epsilon = 1e-9
+
+def feature_distance(pool5_a, pool5_b):
+    """Cosine distance of pool5 features as in 'loss()' of the GAN classes"""
+    a = pool5_a / (tf.norm(pool5_a, axis=1, keep_dims=True) + epsilon)
+    b = pool5_b / (tf.norm(pool5_b, axis=1, keep_dims=True) + epsilon)
+    return 1 - tf.reduce_sum(tf.multiply(a, b), [1])
+
+def cosine(a, b):
+    a = a / (tf.norm(a, axis=1, keep_dims=True) + epsilon)
+    b = b / (tf.norm(b, axis=1, keep_dims=True) + epsilon)
+    return tf.reduce_sum(tf.multiply(a, b), [1])
+
+def main(_):
+    """Check how much each reduced precision encoder changes the feature loss
+
+    In training only the passes on real images ('profile_enc', 'front_enc')
+    run in 'cfg.enc_precision', while the passes on generated images stay in
+    float32. Here profile/front training pairs stand in for real/generated
+    pairs: the distance is computed with both images in float32 and with the
+    first one in each precision of PRECISION. Per precision the report has
+    the feature loss (mean distance) and its delta to float32, the largest
+    per-pair change of the distance, the pool5 cosine to the float32 pool5,
+    and the forward time of the two real-image passes.
+    """
+    if not os.path.exists(cfg.results):
+        os.mkdir(cfg.results)
+    data_feed = loadData(batch_size=cfg.batch_size, train_shuffle=True)
+    precisions = ['fp32'] + sorted(p for p in PRECISION if p != 'fp32')
+    graph = tf.Graph()
+    with graph.as_default():
+        with tf.variable_scope('face_model'):
+            if cfg.encoder == 'lightface':
+                face_model = LightFace(cfg.student_model)
+            else:
+                face_model = Resnet50()
+            face_model.build()
+        shape = [cfg.batch_size, cfg.height, cfg.width, cfg.channel]
+        profile = tf.placeholder(tf.float32, shape, 'profile')
+        front = tf.placeholder(tf.float32, shape, 'front')
+        target = face_model.forward(front, 'front_fp32')[-1]
+        pool5, dist, real_passes = {}, {}, {}
+        for precision in precisions:
+            pool5[precision] = face_model.forward(profile, 'profile_' + precision, precision)[-1]
+            dist[precision] = feature_distance(pool5[precision], target)
+            # Two passes on real images as in training
+            real_passes[precision] = [pool5[precision],
+                                      face_model.forward(front, 'front_' + precision, precision)[-1]]
+        pool5_cos = dict((p, cosine(pool5[p], pool5['fp32'])) for p in precisions)
+
+    def forward_time(sess, fetch, feed, iters=20):
+        sess.run(fetch, feed)
+        start = time.time()
+        for i in range(iters):
+            sess.run(fetch, feed)
+        return (time.time() - start) / iters
+
+    with tf.Session(config=session_config(), graph=graph) as sess:
+        initialize(sess)
+        distances = dict((p, []) for p in precisions)
+        cosines = dict((p, []) for p in precisions)
+        test_num = max(1, 800 // cfg.batch_size)
+        for i in range(test_num):
+            tr_profile, tr_front = data_feed.get_train_batch()
+            dist_, cos_ = sess.run([dist, pool5_cos], {profile: tr_profile, front: tr_front})
+            for p in precisions:
+                distances[p].append(dist_[p]); cosines[p].append(cos_[p])
+        feed = {profile: tr_profile, front: tr_front}
+        times = dict((p, forward_time(sess, real_passes[p], feed)) for p in precisions)
+
+    full = np.concatenate(distances['fp32'])
+    report = {'training_precision': cfg.enc_precision, 'pairs': len(full)}
+    for p in precisions:
+        d, cos = np.concatenate(distances[p]), np.concatenate(cosines[p])
+        report[p] = {'feature_loss': float(d.mean()),
+                     'feature_loss_delta': float(d.mean() - full.mean()),
+                     'feature_distance_std': float(d.std()),
+                     'feature_distance_max_abs_diff': float(np.abs(d - full).max()),
+                     'pool5_cosine': float(cos.mean()),
+                     'pool5_cosine_min': float(cos.min()),
+                     'real_passes_ms': 1000 * times[p]}
+        print('%s: feature loss %.6f (%+.6f), pool5 cosine %.6f (min %.6f), real passes %.1f ms'
+              % (p, report[p]['feature_loss'], report[p]['feature_loss_delta'], report[p]['pool5_cosine'],
+                 report[p]['pool5_cosine_min'], report[p]['real_passes_ms']))
+    with open(os.path.join(cfg.results, 'precision_report.json'), 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    tf.app.run()
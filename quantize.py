@@ -0,0 +1,111 @@
+#coding: utf-8
+import os
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from config import cfg
+from utils import loadData
+from inference import build_frontalizer, restore
+
+epsilon = 1e-9
+
+def cosine(a, b):
+    """Row-wise cosine similarity of two [batch, dim] arrays"""
+    a = a / (np.linalg.norm(a, axis=1, keepdims=True) + epsilon)
+    b = b / (np.linalg.norm(b, axis=1, keepdims=True) + epsilon)
+    return np.sum(a * b, axis=1)
+
+class TFLiteFrontalizer(object):
+    """Run the int8 frontalizer artifact with the TFLite interpreter"""
+    def __init__(self, model_content):
+        self.interpreter = tf.lite.Interpreter(model_content=model_content)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]['index']
+        # Outputs are told apart by rank: image [1,h,w,c] and pool5 [1,2048]
+        for detail in self.interpreter.get_output_details():
+            if len(detail['shape']) == 4:
+                self.gen = detail['index']
+            else:
+                self.pool5 = detail['index']
+
+    def __call__(self, image):
+        self.interpreter.set_tensor(self.input, image)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.gen), self.interpreter.get_tensor(self.pool5)
+
+def main(_):
+    """Post-training int8 quantization of the encoder and decoder
+
+    Weights are quantized per output channel and activation ranges are
+    calibrated on a random sample of 'cfg.test_list'. The quantized model
+    is written to 'cfg.quant_model', and a disjoint sample is used to
+    compare it with the float model on CPU:
+
+    1. pool5_cosine: encoder pool5 of the int8 model against the float model
+    2. identity_cosine: pool5 (float encoder) of the int8 and float outputs
+    3. pixel_mae: mean absolute difference of the generated images
+    4. latency of both models per image
+    """
+    if not os.path.exists(cfg.results):
+        os.mkdir(cfg.results)
+    data_feed = loadData(batch_size=1, train_shuffle=False)
+    test_list = np.random.permutation(data_feed.test_list)
+    calib_list = test_list[:cfg.quant_calib_num]
+    eval_list = test_list[cfg.quant_calib_num:cfg.quant_calib_num + cfg.quant_eval_num]
+    read = lambda name: data_feed.read_image(cfg.test_path + '/' + name)[np.newaxis]
+    # Latency leaves out the first run of each model, so at least two images
+    if len(eval_list) < 2:
+        raise ValueError('quantize needs at least 2 evaluation images, got %d (--quant_eval_num=%d, '
+                         '%d test images after calibration)' % (len(eval_list), cfg.quant_eval_num,
+                                                                max(len(test_list) - len(calib_list), 0)))
+
+    net = build_frontalizer(batch_size=1)
+    config = tf.ConfigProto(device_count={'GPU': 0})
+    with tf.Session(config=config, graph=net.graph) as sess:
+        restore(sess, net)
+
+        # Convert with int8 kernels only, calibrating on the representative set
+        converter = tf.lite.TFLiteConverter.from_session(sess, [net.profile], [net.gen_p, net.feature_p[-1]])
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([read(name)] for name in calib_list)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        tflite_model = converter.convert()
+        with open(cfg.quant_model, 'wb') as f:
+            f.write(tflite_model)
+        print('Quantized model saved to %s (%.1f MB)' % (cfg.quant_model, len(tflite_model) / 1e6))
+
+        # Accuracy and latency on CPU
+        quant_net = TFLiteFrontalizer(tflite_model)
+        pool5_cos, identity_cos, pixel_mae = [], [], []
+        float_time, quant_time = [], []
+        for name in eval_list:
+            image = read(name)
+            start = time.time()
+            gen_f, pool5_f = sess.run([net.gen_p, net.feature_p[-1]], {net.profile: image})
+            float_time.append(time.time() - start)
+            start = time.time()
+            gen_q, pool5_q = quant_net(image)
+            quant_time.append(time.time() - start)
+
+            id_f = sess.run(net.feature_p[-1], {net.profile: gen_f})
+            id_q = sess.run(net.feature_p[-1], {net.profile: gen_q})
+            pool5_cos.append(cosine(pool5_q, pool5_f)[0])
+            identity_cos.append(cosine(id_q, id_f)[0])
+            pixel_mae.append(np.mean(np.abs(gen_q - gen_f)))
+
+    # The first run of each model includes one-off setup, leave it out
+    report = {'pool5_cosine': float(np.mean(pool5_cos)),
+              'pool5_cosine_min': float(np.min(pool5_cos)),
+              'identity_cosine': float(np.mean(identity_cos)),
+              'pixel_mae': float(np.mean(pixel_mae)),
+              'float_latency_ms': 1000 * float(np.median(float_time[1:])),
+              'int8_latency_ms': 1000 * float(np.median(quant_time[1:])),
+              'calibration_images': len(calib_list), 'eval_images': len(eval_list)}
+    report['speedup'] = report['float_latency_ms'] / report['int8_latency_ms']
+    print('Quantization report: %s' % json.dumps(report, sort_keys=True))
+    with open(os.path.join(cfg.results, 'quant_report.json'), 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    tf.app.run()
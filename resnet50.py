@@ -3,10 +3,39 @@ import os
 import numpy as np
 import tensorflow as tf
 from ops import *
+from checkpoint import fed_variable
 
 VGG_MEAN = [131.0912, 103.8827, 91.4953] # for channel BGR
 #VGG_MEAN = [129.1836, 104.7624, 93.5940] # for channel BGR
 
+def resnet50_layout(init=np.zeros):
+    """Parameter dict with the layout of the VGGFace2 Resnet50 npy file
+
+    BatchNorm is the identity (zero mean, unit variance), convolution
+    weights come from 'init', a function of the shape.
+
+    usage:
+        model = Resnet50.__new__(Resnet50)
+        model.data_dict = resnet50_layout()
+    """
+    def conv(name, k, c_in, c_out):
+        data_dict[name] = {'weights': init([k, k, c_in, c_out]).astype(np.float32)}
+        data_dict[name + '_bn'] = {'mean': np.zeros(c_out, np.float32), 'variance': np.ones(c_out, np.float32),
+                                   'offset': np.zeros(c_out, np.float32), 'scale': np.ones(c_out, np.float32)}
+    data_dict = {}
+    conv('conv1_7x7_s2', 7, 3, 64)
+    c_in = 64
+    for stage, blocks, mid in [(2, 3, 64), (3, 4, 128), (4, 6, 256), (5, 3, 512)]:
+        for block in range(1, blocks + 1):
+            name = 'conv%d_%d' % (stage, block)
+            if block == 1:
+                conv(name + '_1x1_proj', 1, c_in, 4 * mid)
+            conv(name + '_1x1_reduce', 1, c_in, mid)
+            conv(name + '_3x3', 3, mid, mid)
+            conv(name + '_1x1_increase', 1, mid, 4 * mid)
+            c_in = 4 * mid
+    return data_dict
+
 class Resnet50(object):
     """Class for Resnet50 model trained on VGGFace2 dataset
     
@@ -219,16 +248,23 @@ class Resnet50(object):
         
         # Clear the model dict
         self.data_dict = None
+        # Reduced precision copies of the parameters, shared by all passes
+        self.cast_cache = {}
         
-    def forward(self, rgb, scope = 'resnet50'):
+    def forward(self, rgb, scope = 'resnet50', precision = 'fp32'):
         """Forward process of face recognition model
         
         args:
             rgb: rgb image tensors with shape(batch, height, width, 3), values range in [0,255]
+            precision: compute precision, 'fp32', 'fp16' or 'int8' (fake-quantized
+                       weights). Outputs are always float32.
         return:
             a set of tensors of layers
         """
+        dtype = PRECISION[precision]
+        w = lambda var: frozen_param(var, precision, self.cast_cache)
         with tf.name_scope(scope):
+            rgb = tf.cast(rgb, dtype)
             # Convert RGB to BGR as VGG model do
             assert rgb.get_shape().as_list()[1] == 224
             assert rgb.get_shape().as_list()[2] == 224
@@ -243,160 +279,160 @@ class Resnet50(object):
             
             # Construct Model
             with tf.name_scope('conv1'):
-                conv1_7x7_s2 = tf.nn.conv2d(bgr, self.conv1_7x7_s2_weights, [1,2,2,1], padding='SAME')
+                conv1_7x7_s2 = tf.nn.conv2d(bgr, w(self.conv1_7x7_s2_weights), [1,2,2,1], padding='SAME')
                 conv1_7x7_s2 = tf.nn.relu(self.bn1(conv1_7x7_s2))
             # output shape:[112, 112, 64]
             pool1_3x3_s2 = tf.layers.max_pooling2d(conv1_7x7_s2, 3, 2, padding='SAME')
             # output shape:[56, 56, 64]
             with tf.name_scope('conv2_1'):
-                conv2_1_proj = tf.nn.conv2d(pool1_3x3_s2, self.conv2_1_1x1_proj_weights, [1,1,1,1], padding='SAME')
+                conv2_1_proj = tf.nn.conv2d(pool1_3x3_s2, w(self.conv2_1_1x1_proj_weights), [1,1,1,1], padding='SAME')
                 conv2_1_proj = self.bn2_1_proj(conv2_1_proj)
-                conv2_1_1x1_reduce = tf.nn.conv2d(pool1_3x3_s2, self.conv2_1_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv2_1_1x1_reduce = tf.nn.conv2d(pool1_3x3_s2, w(self.conv2_1_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv2_1_1x1_reduce = tf.nn.relu(self.bn2_1_reduce(conv2_1_1x1_reduce))
-                conv2_1_3x3 = tf.nn.conv2d(conv2_1_1x1_reduce, self.conv2_1_3x3_weights, [1,1,1,1], padding='SAME')
+                conv2_1_3x3 = tf.nn.conv2d(conv2_1_1x1_reduce, w(self.conv2_1_3x3_weights), [1,1,1,1], padding='SAME')
                 conv2_1_3x3 = tf.nn.relu(self.bn2_1_3x3(conv2_1_3x3))
-                conv2_1_1x1_increase = tf.nn.conv2d(conv2_1_3x3, self.conv2_1_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv2_1_1x1_increase = tf.nn.conv2d(conv2_1_3x3, w(self.conv2_1_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv2_1_1x1_increase = self.bn2_1_increase(conv2_1_1x1_increase)
                 conv2_1 = tf.nn.relu(tf.add(conv2_1_1x1_increase, conv2_1_proj))
             # output shape:[56, 56, 256]
             with tf.name_scope('conv2_2'):
-                conv2_2_1x1_reduce = tf.nn.conv2d(conv2_1, self.conv2_2_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv2_2_1x1_reduce = tf.nn.conv2d(conv2_1, w(self.conv2_2_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv2_2_1x1_reduce = tf.nn.relu(self.bn2_2_reduce(conv2_2_1x1_reduce))
-                conv2_2_3x3 = tf.nn.conv2d(conv2_2_1x1_reduce, self.conv2_2_3x3_weights, [1,1,1,1], padding='SAME')
+                conv2_2_3x3 = tf.nn.conv2d(conv2_2_1x1_reduce, w(self.conv2_2_3x3_weights), [1,1,1,1], padding='SAME')
                 conv2_2_3x3 = tf.nn.relu(self.bn2_2_3x3(conv2_2_3x3))
-                conv2_2_1x1_increase = tf.nn.conv2d(conv2_2_3x3, self.conv2_2_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv2_2_1x1_increase = tf.nn.conv2d(conv2_2_3x3, w(self.conv2_2_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv2_2_1x1_increase = self.bn2_2_increase(conv2_2_1x1_increase)
                 conv2_2 = tf.nn.relu(tf.add(conv2_2_1x1_increase, conv2_1))
             # output shape:[56, 56, 256]
             with tf.name_scope('conv2_3'): 
-                conv2_3_1x1_reduce = tf.nn.conv2d(conv2_2, self.conv2_3_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv2_3_1x1_reduce = tf.nn.conv2d(conv2_2, w(self.conv2_3_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv2_3_1x1_reduce = tf.nn.relu(self.bn2_3_reduce(conv2_3_1x1_reduce))
-                conv2_3_3x3 = tf.nn.conv2d(conv2_3_1x1_reduce, self.conv2_3_3x3_weights, [1,1,1,1], padding='SAME')
+                conv2_3_3x3 = tf.nn.conv2d(conv2_3_1x1_reduce, w(self.conv2_3_3x3_weights), [1,1,1,1], padding='SAME')
                 conv2_3_3x3 = tf.nn.relu(self.bn2_3_3x3(conv2_3_3x3))
-                conv2_3_1x1_increase = tf.nn.conv2d(conv2_3_3x3, self.conv2_3_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv2_3_1x1_increase = tf.nn.conv2d(conv2_3_3x3, w(self.conv2_3_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv2_3_1x1_increase = self.bn2_3_increase(conv2_3_1x1_increase)
                 conv2_3 = tf.nn.relu(tf.add(conv2_3_1x1_increase, conv2_2))
             # output shape:[56, 56, 256]
             with tf.name_scope('conv3_1'):
-                conv3_1_proj = tf.nn.conv2d(conv2_3, self.conv3_1_1x1_proj_weights, [1,2,2,1], padding='SAME')
+                conv3_1_proj = tf.nn.conv2d(conv2_3, w(self.conv3_1_1x1_proj_weights), [1,2,2,1], padding='SAME')
                 conv3_1_proj = self.bn3_1_proj(conv3_1_proj)
-                conv3_1_1x1_reduce = tf.nn.conv2d(conv2_3, self.conv3_1_1x1_reduce_weights, [1,2,2,1], padding='SAME')
+                conv3_1_1x1_reduce = tf.nn.conv2d(conv2_3, w(self.conv3_1_1x1_reduce_weights), [1,2,2,1], padding='SAME')
                 conv3_1_1x1_reduce = tf.nn.relu(self.bn3_1_reduce(conv3_1_1x1_reduce))
-                conv3_1_3x3 = tf.nn.conv2d(conv3_1_1x1_reduce, self.conv3_1_3x3_weights, [1,1,1,1], padding='SAME')
+                conv3_1_3x3 = tf.nn.conv2d(conv3_1_1x1_reduce, w(self.conv3_1_3x3_weights), [1,1,1,1], padding='SAME')
                 conv3_1_3x3 = tf.nn.relu(self.bn3_1_3x3(conv3_1_3x3))
-                conv3_1_1x1_increase = tf.nn.conv2d(conv3_1_3x3, self.conv3_1_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv3_1_1x1_increase = tf.nn.conv2d(conv3_1_3x3, w(self.conv3_1_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv3_1_1x1_increase = self.bn3_1_increase(conv3_1_1x1_increase)
                 conv3_1 = tf.nn.relu(tf.add(conv3_1_1x1_increase, conv3_1_proj))
             # output shape:[28, 28, 512]
             with tf.name_scope('conv3_2'): 
-                conv3_2_1x1_reduce = tf.nn.conv2d(conv3_1, self.conv3_2_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv3_2_1x1_reduce = tf.nn.conv2d(conv3_1, w(self.conv3_2_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv3_2_1x1_reduce = tf.nn.relu(self.bn3_2_reduce(conv3_2_1x1_reduce))
-                conv3_2_3x3 = tf.nn.conv2d(conv3_2_1x1_reduce, self.conv3_2_3x3_weights, [1,1,1,1], padding='SAME')
+                conv3_2_3x3 = tf.nn.conv2d(conv3_2_1x1_reduce, w(self.conv3_2_3x3_weights), [1,1,1,1], padding='SAME')
                 conv3_2_3x3 = tf.nn.relu(self.bn3_2_3x3(conv3_2_3x3))
-                conv3_2_1x1_increase = tf.nn.conv2d(conv3_2_3x3, self.conv3_2_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv3_2_1x1_increase = tf.nn.conv2d(conv3_2_3x3, w(self.conv3_2_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv3_2_1x1_increase = self.bn3_2_increase(conv3_2_1x1_increase)
                 conv3_2 = tf.nn.relu(tf.add(conv3_2_1x1_increase, conv3_1)) 
             # output shape:[28, 28, 512]
             with tf.name_scope('conv3_3'): 
-                conv3_3_1x1_reduce = tf.nn.conv2d(conv3_2, self.conv3_3_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv3_3_1x1_reduce = tf.nn.conv2d(conv3_2, w(self.conv3_3_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv3_3_1x1_reduce = tf.nn.relu(self.bn3_3_reduce(conv3_3_1x1_reduce))
-                conv3_3_3x3 = tf.nn.conv2d(conv3_3_1x1_reduce, self.conv3_3_3x3_weights, [1,1,1,1], padding='SAME')
+                conv3_3_3x3 = tf.nn.conv2d(conv3_3_1x1_reduce, w(self.conv3_3_3x3_weights), [1,1,1,1], padding='SAME')
                 conv3_3_3x3 = tf.nn.relu(self.bn3_3_3x3(conv3_3_3x3))
-                conv3_3_1x1_increase = tf.nn.conv2d(conv3_3_3x3, self.conv3_3_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv3_3_1x1_increase = tf.nn.conv2d(conv3_3_3x3, w(self.conv3_3_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv3_3_1x1_increase = self.bn3_3_increase(conv3_3_1x1_increase)
                 conv3_3 = tf.nn.relu(tf.add(conv3_3_1x1_increase, conv3_2))
             # output shape:[28, 28, 512]
             with tf.name_scope('conv3_4'): 
-                conv3_4_1x1_reduce = tf.nn.conv2d(conv3_3, self.conv3_4_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv3_4_1x1_reduce = tf.nn.conv2d(conv3_3, w(self.conv3_4_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv3_4_1x1_reduce = tf.nn.relu(self.bn3_4_reduce(conv3_4_1x1_reduce))
-                conv3_4_3x3 = tf.nn.conv2d(conv3_4_1x1_reduce, self.conv3_4_3x3_weights, [1,1,1,1], padding='SAME')
+                conv3_4_3x3 = tf.nn.conv2d(conv3_4_1x1_reduce, w(self.conv3_4_3x3_weights), [1,1,1,1], padding='SAME')
                 conv3_4_3x3 = tf.nn.relu(self.bn3_4_3x3(conv3_4_3x3))
-                conv3_4_1x1_increase = tf.nn.conv2d(conv3_4_3x3, self.conv3_4_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv3_4_1x1_increase = tf.nn.conv2d(conv3_4_3x3, w(self.conv3_4_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv3_4_1x1_increase = self.bn3_4_increase(conv3_4_1x1_increase)
                 conv3_4 = tf.nn.relu(tf.add(conv3_4_1x1_increase, conv3_3))     
             # output shape:[28, 28, 512]
             with tf.name_scope('conv4_1'):
-                conv4_1_proj = tf.nn.conv2d(conv3_4, self.conv4_1_1x1_proj_weights, [1,2,2,1], padding='SAME')
+                conv4_1_proj = tf.nn.conv2d(conv3_4, w(self.conv4_1_1x1_proj_weights), [1,2,2,1], padding='SAME')
                 conv4_1_proj = self.bn4_1_proj(conv4_1_proj)
-                conv4_1_1x1_reduce = tf.nn.conv2d(conv3_4, self.conv4_1_1x1_reduce_weights, [1,2,2,1], padding='SAME')
+                conv4_1_1x1_reduce = tf.nn.conv2d(conv3_4, w(self.conv4_1_1x1_reduce_weights), [1,2,2,1], padding='SAME')
                 conv4_1_1x1_reduce = tf.nn.relu(self.bn4_1_reduce(conv4_1_1x1_reduce))
-                conv4_1_3x3 = tf.nn.conv2d(conv4_1_1x1_reduce, self.conv4_1_3x3_weights, [1,1,1,1], padding='SAME')
+                conv4_1_3x3 = tf.nn.conv2d(conv4_1_1x1_reduce, w(self.conv4_1_3x3_weights), [1,1,1,1], padding='SAME')
                 conv4_1_3x3 = tf.nn.relu(self.bn4_1_3x3(conv4_1_3x3))
-                conv4_1_1x1_increase = tf.nn.conv2d(conv4_1_3x3, self.conv4_1_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv4_1_1x1_increase = tf.nn.conv2d(conv4_1_3x3, w(self.conv4_1_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv4_1_1x1_increase = self.bn4_1_increase(conv4_1_1x1_increase)
                 conv4_1 = tf.nn.relu(tf.add(conv4_1_1x1_increase, conv4_1_proj))
             # output shape:[14, 14, 1024]
             with tf.name_scope('conv4_2'): 
-                conv4_2_1x1_reduce = tf.nn.conv2d(conv4_1, self.conv4_2_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv4_2_1x1_reduce = tf.nn.conv2d(conv4_1, w(self.conv4_2_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv4_2_1x1_reduce = tf.nn.relu(self.bn4_2_reduce(conv4_2_1x1_reduce))
-                conv4_2_3x3 = tf.nn.conv2d(conv4_2_1x1_reduce, self.conv4_2_3x3_weights, [1,1,1,1], padding='SAME')
+                conv4_2_3x3 = tf.nn.conv2d(conv4_2_1x1_reduce, w(self.conv4_2_3x3_weights), [1,1,1,1], padding='SAME')
                 conv4_2_3x3 = tf.nn.relu(self.bn4_2_3x3(conv4_2_3x3))
-                conv4_2_1x1_increase = tf.nn.conv2d(conv4_2_3x3, self.conv4_2_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv4_2_1x1_increase = tf.nn.conv2d(conv4_2_3x3, w(self.conv4_2_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv4_2_1x1_increase = self.bn4_2_increase(conv4_2_1x1_increase)
                 conv4_2 = tf.nn.relu(tf.add(conv4_2_1x1_increase, conv4_1)) 
             # output shape:[14, 14, 1024]
             with tf.name_scope('conv4_3'): 
-                conv4_3_1x1_reduce = tf.nn.conv2d(conv4_2, self.conv4_3_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv4_3_1x1_reduce = tf.nn.conv2d(conv4_2, w(self.conv4_3_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv4_3_1x1_reduce = tf.nn.relu(self.bn4_3_reduce(conv4_3_1x1_reduce))
-                conv4_3_3x3 = tf.nn.conv2d(conv4_3_1x1_reduce, self.conv4_3_3x3_weights, [1,1,1,1], padding='SAME')
+                conv4_3_3x3 = tf.nn.conv2d(conv4_3_1x1_reduce, w(self.conv4_3_3x3_weights), [1,1,1,1], padding='SAME')
                 conv4_3_3x3 = tf.nn.relu(self.bn4_3_3x3(conv4_3_3x3))
-                conv4_3_1x1_increase = tf.nn.conv2d(conv4_3_3x3, self.conv4_3_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv4_3_1x1_increase = tf.nn.conv2d(conv4_3_3x3, w(self.conv4_3_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv4_3_1x1_increase = self.bn4_3_increase(conv4_3_1x1_increase)
                 conv4_3 = tf.nn.relu(tf.add(conv4_3_1x1_increase, conv4_2)) 
             # output shape:[14, 14, 1024]
             with tf.name_scope('conv4_4'): 
-                conv4_4_1x1_reduce = tf.nn.conv2d(conv4_3, self.conv4_4_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv4_4_1x1_reduce = tf.nn.conv2d(conv4_3, w(self.conv4_4_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv4_4_1x1_reduce = tf.nn.relu(self.bn4_4_reduce(conv4_4_1x1_reduce))
-                conv4_4_3x3 = tf.nn.conv2d(conv4_4_1x1_reduce, self.conv4_4_3x3_weights, [1,1,1,1], padding='SAME')
+                conv4_4_3x3 = tf.nn.conv2d(conv4_4_1x1_reduce, w(self.conv4_4_3x3_weights), [1,1,1,1], padding='SAME')
                 conv4_4_3x3 = tf.nn.relu(self.bn4_4_3x3(conv4_4_3x3))
-                conv4_4_1x1_increase = tf.nn.conv2d(conv4_4_3x3, self.conv4_4_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv4_4_1x1_increase = tf.nn.conv2d(conv4_4_3x3, w(self.conv4_4_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv4_4_1x1_increase = self.bn4_4_increase(conv4_4_1x1_increase)
                 conv4_4 = tf.nn.relu(tf.add(conv4_4_1x1_increase, conv4_3))
             # output shape:[14, 14, 1024]
             with tf.name_scope('conv4_5'): 
-                conv4_5_1x1_reduce = tf.nn.conv2d(conv4_4, self.conv4_5_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv4_5_1x1_reduce = tf.nn.conv2d(conv4_4, w(self.conv4_5_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv4_5_1x1_reduce = tf.nn.relu(self.bn4_5_reduce(conv4_5_1x1_reduce))
-                conv4_5_3x3 = tf.nn.conv2d(conv4_5_1x1_reduce, self.conv4_5_3x3_weights, [1,1,1,1], padding='SAME')
+                conv4_5_3x3 = tf.nn.conv2d(conv4_5_1x1_reduce, w(self.conv4_5_3x3_weights), [1,1,1,1], padding='SAME')
                 conv4_5_3x3 = tf.nn.relu(self.bn4_5_3x3(conv4_5_3x3))
-                conv4_5_1x1_increase = tf.nn.conv2d(conv4_5_3x3, self.conv4_5_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv4_5_1x1_increase = tf.nn.conv2d(conv4_5_3x3, w(self.conv4_5_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv4_5_1x1_increase = self.bn4_5_increase(conv4_5_1x1_increase)
                 conv4_5 = tf.nn.relu(tf.add(conv4_5_1x1_increase, conv4_4)) 
             # output shape:[14, 14, 1024]
             with tf.name_scope('conv4_6'): 
-                conv4_6_1x1_reduce = tf.nn.conv2d(conv4_5, self.conv4_6_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv4_6_1x1_reduce = tf.nn.conv2d(conv4_5, w(self.conv4_6_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv4_6_1x1_reduce = tf.nn.relu(self.bn4_6_reduce(conv4_6_1x1_reduce))
-                conv4_6_3x3 = tf.nn.conv2d(conv4_6_1x1_reduce, self.conv4_6_3x3_weights, [1,1,1,1], padding='SAME')
+                conv4_6_3x3 = tf.nn.conv2d(conv4_6_1x1_reduce, w(self.conv4_6_3x3_weights), [1,1,1,1], padding='SAME')
                 conv4_6_3x3 = tf.nn.relu(self.bn4_6_3x3(conv4_6_3x3))
-                conv4_6_1x1_increase = tf.nn.conv2d(conv4_6_3x3, self.conv4_6_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv4_6_1x1_increase = tf.nn.conv2d(conv4_6_3x3, w(self.conv4_6_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv4_6_1x1_increase = self.bn4_6_increase(conv4_6_1x1_increase)
                 conv4_6 = tf.nn.relu(tf.add(conv4_6_1x1_increase, conv4_5)) 
             # output shape:[14, 14, 1024]
             with tf.name_scope('conv5_1'):
-                conv5_1_proj = tf.nn.conv2d(conv4_6, self.conv5_1_1x1_proj_weights, [1,2,2,1], padding='SAME')
+                conv5_1_proj = tf.nn.conv2d(conv4_6, w(self.conv5_1_1x1_proj_weights), [1,2,2,1], padding='SAME')
                 conv5_1_proj = self.bn5_1_proj(conv5_1_proj)
-                conv5_1_1x1_reduce = tf.nn.conv2d(conv4_6, self.conv5_1_1x1_reduce_weights, [1,2,2,1], padding='SAME')
+                conv5_1_1x1_reduce = tf.nn.conv2d(conv4_6, w(self.conv5_1_1x1_reduce_weights), [1,2,2,1], padding='SAME')
                 conv5_1_1x1_reduce = tf.nn.relu(self.bn5_1_reduce(conv5_1_1x1_reduce))
-                conv5_1_3x3 = tf.nn.conv2d(conv5_1_1x1_reduce, self.conv5_1_3x3_weights, [1,1,1,1], padding='SAME')
+                conv5_1_3x3 = tf.nn.conv2d(conv5_1_1x1_reduce, w(self.conv5_1_3x3_weights), [1,1,1,1], padding='SAME')
                 conv5_1_3x3 = tf.nn.relu(self.bn5_1_3x3(conv5_1_3x3))
-                conv5_1_1x1_increase = tf.nn.conv2d(conv5_1_3x3, self.conv5_1_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv5_1_1x1_increase = tf.nn.conv2d(conv5_1_3x3, w(self.conv5_1_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv5_1_1x1_increase = self.bn5_1_increase(conv5_1_1x1_increase)
                 conv5_1 = tf.nn.relu(tf.add(conv5_1_1x1_increase, conv5_1_proj))
             # output shape:[7, 7, 2048]
             with tf.name_scope('conv5_2'): 
-                conv5_2_1x1_reduce = tf.nn.conv2d(conv5_1, self.conv5_2_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv5_2_1x1_reduce = tf.nn.conv2d(conv5_1, w(self.conv5_2_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv5_2_1x1_reduce = tf.nn.relu(self.bn5_2_reduce(conv5_2_1x1_reduce))
-                conv5_2_3x3 = tf.nn.conv2d(conv5_2_1x1_reduce, self.conv5_2_3x3_weights, [1,1,1,1], padding='SAME')
+                conv5_2_3x3 = tf.nn.conv2d(conv5_2_1x1_reduce, w(self.conv5_2_3x3_weights), [1,1,1,1], padding='SAME')
                 conv5_2_3x3 = tf.nn.relu(self.bn5_2_3x3(conv5_2_3x3))
-                conv5_2_1x1_increase = tf.nn.conv2d(conv5_2_3x3, self.conv5_2_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv5_2_1x1_increase = tf.nn.conv2d(conv5_2_3x3, w(self.conv5_2_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv5_2_1x1_increase = self.bn5_2_increase(conv5_2_1x1_increase)
                 conv5_2 = tf.nn.relu(tf.add(conv5_2_1x1_increase, conv5_1))
             # output shape:[7, 7, 2048]
             with tf.name_scope('conv5_3'): 
-                conv5_3_1x1_reduce = tf.nn.conv2d(conv5_2, self.conv5_3_1x1_reduce_weights, [1,1,1,1], padding='SAME')
+                conv5_3_1x1_reduce = tf.nn.conv2d(conv5_2, w(self.conv5_3_1x1_reduce_weights), [1,1,1,1], padding='SAME')
                 conv5_3_1x1_reduce = tf.nn.relu(self.bn5_3_reduce(conv5_3_1x1_reduce))
-                conv5_3_3x3 = tf.nn.conv2d(conv5_3_1x1_reduce, self.conv5_3_3x3_weights, [1,1,1,1], padding='SAME')
+                conv5_3_3x3 = tf.nn.conv2d(conv5_3_1x1_reduce, w(self.conv5_3_3x3_weights), [1,1,1,1], padding='SAME')
                 conv5_3_3x3 = tf.nn.relu(self.bn5_3_3x3(conv5_3_3x3))
-                conv5_3_1x1_increase = tf.nn.conv2d(conv5_3_3x3, self.conv5_3_1x1_increase_weights, [1,1,1,1], padding='SAME')
+                conv5_3_1x1_increase = tf.nn.conv2d(conv5_3_3x3, w(self.conv5_3_1x1_increase_weights), [1,1,1,1], padding='SAME')
                 conv5_3_1x1_increase = self.bn5_3_increase(conv5_3_1x1_increase)
                 conv5_3 = tf.nn.relu(tf.add(conv5_3_1x1_increase, conv5_2)) 
             # output shape:[7, 7, 2048]
@@ -405,6 +441,9 @@ class Resnet50(object):
             pool5_7x7_s1 = tf.reshape(pool5_7x7_s1, [-1, dim])
             # output shape: [2048]
             assert pool5_7x7_s1.get_shape().as_list()[1:] == [2048]
+            if dtype != tf.float32:
+                conv3_4, conv4_6, conv5_3, pool5_7x7_s1 = [tf.cast(t, tf.float32) 
+                    for t in [conv3_4, conv4_6, conv5_3, pool5_7x7_s1]]
         
         return conv3_4, conv4_6, conv5_3, pool5_7x7_s1 # shape of 28,14,7,1
 
@@ -438,12 +477,13 @@ class Resnet50(object):
             return fc
 
     def get_filter_bias(self, name):
-        return tf.Variable(self.data_dict[name]['weights'], name="weights"), \
+        return fed_variable(self.data_dict[name]['weights'], "weights", '%s:%s/weights' % (cfg.face_model, name)), \
                    tf.constant(self.data_dict[name]['biases'], name="biases")
     
     def get_filter(self, name):
-        return tf.Variable(self.data_dict[name]['weights'], name="filter")
+        # Fed to the initializer, the weights are not stored in the graph
+        return fed_variable(self.data_dict[name]['weights'], "filter", '%s:%s/weights' % (cfg.face_model, name))
 
     def get_bias(self, name):
-        return tf.Variable(self.data_dict[name]['biases'], name="biases")
+        return fed_variable(self.data_dict[name]['biases'], "biases", '%s:%s/biases' % (cfg.face_model, name))
 
@@ -0,0 +1,78 @@
+#coding: utf-8
+import os
+import numpy as np
+
+class LossSampler(object):
+    """Draw train samples with probability proportional to their recent loss
+
+    The last per-example loss of every sample (e.g. 'profile_distance') is
+    kept as float16, with the iteration it was measured at. A loss measured
+    'age' iterations ago decays towards the mean loss by decay**age, as the
+    model has changed since. The loss distribution is mixed with a uniform
+    one ('mix'), so every sample keeps being drawn and the importance
+    weights 1 / (n * p), which keep the weighted loss unbiased, stay below
+    1 / mix. Samples never drawn get the largest loss seen so far.
+
+    usage:
+        indices, weights = sampler.sample(batch_size)
+        ... run the step with the weights, fetch the per-example losses ...
+        sampler.update(indices, losses, iteration)
+
+    args:
+        size: number of samples.
+        decay: staleness decay of a recorded loss per iteration.
+        mix: fraction of the uniform distribution in the draw.
+    """
+    def __init__(self, size, decay=0.999, mix=0.2):
+        self.losses = np.zeros(size, np.float16)
+        self.steps = np.zeros(size, np.uint32)
+        self.seen = np.zeros(size, bool)
+        self.decay, self.mix = decay, mix
+        self.iteration = 0
+
+    def __len__(self):
+        return len(self.losses)
+
+    def probabilities(self):
+        if not self.seen.any():
+            return np.full(len(self), 1. / len(self))
+        losses = self.losses.astype(np.float32)
+        mean = losses[self.seen].mean()
+        staleness = self.decay ** (self.iteration - self.steps).astype(np.float32)
+        priority = np.where(self.seen, mean + (losses - mean) * staleness, losses[self.seen].max())
+        priority = np.maximum(priority, 0.).astype(np.float64)
+        p = priority / max(priority.sum(), 1e-12)
+        return (1. - self.mix) * p + self.mix / len(self)
+
+    def sample(self, batch_size):
+        """Indices of a batch and their importance weights"""
+        p = self.probabilities()
+        indices = np.random.choice(len(self), batch_size, p=p)
+        weights = 1. / (len(self) * p[indices])
+        return indices, weights.astype(np.float32)
+
+    def update(self, indices, losses, iteration):
+        self.losses[indices] = losses
+        self.steps[indices] = iteration
+        self.seen[indices] = True
+        self.iteration = iteration
+
+    def state(self):
+        """Copy of the arrays of the state, saved with a checkpoint"""
+        return {'losses': self.losses.copy(), 'steps': self.steps.copy(), 'seen': self.seen.copy(),
+                'iteration': np.array(self.iteration)}
+
+    def load(self, path):
+        """Restore a saved state of the same number of samples, return whether it was
+
+        args:
+            path: npz file of 'state', None for none.
+        """
+        if path is None or not os.path.exists(path):
+            return False
+        state = np.load(path)
+        if len(state['losses']) != len(self):
+            return False
+        self.losses, self.steps, self.seen = state['losses'], state['steps'], state['seen']
+        self.iteration = int(state['iteration'])
+        return True
@@ -0,0 +1,102 @@
+#coding: utf-8
+
+def progressive_resolutions(spec):
+    """Resolutions of the progressive stages of '--progressive' ('' for none)
+
+    Full resolution (224) is a stage too, to fade in the last decoder stage.
+    Stages are decoder exits (56, 112) in ascending order.
+    """
+    if not spec:
+        return []
+    resolutions = [int(item.split(':')[0]) for item in spec.split(',')]
+    for resolution in resolutions:
+        if resolution not in (56, 112):
+            raise ValueError('No decoder exit at resolution %d in --progressive=%s' % (resolution, spec))
+    if resolutions != sorted(set(resolutions)):
+        raise ValueError('Resolutions of --progressive=%s must be ascending' % spec)
+    return resolutions + [224]
+
+class ProgressiveSchedule(object):
+    """Output resolution of progressive training at every iteration
+
+    Training starts at the first resolution of 'spec'. Every later stage
+    fades in from the upsampled output of the one below over 'fade'
+    epochs, the last stage (224) lasting until the end of training.
+
+    args:
+        spec: '<resolution>:<epochs>' of the stages below 224, e.g.
+              '56:1,112:2'. Resolutions are early exits of the decoder.
+        fade: epochs of the fade-in at the start of a stage.
+        num_batch: iterations per epoch.
+    """
+    def __init__(self, spec, fade, num_batch):
+        self.resolutions = progressive_resolutions(spec)
+        self.starts, start = [], 0
+        for item in spec.split(','):
+            epochs = item.split(':')[1]
+            self.starts.append(start)
+            start += int(float(epochs) * num_batch)
+        self.starts.append(start)
+        self.fade_steps = max(int(fade * num_batch), 1)
+
+    def __call__(self, iteration):
+        """Resolution and fade-in weight of the stage (1 once faded in)"""
+        stage = len([start for start in self.starts if start <= iteration]) - 1
+        if stage == 0:
+            return self.resolutions[0], 1.
+        fade = min((iteration - self.starts[stage] + 1.) / self.fade_steps, 1.)
+        return self.resolutions[stage], fade
+
+class CriticScheduler(object):
+    """Number of D steps per G step, chosen at runtime from training signals
+
+    D steps run until D is ahead of G, within [low, high] steps. D is
+    ahead when its last step
+    1. barely raised the Wasserstein estimate (-d_loss): the gain is below
+       'tol' times the running mean of the estimate, and the gradient norm
+       of the penalty (grad4) is within 'gp_tol' of 1, so the critic is
+       close to 1-Lipschitz and the estimate can be trusted, or
+    2. left the estimate above 'ratio' times the running mean of |g_loss|.
+
+    usage:
+        scheduler.start()
+        while scheduler.more():
+            d_loss, grad4 = sess.run([net.train_dis, net.d_loss, net.grad4])[1:]
+            scheduler.observe(d_loss, grad4)
+        scheduler.generator(g_loss)
+    """
+    def __init__(self, low=1, high=5, tol=0.05, gp_tol=0.2, ratio=2., momentum=0.9):
+        self.low, self.high = low, high
+        self.tol, self.gp_tol, self.ratio = tol, gp_tol, ratio
+        self.momentum = momentum
+        self.w_mean = None
+        self.g_mean = None
+        self.steps = 0
+
+    def _average(self, mean, value):
+        return value if mean is None else self.momentum * mean + (1 - self.momentum) * value
+
+    def start(self):
+        self.steps = 0
+        self.w_last = None
+        self.ahead = False
+
+    def more(self):
+        if self.steps < self.low:
+            return True
+        return self.steps < self.high and not self.ahead
+
+    def observe(self, d_loss, grad4):
+        """Signals of the D step just run"""
+        w = -float(d_loss)
+        self.steps += 1
+        converged = self.w_last is not None and w - self.w_last < self.tol * abs(self.w_mean) and \
+                    abs(float(grad4) - 1.) < self.gp_tol
+        dominant = self.g_mean is not None and abs(w) > self.ratio * abs(self.g_mean)
+        self.ahead = converged or dominant
+        self.w_last = w
+        self.w_mean = self._average(self.w_mean, w)
+
+    def generator(self, g_loss):
+        """Signal of the G step following the D steps"""
+        self.g_mean = self._average(self.g_mean, float(g_loss))
@@ -0,0 +1,233 @@
+#coding: utf-8
+import os
+import json
+import time
+import threading
+import collections
+import contextlib
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+class PhaseTimer(object):
+    """Wall-clock time of named phases
+
+    Phases can be nested, the time of an inner phase is not counted in
+    the outer one, so the totals add up to the elapsed time.
+
+    usage:
+        with timer.phase('graph_build'):
+            ...
+    """
+    def __init__(self):
+        self.totals = collections.OrderedDict()
+        self.counts = collections.OrderedDict()
+        self._stack = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        self._stack.append(0.)
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            inner = self._stack.pop()
+            self.add(name, elapsed - inner)
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def add(self, name, seconds):
+        self.totals[name] = self.totals.get(name, 0.) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def reset(self):
+        self.totals.clear()
+        self.counts.clear()
+
+    def report(self, title):
+        """Print the totals and return them as a dict"""
+        total = sum(self.totals.values())
+        print('%s: %.2fs' % (title, total))
+        for name, seconds in self.totals.items():
+            print('    %-16s %8.2fs  %5.1f%%' % (name, seconds, 100. * seconds / max(total, 1e-9)))
+        return dict(self.totals)
+
+# Startup phases of the training process: imports, weight load, graph build, session init
+startup = PhaseTimer()
+
+class _RollingFile(object):
+    """Append-only file moved to '<path>.1' after 'max_rows' rows"""
+    def __init__(self, path, max_rows, header=None):
+        self.path, self.max_rows, self.header = path, max_rows, header
+        self.rows = 0
+        self._open('a')
+
+    def _open(self, mode):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open(self.path, mode)
+        if new and self.header is not None:
+            self.file.write(self.header + '\n')
+
+    def write(self, line):
+        if self.max_rows > 0 and self.rows >= self.max_rows:
+            self.file.close()
+            os.rename(self.path, self.path + '.1')
+            self._open('w')
+            self.rows = 0
+        self.file.write(line + '\n')
+        self.file.flush()
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+class _PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StepMetrics(object):
+    """Phase times and gauges of every training step
+
+    Each step is one row (iteration, seconds of each phase, gauges such as
+    the input queue fill and the losses) appended to 'metrics.jsonl' and
+    'metrics.csv' in 'path', which roll over after 'max_rows' rows. With a
+    port, the latest step and the totals are served in the Prometheus text
+    format on http://127.0.0.1:<port>/metrics. A summary of the steps since
+    the last one is printed at most every 'log_every' seconds.
+
+    usage:
+        with metrics.phase('critic'):
+            ...
+        metrics.end_step(iteration, {'queue_fill': 0.9})
+
+    args:
+        phases: names of the phases, columns of the CSV file.
+        gauges: names of the gauges, columns of the CSV file.
+    """
+    def __init__(self, path, phases, gauges, port=0, log_every=30., max_rows=100000):
+        self.phases, self.gauges = list(phases), list(gauges)
+        self.log_every = log_every
+        self.timer = PhaseTimer()
+        self.window = PhaseTimer()
+        self.window_steps = 0
+        self.last_log = time.time()
+        self.last = {}
+        self.totals = dict((name, 0.) for name in self.phases)
+        self.steps = 0
+        self.lock = threading.Lock()
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.columns = ['iteration', 'time'] + self.phases + self.gauges
+        self.jsonl = _RollingFile(os.path.join(path, 'metrics.jsonl'), max_rows)
+        self.csv = _RollingFile(os.path.join(path, 'metrics.csv'), max_rows, ','.join(self.columns))
+
+        self.server = None
+        if port:
+            self.server = HTTPServer(('127.0.0.1', port), _PrometheusHandler)
+            self.server.metrics = self
+            thread = threading.Thread(target=self.server.serve_forever)
+            thread.daemon = True
+            thread.start()
+
+    def phase(self, name):
+        return self.timer.phase(name)
+
+    def end_step(self, iteration, gauges=None):
+        """Record the phases timed since the last call as one step"""
+        row = {'iteration': iteration, 'time': time.time()}
+        for name in self.phases:
+            row[name] = self.timer.totals.get(name, 0.)
+            self.window.add(name, row[name])
+        row.update(gauges or {})
+        self.timer.reset()
+        self.window_steps += 1
+
+        with self.lock:
+            self.last = row
+            self.steps += 1
+            for name in self.phases:
+                self.totals[name] += row[name]
+        self.jsonl.write(json.dumps(row, sort_keys=True))
+        self.csv.write(','.join('%s' % row.get(column, '') for column in self.columns))
+
+        if time.time() - self.last_log >= self.log_every:
+            self.log(row)
+
+    def log(self, row):
+        """Print the last gauges and the mean phase times since the last print"""
+        steps = max(self.window_steps, 1)
+        gauges = ', '.join('%s:%.3g' % (name, row[name]) for name in self.gauges if name in row)
+        phases = ', '.join('%s:%.1fms' % (name, 1000. * self.window.totals.get(name, 0.) / steps)
+                           for name in self.phases)
+        print('Step %d (%d steps in %.0fs), %s | %s' %
+              (row['iteration'], self.window_steps, time.time() - self.last_log, gauges, phases))
+        self.window.reset()
+        self.window_steps = 0
+        self.last_log = time.time()
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        with self.lock:
+            lines = ['# TYPE frontalization_steps_total counter',
+                     'frontalization_steps_total %d' % self.steps,
+                     '# TYPE frontalization_phase_seconds gauge']
+            lines += ['frontalization_phase_seconds{phase="%s"} %f' % (name, self.last.get(name, 0.))
+                      for name in self.phases]
+            lines.append('# TYPE frontalization_phase_seconds_total counter')
+            lines += ['frontalization_phase_seconds_total{phase="%s"} %f' % (name, self.totals[name])
+                      for name in self.phases]
+            for name in self.gauges:
+                if name in self.last:
+                    lines += ['# TYPE frontalization_%s gauge' % name,
+                              'frontalization_%s %f' % (name, self.last[name])]
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        self.jsonl.close()
+        self.csv.close()
+        if self.server is not None:
+            self.server.shutdown()
+
+class TimeToTarget(object):
+    """Wall-clock training time until the test feature loss reaches a target
+
+    The first time the target is reached, the time since the start, the
+    iteration and the identity similarity of the test set are stored in
+    'time_to_target.json' in 'path' under 'key' (the setting of the run),
+    next to the results of other settings.
+
+    args:
+        target: test feature loss to reach, 0 for none.
+    """
+    def __init__(self, path, key, target):
+        self.path = os.path.join(path, 'time_to_target.json')
+        self.key = key
+        self.target = target
+        self.start = time.time()
+        self.done = target <= 0
+
+    def update(self, iteration, fea_loss, identity_sim=None):
+        if self.done or fea_loss is None or fea_loss > self.target:
+            return
+        self.done = True
+        seconds = time.time() - self.start
+        results = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                results = json.load(f)
+        results[self.key] = {'target': self.target, 'seconds': seconds, 'iteration': iteration,
+                             'fea_loss': fea_loss, 'identity_sim': identity_sim}
+        with open(self.path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Feature loss %.3f reached at iteration %d after %.0fs' % (fea_loss, iteration, seconds))
@@ -0,0 +1,133 @@
+#coding: utf-8
+"""Kill and resume short training runs on the synthetic dataset
+
+usage:
+    python test_resume.py
+
+ResumeOrderTest checks the input pipeline alone and takes seconds.
+ResumeRunTest trains main.py three times on the synthetic dataset of
+benchmark.py (uninterrupted, killed, resumed), which takes minutes on CPU.
+Both use '--exact_order', the setting under which resume is exact.
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import subprocess
+import tensorflow as tf
+from config import cfg
+from checkpoint import initialize
+from utils import loadData
+from benchmark import make_synthetic
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BATCH = 2
+SEED = 7
+
+def synthetic_flags(root):
+    """Data and face model flags of the synthetic files in 'root'"""
+    images = os.path.join(root, 'images')
+    return {'profile_path': images, 'front_path': images, 'test_path': images,
+            'profile_list': os.path.join(root, 'profile.txt'), 'gt_list': os.path.join(root, 'profile.txt'),
+            'front_list': os.path.join(root, 'front.txt'), 'test_list': os.path.join(root, 'test.txt'),
+            'face_model': os.path.join(root, 'resnet50.npy')}
+
+class SyntheticTest(tf.test.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        make_synthetic(cls.root)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+class ResumeOrderTest(SyntheticTest):
+    """Batches dequeued from a cursor continue an interrupted input pipeline"""
+    def consume(self, cursor, batches):
+        """Profile paths of the first 'batches' batches from 'cursor', the rest of the queue is dropped"""
+        for flag, value in synthetic_flags(self.root).items():
+            setattr(cfg, flag, value)
+        cfg.exact_order = True
+        data_feed = loadData(batch_size=BATCH, seed=SEED, cursor=cursor)
+        graph = tf.Graph()
+        with graph.as_default():
+            data_feed.get_train()
+            with tf.Session(graph=graph) as sess:
+                initialize(sess)
+                coord = tf.train.Coordinator()
+                threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+                names = [name for i in range(batches) for name in sess.run(data_feed.train_names)]
+                coord.request_stop()
+                coord.join(threads)
+        return names
+
+    def test_order(self):
+        full = self.consume(0, 6)
+        self.assertEqual(len(set(full)), 6 * BATCH)
+        self.assertEqual(self.consume(0, 3) + self.consume(3 * BATCH, 3), full)
+
+class ResumeRunTest(SyntheticTest):
+    """main.py killed after a checkpoint and resumed matches an uninterrupted run"""
+    def train(self, name, order, resume=False, kill=False):
+        """Train one epoch of 4 steps in '<root>/<name>', saving after every step
+
+        args:
+            order: name of the order log in the run directory.
+            resume: continue from the latest checkpoint of the run.
+            kill: kill the process once its first checkpoint is complete.
+        return:
+            checkpoint directory of the run.
+        """
+        run_dir = os.path.join(self.root, name)
+        ckpt_dir = os.path.join(run_dir, 'ckpt')
+        if not os.path.exists(run_dir):
+            os.makedirs(run_dir)
+        flags = synthetic_flags(self.root)
+        flags.update({'batch_size': BATCH, 'dataset_size': 4 * BATCH, 'epoch': 1, 'save_freq': 1,
+                      'test_sum_freq': 1000, 'test_images': BATCH, 'exact_order': True, 'seed': SEED,
+                      'keep_checkpoints': 0, 'async_ckpt': False, 'graph_cache': '',
+                      'results': os.path.join(run_dir, 'results'), 'summary_dir': os.path.join(run_dir, 'summary'),
+                      'logdir': os.path.join(ckpt_dir, 'model'), 'order_log': os.path.join(run_dir, order),
+                      'is_finetune': resume, 'resume': resume, 'model_path': ckpt_dir, 'restore_scope': 'all'})
+        command = [sys.executable, os.path.join(HERE, 'main.py')] + \
+                  ['--%s=%s' % (flag, value) for flag, value in sorted(flags.items())]
+        with open(os.path.join(run_dir, order + '.out'), 'w') as out:
+            process = subprocess.Popen(command, cwd=HERE, stdout=out, stderr=subprocess.STDOUT)
+            while kill and process.poll() is None and tf.train.latest_checkpoint(ckpt_dir) is None:
+                time.sleep(0.1)
+            if kill and process.poll() is None:
+                process.kill()
+            code = process.wait()
+        if not kill:
+            self.assertEqual(code, 0, 'main.py failed, see %s.out' % os.path.join(run_dir, order))
+        return ckpt_dir
+
+    def read_lines(self, path):
+        with open(path) as f:
+            return f.read().splitlines()
+
+    def read_state(self, ckpt_dir):
+        """Training state and global step of the latest checkpoint"""
+        path = tf.train.latest_checkpoint(ckpt_dir)
+        with open(path + '.state.json') as f:
+            state = json.load(f)
+        return state, int(tf.train.NewCheckpointReader(path).get_tensor('global_step'))
+
+    def test_kill_resume(self):
+        full_dir = self.train('full', 'order.txt')
+        killed_dir = self.train('killed', 'order.txt', kill=True)
+        state, _ = self.read_state(killed_dir)
+        self.assertLess(state['iteration'], 4, 'the run ended before it was killed')
+        killed = self.read_lines(os.path.join(self.root, 'killed', 'order.txt'))[:state['cursor']]
+        self.train('killed', 'resumed.txt', resume=True)
+
+        resumed = self.read_lines(os.path.join(self.root, 'killed', 'resumed.txt'))
+        full = self.read_lines(os.path.join(self.root, 'full', 'order.txt'))
+        self.assertEqual(killed + resumed, full)
+        self.assertEqual(self.read_state(killed_dir), self.read_state(full_dir))
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,117 @@
+#coding: utf-8
+import os
+import re
+import json
+import signal
+import collections
+import tensorflow as tf
+from tensorflow.core.framework import step_stats_pb2
+from tensorflow.python.client import timeline
+
+def component_of(name):
+    """GAN component of an op, from its name scope
+
+    Encoder passes ('profile_enc', 'front_gen_enc', ...) are split, the
+    copies of the decoder and the discriminator built with reuse are merged,
+    and gradient ops are counted as the backward pass of their component.
+
+    example:
+        'gradients_1/discriminator_2/eyes/d_conv1/Conv2D_grad/Conv2DBackpropInput'
+        -> 'discriminator/eyes (backward)'
+    """
+    parts = name.split(':')[0].split('/')
+    top = re.sub(r'_\d+$', '', parts[0])
+    if top == 'gradients' and len(parts) > 1:
+        return component_of('/'.join(parts[1:])) + ' (backward)'
+    if top.endswith('_enc'):
+        return 'face_model/' + parts[0]
+    if top == 'discriminator' and len(parts) > 2:
+        return 'discriminator/' + parts[1]
+    if top.startswith('Adam') or top.startswith('beta1_power') or top.startswith('beta2_power'):
+        return 'optimizer/' + parts[0]
+    if top in ('decoder', 'discriminator', 'face_model', 'gp', 'Debug', 'loss', 'data_feed'):
+        return top
+    return 'other'
+
+def scope_costs(step_stats):
+    """Op time (ms) and op count per component of a traced run
+
+    On GPU only the 'stream:all' timelines are counted (with the CPU
+    devices), the other GPU streams repeat the same kernels.
+    """
+    devices = list(step_stats.dev_stats)
+    streams = [dev for dev in devices if dev.device.endswith('stream:all')]
+    if streams:
+        devices = streams + [dev for dev in devices if 'CPU' in dev.device.upper()]
+    costs = collections.defaultdict(lambda: [0., 0])
+    for dev in devices:
+        for node in dev.node_stats:
+            cost = costs[component_of(node.node_name)]
+            cost[0] += node.all_end_rel_micros / 1000.
+            cost[1] += 1
+    return dict((name, {'ms': ms, 'ops': ops}) for name, (ms, ops) in costs.items())
+
+class Tracer(object):
+    """Full op-level trace of chosen training steps
+
+    A step is traced when its iteration is in 'steps', or after the process
+    received SIGUSR1 ('kill -USR1 <pid>' traces the next step). Every run of
+    the step is traced, then a Chrome trace ('trace_<iteration>.json', open
+    it in chrome://tracing) and the cost per component of 'component_of'
+    ('trace_<iteration>_scopes.json') are written to 'path'.
+
+    usage:
+        tracer.begin(iteration)
+        sess.run(fetches, feed, **tracer.run_args())
+        tracer.end()
+
+    args:
+        steps: comma-separated iterations, e.g. '100,5000'.
+    """
+    def __init__(self, path, steps=''):
+        self.path = path
+        self.steps = set(int(step) for step in steps.split(',') if step.strip())
+        self.requested = False
+        self.iteration = None
+        self.metadata = []
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self._request)
+
+    def _request(self, signum, frame):
+        self.requested = True
+
+    def begin(self, iteration):
+        if iteration in self.steps or self.requested:
+            self.requested = False
+            self.iteration = iteration
+            self.metadata = []
+
+    def run_args(self):
+        """Keyword arguments of sess.run, empty when the step is not traced"""
+        if self.iteration is None:
+            return {}
+        self.metadata.append(tf.RunMetadata())
+        return {'options': tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                'run_metadata': self.metadata[-1]}
+
+    def end(self):
+        if self.iteration is None:
+            return
+        # Runs of a step share the clock, so their timelines are merged
+        step_stats = step_stats_pb2.StepStats()
+        for metadata in self.metadata:
+            step_stats.dev_stats.extend(metadata.step_stats.dev_stats)
+        prefix = os.path.join(self.path, 'trace_%d' % self.iteration)
+        with open(prefix + '.json', 'w') as f:
+            f.write(timeline.Timeline(step_stats).generate_chrome_trace_format())
+        costs = scope_costs(step_stats)
+        with open(prefix + '_scopes.json', 'w') as f:
+            json.dump(costs, f, indent=2, sort_keys=True)
+
+        total = sum(cost['ms'] for cost in costs.values())
+        print('Trace of step %d (%d runs): %.1f ms of ops' % (self.iteration, len(self.metadata), total))
+        for name, cost in sorted(costs.items(), key=lambda item: -item[1]['ms']):
+            print('    %-36s %9.2fms  %5.1f%%  %5d ops' %
+                  (name, cost['ms'], 100. * cost['ms'] / max(total, 1e-9), cost['ops']))
+        self.iteration = None
+        self.metadata = []
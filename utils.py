@@ -1,13 +1,52 @@
 #codingL utf-8
 import os
-import scipy
 import numpy as np
 import tensorflow as tf
 from PIL import Image
-import matplotlib.pyplot as plt
-import struct
 
 from config import cfg
+from loader import SharedLoader, LRUCache, cached_decode, cache_stats, random_crop_box
+from manifest import Manifest
+from checkpoint import fed_variable, initialize
+
+def decode_crop_jpeg(contents, random_crop=False):
+    """Decode the target size crop of a JPEG
+    
+    Images of the original size are crop-decoded, without decoding the
+    borders. Images of other sizes are decoded and resized to the original
+    size first, so the crop covers the same part of the aligned face.
+    
+    args:
+        contents: JPEG string tensor
+        random_crop: random crop if True, else center crop
+    return:
+        uint8 tensor of shape (height, width, channel)
+    """
+    if random_crop:
+        top = tf.random_uniform([], 0, cfg.ori_height - cfg.height + 1, tf.int32)
+        left = tf.random_uniform([], 0, cfg.ori_width - cfg.width + 1, tf.int32)
+    else:
+        top = tf.constant((cfg.ori_height - cfg.height) // 2)
+        left = tf.constant((cfg.ori_width - cfg.width) // 2)
+    
+    def crop_decode():
+        window = tf.stack([top, left, cfg.height, cfg.width])
+        return tf.image.decode_and_crop_jpeg(contents, window, channels=cfg.channel)
+    def resize_decode():
+        image = tf.image.decode_jpeg(contents, channels=cfg.channel)
+        image = tf.image.resize_images(image, [cfg.ori_height, cfg.ori_width])
+        image = tf.saturate_cast(tf.round(image), tf.uint8)
+        return tf.slice(image, tf.stack([top, left, 0]), [cfg.height, cfg.width, cfg.channel])
+    
+    size = tf.image.extract_jpeg_shape(contents)[:2]
+    original = tf.reduce_all(tf.equal(size, [cfg.ori_height, cfg.ori_width]))
+    image = tf.cond(original, crop_decode, resize_decode)
+    image.set_shape([cfg.height, cfg.width, cfg.channel])
+    return image
+
+def join_paths(root, names):
+    """Paths of an array of image names in 'root', joined without a Python loop"""
+    return np.char.add(root + '/', np.asarray(names))
 
 class loadData(object):
     """Class for loading data.
@@ -19,69 +58,165 @@ class loadData(object):
     Args:
         batch_size (int): size of every train batch
         train_shuffle (bool): whether to shuffle train set.
+        seed (int): seed of the shuffle, None for a random order.
+        cursor (int): number of train images already consumed, the train
+            lists start after them (used to resume training, see 'get_train').
         
     """
-    def __init__(self, batch_size = 20, train_shuffle = True):
+    def __init__(self, batch_size = 20, train_shuffle = True, seed = None, cursor = 0):
         self.batch_size = batch_size
-        self.profile = np.loadtxt(cfg.profile_list, dtype='string', delimiter=',')
-        self.front = np.loadtxt(cfg.front_list, dtype='string', delimiter=',')
+        self.seed = seed
+        if cfg.manifest:
+            manifest = Manifest(cfg.manifest)
+            self.profile = manifest.names('profile')
+            self.front = manifest.names('front')
+            self.test_list = manifest.names('test')
+        else:
+            self.profile = np.loadtxt(cfg.profile_list, dtype='string', delimiter=',')
+            self.front = np.loadtxt(cfg.front_list, dtype='string', delimiter=',')
+            self.test_list = np.loadtxt(cfg.test_list, dtype='string',delimiter=',') #
+        # Profiles in list order, indexed by the loss sampler
+        self.sample_list = np.array(self.profile)
+        # Number of train images, an epoch is one pass over the profiles
+        self.dataset_size = cfg.dataset_size if cfg.dataset_size > 0 else len(self.profile)
         
         if(train_shuffle): 
-            np.random.shuffle(self.profile)
-            np.random.shuffle(self.front)
+            rng = np.random.RandomState(seed) if seed is not None else np.random
+            rng.shuffle(self.profile)
+            rng.shuffle(self.front)
+        # Input producers cycle through the lists in order
+        if cursor:
+            self.profile = np.roll(self.profile, -(cursor % len(self.profile)))
+            self.front = np.roll(self.front, -(cursor % len(self.front)))
                          
-        self.test_list = np.loadtxt(cfg.test_list, dtype='string',delimiter=',') #
+        self.train_index = 0
         self.test_index = 0
+        self.train_loader = None
+        self.test_loader = None
+        self.sample_loader = None
+        # Decoded images shared by the profile, front and test readers of the
+        # main process. '--cache_mb' is the budget of all caches, the loader
+        # workers (train, test and sampler) get a share each.
+        loaders = (3 if cfg.sampler else 2) if cfg.loader_workers > 0 else 0
+        self.cache_bytes = cfg.cache_mb * 2**20 // (1 + loaders)
+        self.cache = LRUCache(self.cache_bytes) if cfg.cache_mb > 0 else None
         
         # Crop Box: left, upper, right, lower
         self.crop_box = [(cfg.ori_width - cfg.width) / 2, (cfg.ori_height - cfg.height) / 2,
                         (cfg.ori_width + cfg.width) / 2, (cfg.ori_height + cfg.height) / 2]         
-        assert Image.open(os.path.join(cfg.profile_path, self.profile[0])).size == \
-               (cfg.ori_width, cfg.ori_height)
+        
+        # Loader workers are forked here, before any session or thread is started
+        if cfg.loader_workers > 0:
+            crop_box = self.crop_box if cfg.crop else None
+            profile_list, front_list = self.train_lists()
+            self.train_loader = SharedLoader([(profile_list, True), (front_list, True)],
+                                             self.batch_size, crop_box, cfg.loader_ring, cfg.loader_workers,
+                                             self.cache_bytes)
+            self.test_loader = SharedLoader([(join_paths(cfg.test_path, self.test_list), False)],
+                                            self.batch_size, crop_box, cfg.loader_ring, cfg.loader_workers,
+                                            self.cache_bytes)
+            if cfg.sampler:
+                self.sample_loader = SharedLoader([(join_paths(cfg.profile_path, self.sample_list), True),
+                                                   (front_list, False)],
+                                                  self.batch_size, None, 1, cfg.loader_workers,
+                                                  self.cache_bytes, prefetch=False)
+            # Test images of loader batches not returned yet
+            self.test_pending = np.zeros((0, cfg.height, cfg.width, cfg.channel), np.uint8)
     
+    def train_lists(self):
+        """Paths of the profile and front lists of the input producers"""
+        return join_paths(cfg.profile_path, self.profile), join_paths(cfg.front_path, self.front)
+
     def get_train(self):
         """Get train images by Feeding
         
         Train images will be horizontal-flipped and center-cropped randomly.
+        The paths of the dequeued profiles are in 'self.train_names'.
+        
+        Pairs are shuffled within the batch queue, whose order depends on
+        the reader threads, so a run resumed from a cursor consumes about,
+        not exactly, the images an uninterrupted run would: images read
+        ahead of the cursor (up to the queue capacity, 32 batches) are read
+        again, and as many behind it are skipped. With '--exact_order' one
+        thread dequeues the pairs in list order, and resume is exact.
+        
+        With '--cache_mb', images are decoded by 'read_cached' through the
+        cache of the test reader, and only cropped and flipped in the graph.
         
         return:
             profile (tf.tensor): profile of identity A
             front (tf.tensor): front face of identity B
         """
         with tf.name_scope('data_feed'):
-            profile_list = [cfg.profile_path+'/'+img for img in self.profile]
-            front_list = [cfg.front_path+'/'+img for img in self.front]
-            profile_files = tf.train.string_input_producer(profile_list, shuffle=False) #
-            front_files = tf.train.string_input_producer(front_list, shuffle=False) #
-            
-            _, profile_value = tf.WholeFileReader().read(profile_files)
-            profile_value = tf.image.decode_jpeg(profile_value, channels=cfg.channel)
-            _, front_value = tf.WholeFileReader().read(front_files)
-            front_value = tf.image.decode_jpeg(front_value, channels=cfg.channel) 
+            # Lists are fed when the variables are initialized, the graph does not hold them
+            profile_list, front_list = self.train_lists()
+            profile_list = fed_variable(profile_list, 'profile_list', 'profile_list', tf.string, [None],
+                                        trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES])
+            front_list = fed_variable(front_list, 'front_list', 'front_list', tf.string, [None],
+                                      trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES])
+            profile_files = tf.train.string_input_producer(tf.reshape(profile_list, [-1]), shuffle=False) #
+            front_files = tf.train.string_input_producer(tf.reshape(front_list, [-1]), shuffle=False) #
             
-            # Flip and crop image
-            lf_profile_value = tf.image.random_flip_left_right(profile_value)
-            crop_profile_value = tf.random_crop(lf_profile_value, [cfg.height, cfg.width, cfg.channel])
-            # Args: [image, offset_height, offset_width, target_height, target_width]
-            crop_front_value = tf.image.crop_to_bounding_box(front_value, 
-                                                            (cfg.ori_height-cfg.height)/2, 
-                                                            (cfg.ori_width-cfg.width)/2, 
-                                                            cfg.height, cfg.width)
-            profile,front = tf.train.shuffle_batch([crop_profile_value,crop_front_value],
-                                                  batch_size=self.batch_size,
-                                                  num_threads=8,
-                                                  capacity=32 * self.batch_size,
-                                                  min_after_dequeue=self.batch_size * 16,
-                                                  allow_smaller_final_batch=False)
+            if self.cache is not None:
+                profile_name = profile_files.dequeue()
+                profile_value = tf.random_crop(self.read_cached(profile_name), [cfg.height, cfg.width, cfg.channel])
+                crop_profile_value = tf.image.random_flip_left_right(profile_value)
+                crop_front_value = tf.image.crop_to_bounding_box(self.read_cached(front_files.dequeue()),
+                                                                 (cfg.ori_height - cfg.height) // 2,
+                                                                 (cfg.ori_width - cfg.width) // 2,
+                                                                 cfg.height, cfg.width)
+            else:
+                # Decode only the crop, then flip (same distribution as flip then crop)
+                profile_name, profile_value = tf.WholeFileReader().read(profile_files)
+                crop_profile_value = tf.image.random_flip_left_right(decode_crop_jpeg(profile_value, True))
+                _, front_value = tf.WholeFileReader().read(front_files)
+                crop_front_value = decode_crop_jpeg(front_value, False)
+            if cfg.exact_order:
+                # One thread keeps the list order, the cursor then marks the next pair exactly
+                profile,front,self.train_names = tf.train.batch([crop_profile_value,crop_front_value,profile_name],
+                                                                batch_size=self.batch_size,
+                                                                num_threads=1,
+                                                                capacity=32 * self.batch_size,
+                                                                allow_smaller_final_batch=False)
+            else:
+                profile,front,self.train_names = tf.train.shuffle_batch([crop_profile_value,crop_front_value,profile_name],
+                                                                        batch_size=self.batch_size,
+                                                                        num_threads=8,
+                                                                        capacity=32 * self.batch_size,
+                                                                        min_after_dequeue=self.batch_size * 16,
+                                                                        allow_smaller_final_batch=False)
+            # Fill level of the batch queue, near zero when training waits for data
+            queue = tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS)[-1].queue
+            self.queue_fill = tf.divide(tf.cast(queue.size(), tf.float32), 32. * self.batch_size,
+                                        'queue_fill')
             return tf.cast(profile, tf.float32, 'profile'), tf.cast(front, tf.float32, 'front')
         
+    def read_cached(self, path):
+        """Decoded image of a path tensor, through the decoded image cache
+        
+        return:
+            uint8 tensor of shape (ori_height, ori_width, channel)
+        """
+        def read(path):
+            img, _ = cached_decode(self.cache, path if isinstance(path, str) else path.decode('utf-8'), False, None)
+            # The cache keeps its array, the graph gets a copy
+            return img.copy()
+        image = tf.py_func(read, [path], tf.uint8, name='read_cached')
+        image.set_shape([cfg.ori_height, cfg.ori_width, cfg.channel])
+        return image
+        
     def get_train_batch(self):
         """Get train images by preload
         
+        With '--loader_workers', images are decoded by a process pool and
+        returned as uint8 views of shared memory (valid until the next call).
+        
         return:
             trX: training profile images
             trY: training front images
         """
+        if cfg.loader_workers > 0:
+            return self.train_loader.get()
         trX = np.zeros((self.batch_size, cfg.height, cfg.width, cfg.channel), dtype=np.float32)
         trY = np.zeros((self.batch_size, cfg.height, cfg.width, cfg.channel), dtype=np.float32)
         for i in range(self.batch_size):
@@ -95,6 +230,33 @@ class loadData(object):
         self.train_index += self.batch_size
         return trX, trY
         
+    def get_train_pairs(self, indices):
+        """Get the profiles at 'indices' of the profile list, with random fronts
+        
+        Augmented as in 'get_train': profiles are cropped at a random offset
+        and flipped at random, fronts are center-cropped. With
+        '--loader_workers' images are decoded by the sampler loader (batches
+        of 'batch_size', uint8 views valid until the next call), otherwise in
+        the calling thread, through the decoded image cache.
+        
+        args:
+            indices: positions in the profile list (before shuffling)
+        return:
+            trX: training profile images
+            trY: training front images
+        """
+        fronts = np.random.randint(len(self.front), size=len(indices))
+        profile_boxes = [random_crop_box() for index in indices]
+        if self.sample_loader is not None:
+            return self.sample_loader.get_items([indices, fronts], [profile_boxes, [self.crop_box] * len(indices)])
+        trX = np.zeros((len(indices), cfg.height, cfg.width, cfg.channel), dtype=np.float32)
+        trY = np.zeros((len(indices), cfg.height, cfg.width, cfg.channel), dtype=np.float32)
+        for i, index in enumerate(indices):
+            trX[i] = cached_decode(self.cache, cfg.profile_path+'/'+self.sample_list[index],
+                                   np.random.random() > 0.5, profile_boxes[i])[0]
+            trY[i] = cached_decode(self.cache, cfg.front_path+'/'+self.front[fronts[i]], False, self.crop_box)[0]
+        return trX, trY
+        
     def get_test_batch(self, batch_size = cfg.batch_size):
         """Get test images by batch
         
@@ -104,6 +266,18 @@ class loadData(object):
             teX: testing profile images
             teY: testing front images, same as profile images
         """
+        if cfg.loader_workers > 0:
+            if batch_size == self.test_loader.batch_size and len(self.test_pending) == 0:
+                teX, = self.test_loader.get()
+            else:
+                # Loader batches are consecutive, batches of other sizes are cut from them
+                while len(self.test_pending) < batch_size:
+                    batch, = self.test_loader.get()
+                    self.test_pending = np.concatenate([self.test_pending, batch])
+                teX, self.test_pending = self.test_pending[:batch_size], self.test_pending[batch_size:]
+            # Negative indices of 'save_images' wrap around the list
+            self.test_index = (self.test_index + batch_size) % len(self.test_list)
+            return teX, teX
         teX = np.zeros((batch_size, cfg.height, cfg.width, cfg.channel), dtype=np.float32)
         teY = np.zeros((batch_size, cfg.height, cfg.width, cfg.channel), dtype=np.float32)
         for i in range(batch_size):
@@ -129,17 +303,22 @@ class loadData(object):
         return:
             img: data matrix from image
         """
-        img = Image.open(img)
-        if(img.mode=='L' and cfg.channel == 3):
-            img = img.convert('RGB')
-        if flip and np.random.random() > 0.5:
-            img = img.transpose(Image.FLIP_LEFT_RIGHT)
-        if cfg.crop:
-            img = img.crop(self.crop_box)
-        img = np.array(img, dtype=np.float32)
-        if(cfg.channel == 1):
-            img = np.expand_dims(img, axis=2)
-        return img
+        img, _ = cached_decode(self.cache, img, flip and np.random.random() > 0.5,
+                               self.crop_box if cfg.crop else None)
+        return img.astype(np.float32)
+    
+    def cache_stats(self):
+        """Hit statistics of the decoded image caches (main thread and loader workers)
+        
+        'decode_failures' counts the images the loader workers replaced by black ones.
+        """
+        hits, misses, failures = 0, 0, 0
+        for cache in [self.cache, self.train_loader, self.test_loader, self.sample_loader]:
+            if cache is not None:
+                hits += cache.hits
+                misses += cache.misses
+                failures += getattr(cache, 'failures', 0)
+        return cache_stats(hits, misses, failures)
         
     def save_images(self, imgs, epoch=0):
         """Save images
@@ -184,42 +363,34 @@ if __name__ == '__main__':
         """
         label images with label/session/pose/illuminatio/express
         """
+        import pandas as pd
         l = np.loadtxt('images.txt',dtype='string')
         l = pd.DataFrame(l,columns=['name'])
-        l['label'] = 1; l['exp'] = 1; l['pose'] = '051'; l['ill'] = '07'; l['sess'] = '01'
-        for i in range(l.shape[0]):
-            name = l.iloc[i,0]
-            l.iloc[i,1] = int(name[:3])
-            l.iloc[i,2] = int(name[7:9])
-            l.iloc[i,3] = name[10:13]
-            l.iloc[i,4] = name[14:16]
-            l.iloc[i,5] = name[4:6]  
-        l.to_csv('session01.csv',index=false)
+        name = l['name'].str
+        l['label'] = name[:3].astype(int); l['exp'] = name[7:9].astype(int)
+        l['pose'] = name[10:13]; l['ill'] = name[14:16]; l['sess'] = name[4:6]
+        l.to_csv('session01.csv',index=False)
         
     def f2():
         """
         divide into train set and test set according to setting 1 of MIPE
         """
+        import pandas as pd
         #images = pd.read_csv('session01.csv',dtype='string')
         images = pd.read_csv('session01.csv')
         images = images[images.exp == 1]
         train = images[images.label < 101]
         pose_set1 = [80,130,140,51,50,41,190]
-        with open('setting1_train.txt', 'w') as f:
-            for pose in pose_set1:
-                train_pose = train[train.pose == pose]
-                for name in train_pose.name.values:
-                    f.write(name+',')
-                    f.write(name[:10]+'051_07.jpg\n')
-                    f.flush()
+        
+        def write_pairs(path, images):
+            # Pairs of (image, frontal image of the same session) in the order of pose_set1
+            images = pd.concat([images[images.pose == pose] for pose in pose_set1])
+            pairs = images.name + ',' + images.name.str[:10] + '051_07.jpg'
+            with open(path, 'w') as f:
+                f.write(''.join(pair + '\n' for pair in pairs.values))
+        write_pairs('setting1_train.txt', train)
         test = images[images.label > 100]
-        with open('setting1_test.txt', 'w') as f:
-            for pose in pose_set1:
-                test_pose = test[test.pose == pose]
-                for name in test_pose.name.values:
-                    f.write(name+',')
-                    f.write(name[:10]+'051_07.jpg\n')
-                    f.flush()    
+        write_pairs('setting1_test.txt', test)
     
     def f2():
         """
@@ -231,8 +402,9 @@ if __name__ == '__main__':
             
     def f3():
         """
-        extract image features by VGG-FACE
+        extract image features by VGG-FACE (see extract.py for Resnet50 features)
         """
+        import struct
         def read_img(img):
             img = Image.open(os.path.join('/home/prisVideos/session01_align', img))
             img = img.crop((13,13,237,237))
@@ -249,7 +421,7 @@ if __name__ == '__main__':
         profile = tf.placeholder("float", [None, 224, 224, 3])
         fc7_encoder = vgg.forward(profile)
         sess = tf.InteractiveSession()
-        sess.run(tf.global_variables_initializer())
+        initialize(sess)
         batch = 10
         images = np.loadtxt('mpie/session01_train.txt', dtype='string', delimiter=',')
         with open('mpie/session01_test3_feature', 'wb') as f: